@@ -9,6 +9,16 @@ const api = axios.create({
   }
 })
 
+// 容器告警检查解析的 node_exporter 指标族（见 AlertListView 的 parseNodeExporterMetrics）
+const CONTAINER_METRIC_FAMILIES = [
+  'node_cpu_seconds_total',
+  'node_memory_*',
+  'node_filesystem_size_bytes',
+  'node_filesystem_free_bytes',
+  'node_network_receive_bytes_total',
+  'node_network_transmit_bytes_total'
+]
+
 // 请求拦截器 - 添加token和日志
 api.interceptors.request.use(config => {
   const token = localStorage.getItem('token')
@@ -232,33 +242,39 @@ const dashboardApi = {
       .then(response => response.data)
   },
 
-  // 获取租赁信息
-  getRentals() {
-    return api.get('/rentals/all')
-      .then(response => {
-        console.log('API getRentals response:', response)
-        if (response.data) {
-          // 确保每个租赁对象都包含用户信息
-          const rentals = response.data.rentals || response.data
-          return {
-            success: true,
-            rentals: rentals.map(rental => ({
-              ...rental,
-              // 确保用户信息存在
-              user_info: rental.user_info || {
-                email: rental.user_email || rental.email,
-                username: rental.username
-              }
-            })),
-            message: response.data.message || '获取成功'
+  // 获取一页租赁信息：服务端按 id 倒序键集分页，返回 next_cursor，下一页时原样传回 cursor
+  // params 可传过滤条件和分页参数，如 { status: 'active', end_before: '2025-03-01T00:00:00', limit: 10, cursor }
+  async getRentals(params = {}) {
+    try {
+      const response = await api.get('/rentals/all', { params })
+      if (!response || !response.success) return response
+
+      return {
+        success: true,
+        // 确保每个租赁对象都包含用户信息
+        rentals: (response.data || []).map(rental => ({
+          ...rental,
+          user_info: rental.user_info || {
+            email: rental.user_email || rental.email,
+            username: rental.username
           }
-        }
-        return response
-      })
-      .catch(error => {
-        console.error('API getRentals error:', error)
-        throw error
-      })
+        })),
+        next_cursor: response.next_cursor,
+        message: '获取成功'
+      }
+    } catch (error) {
+      console.error('API getRentals error:', error)
+      throw error
+    }
+  },
+
+  // 导出租赁信息：format=ndjson 时服务端不分页，流式返回全部匹配记录（每行一条 JSON），返回原始文本
+  exportRentals(params = {}) {
+    return api.get('/rentals/all', {
+      params: { ...params, format: 'ndjson' },
+      responseType: 'text',
+      timeout: 0
+    })
   },
 
   // 获取收入统计
@@ -349,9 +365,10 @@ export const alarmRuleApi = {
 // 修改原有的告警相关 API
 const alertApi = {
   // 获取告警列表
-  getAlerts: () => {
+  getAlerts: (params = {}) => {
     console.log('开始获取告警列表...')
-    return api.get('/alerts')
+    // 告警列表按创建时间倒序分页，默认取最近 500 条，更多数据通过 next_cursor 翻页
+    return api.get('/alerts', { params: { limit: 500, ...params } })
       .then(response => {
         console.log('原始告警响应:', response)
         
@@ -420,6 +437,7 @@ const alertApi = {
       message: data.message || '系统告警',
       severity: 'high', // 枚举值: 'low', 'medium', 'high', 'critical'
       status: 'active', // 枚举值: 'active', 'acknowledged', 'resolved'
+      source: data.source, // 告警来源（容器名），后端按来源去重
       details: JSON.stringify({timestamp: new Date().toISOString().substring(0, 19)})
     }
     
@@ -590,7 +608,12 @@ const containerApi = {
   getContainerMetrics: (containerName, port) => {
     console.log('开始获取容器监控数据:', containerName)
     // 使用后端代理路由获取监控数据，包含端口参数
-    return api.get(`/proxy/metrics/${encodeURIComponent(containerName)}?port=${port}`, {
+    return api.get(`/proxy/metrics/${encodeURIComponent(containerName)}`, {
+      // 只请求告警检查用到的指标族，避免传输完整的 exporter 输出
+      params: {
+        port,
+        match: CONTAINER_METRIC_FAMILIES  // axios 序列化为 match[]=...&match[]=...
+      },
       headers: {
         'Accept': 'text/plain,*/*'  // 接受纯文本响应
       }
@@ -0,0 +1,41 @@
+// 实时事件流（SSE）：告警状态变化与容器流量增量由服务端推送，替代定时轮询
+// 浏览器断线后自动重连，并携带 Last-Event-ID 从上次收到的事件之后继续推送
+
+/**
+ * 打开实时事件流
+ * @param {Object} options
+ * @param {string[]} options.types 事件类型：alert、traffic
+ * @param {Array} options.serverIds 只接收这些服务器的事件
+ * @param {Array} options.containerIds 只接收这些容器的流量事件
+ * @param {Function} options.onEvent (type, data) => void
+ * @param {Function} options.onReset 落后太多、事件已过期时调用，应重新拉取一次全量数据
+ * @returns {Function} 关闭事件流的函数
+ */
+export function openEventStream({ types = [], serverIds = [], containerIds = [], onEvent, onReset } = {}) {
+  const params = new URLSearchParams()
+  if (types.length) params.set('types', types.join(','))
+  if (serverIds.length) params.set('server_id', serverIds.join(','))
+  if (containerIds.length) params.set('container_id', containerIds.join(','))
+
+  // EventSource 无法设置 Authorization 请求头，通过查询参数传递 token
+  const token = localStorage.getItem('token')
+  if (token) params.set('jwt', token)
+
+  const source = new EventSource(`/api/events/stream?${params.toString()}`)
+
+  const eventTypes = types.length ? types : ['alert', 'traffic']
+  eventTypes.forEach(type => {
+    source.addEventListener(type, event => {
+      try {
+        onEvent?.(type, JSON.parse(event.data))
+      } catch (error) {
+        console.error('解析实时事件失败:', error)
+      }
+    })
+  })
+  source.addEventListener('reset', () => onReset?.())
+
+  return () => source.close()
+}
+
+export default openEventStream
@@ -6,8 +6,6 @@ from flask_mail import Mail
 from flask_migrate import Migrate
 from celery import Celery
 from app.config import Config
-import logging
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 import os
 from flask_jwt_extended import JWTManager
@@ -24,15 +22,11 @@ celery = None
 
 
 def setup_logging(app):
-    """设置日志记录"""
-    log_file = app.config['LOG_FILE']
-    handler = RotatingFileHandler(log_file, maxBytes=100000000, backupCount=3)
-    handler.setLevel(logging.INFO)  # 设置日志级别
-    formatter = logging.Formatter(
-        "[%(asctime)s] %(levelname)s in %(module)s: %(message)s"
-    )
-    handler.setFormatter(formatter)
-    app.logger.addHandler(handler)
+    """设置日志记录：全进程共用的非阻塞 JSON 日志（见 app.utils.log_config），并记录每个请求的 request_id 和耗时"""
+    from app.utils.log_config import configure_logging, register_request_logging
+
+    configure_logging(app.config)
+    register_request_logging(app)
 
 
 def make_celery(app):
@@ -42,9 +36,31 @@ def make_celery(app):
     celery_instance = Celery(
         app.import_name,
         backend=app.config['CELERY_RESULT_BACKEND'],
-        broker=app.config['CELERY_BROKER_URL']
+        broker=app.config['CELERY_BROKER_URL'],
+        include=['app.utils.notification_queue', 'app.utils.notification_digest', 'app.utils.finance_aggregates',
+                 'app.utils.commission_settlement', 'app.utils.monitoring_utils', 'app.utils.traffic_utils']
     )
     celery_instance.conf.update(app.config)
+
+    # 周期任务，由 celery beat 调度（celery -A app.celery beat）；配置沿用旧式 CELERY* 键名，不能与新键名混用
+    celery_instance.conf.update(CELERYBEAT_SCHEDULE={
+        "collect-server-health": {
+            "task": "monitoring.collect_server_health",
+            "schedule": app.config['MONITORING_INTERVAL']
+        },
+        "collect-realtime-traffic": {
+            "task": "traffic.collect_realtime",
+            "schedule": app.config['TRAFFIC_PUSH_INTERVAL']
+        },
+    })
+
+    class ContextTask(celery_instance.Task):
+        # 任务在应用上下文中执行，可以直接使用 db、mail 等插件
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    celery_instance.Task = ContextTask
     return celery_instance
 
 
@@ -75,6 +91,18 @@ def create_app(config_class=Config):
         global celery
         celery = make_celery(app)
 
+        # 租赁、序列号、容器的截止时间变更在提交后同步到到期调度器
+        from app.utils.expiry_scheduler import register_expiry_tracking
+        register_expiry_tracking()
+
+        # 租赁、ACL 配置、设备绑定的服务器/容器 ID 在 flush 时同步到依赖索引表
+        from app.utils.resource_index import register_resource_index
+        register_resource_index()
+
+        # 发票支付和佣金记录在 flush 时同步到财务汇总
+        from app.utils.finance_aggregates import register_finance_tracking
+        register_finance_tracking()
+
     except Exception as e:
         app.logger.error(f"Initialization error: {e}")
         raise
@@ -95,6 +123,7 @@ def create_app(config_class=Config):
     from app.routes.monitoring_routes import monitoring_bp  # 新增：监控模块
     from app.routes.serial_routes import serial_bp  # 新增：序列号管理模块
     from app.routes.security_routes import security_bp  # 新增：安全与设备绑定模块
+    from app.routes.events_routes import events_bp  # 实时事件推送（SSE）
     from app.utils.user_history import user_history_bp  # 从 utils 导入 user_history 蓝图
 
     # 新增：注册 system_bp 蓝图
@@ -117,6 +146,7 @@ def create_app(config_class=Config):
     app.register_blueprint(monitoring_bp, url_prefix='')  # 新增：监控模块
     app.register_blueprint(serial_bp, url_prefix='')  # 新增：序列号管理模块
     app.register_blueprint(security_bp, url_prefix='')  # 新增：安全与设备绑定模块
+    app.register_blueprint(events_bp)  # 实时事件推送，url_prefix 在蓝图定义时已设置
     app.register_blueprint(user_history_bp, url_prefix='')  # 注册 user_history 蓝图
 
     app.logger.info("App successfully created and initialized.")
@@ -38,26 +38,116 @@ class Config:
     # Redis 配置
     REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+    REDIS_DB = int(os.getenv('REDIS_DB', 0))
+    REDIS_PASSWORD = os.getenv('REDIS_PASSWORD') or None
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 100))  # 每个进程的连接池上限
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 30))  # 读写超时（秒），需大于 EVENT_STREAM_BLOCK_MS
+    REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 2))  # 连接超时（秒）
+    REDIS_STREAM_MAX_CONNECTIONS = int(os.getenv('REDIS_STREAM_MAX_CONNECTIONS', 200))  # 每个进程阻塞读取事件流（SSE）的连接池上限，即最大 SSE 连接数
 
     # Celery 配置（如果需要使用 Celery 进行异步任务处理）
     CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', f"redis://{REDIS_HOST}:{REDIS_PORT}/0")
     CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', f"redis://{REDIS_HOST}:{REDIS_PORT}/0")
 
+    # 邮件发送队列配置
+    EMAIL_QUEUE_KEY = os.getenv('EMAIL_QUEUE_KEY', 'notifications:email')  # 待发送邮件的 Redis 列表键名
+    EMAIL_FLUSH_DELAY = float(os.getenv('EMAIL_FLUSH_DELAY', 2))  # 入队后等待多久再批量发送（秒），用于积累批次
+    EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 200))  # 每次从队列取出的邮件数
+    EMAIL_MESSAGES_PER_CONNECTION = int(os.getenv('EMAIL_MESSAGES_PER_CONNECTION', 50))  # 每个 SMTP 连接最多发送的邮件数
+    EMAIL_MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', 5))  # 发送失败的最大重试次数
+    EMAIL_RETRY_BACKOFF = int(os.getenv('EMAIL_RETRY_BACKOFF', 30))  # 首次重试等待时间（秒），之后每次翻倍
+    NOTIFICATION_DIGEST_WINDOW = int(os.getenv('NOTIFICATION_DIGEST_WINDOW', 300))  # 管理员通知汇总窗口（秒），窗口内的通知合并为一封邮件
+    NOTIFICATION_DIGEST_URGENT_DELAY = int(os.getenv('NOTIFICATION_DIGEST_URGENT_DELAY', 10))  # critical 通知提前发送前的等待时间（秒），合并同一波故障
+    NOTIFICATION_DIGEST_MAX_ITEMS = int(os.getenv('NOTIFICATION_DIGEST_MAX_ITEMS', 200))  # 缓冲达到该条数时提前发送
+
     # 日志级别配置（根据需求进行动态调整）
-    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # 默认日志级别为 INFO
-    LOG_FILE = os.getenv('LOG_FILE', 'app.log')  # 可以在 .env 文件中指定日志文件路径
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # 默认日志级别为 INFO，可按模块设置，如 "INFO,app.utils.auth_utils=WARNING"
+    LOG_FILE = os.getenv('LOG_FILE', 'app.log')  # 可以在 .env 文件中指定日志文件路径，为空时不写文件
+    LOG_FILE_MAX_BYTES = int(os.getenv('LOG_FILE_MAX_BYTES', 100000000))  # 日志文件轮转大小（字节）
+    LOG_FILE_BACKUP_COUNT = int(os.getenv('LOG_FILE_BACKUP_COUNT', 3))  # 保留的轮转文件数
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json 或 text
+    LOG_CONSOLE = os.getenv('LOG_CONSOLE', 'true').lower() == 'true'  # 是否同时输出到控制台
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # 日志队列最大记录数，队列满时丢弃
+    LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', 100))  # 每个调用位置每个采样窗口最多输出的 DEBUG/INFO 记录数，0 表示不采样
+    LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', 10))  # 采样窗口（秒）
 
     # JWT 配置
     JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', 24))  # 默认设置为24小时
 
     # 监控配置
-    MONITORING_INTERVAL = int(os.getenv('MONITORING_INTERVAL', 60))  # 监控日志收集时间间隔（秒）
+    MONITORING_INTERVAL = int(os.getenv('MONITORING_INTERVAL', 60))  # 监控日志收集时间间隔（秒），也是健康指标采集任务的调度间隔
+    MONITORING_SSH_USER = os.getenv('MONITORING_SSH_USER', 'root')  # 采集健康指标时登录服务器的 SSH 用户
+    MONITORING_SSH_PASSWORD = os.getenv('MONITORING_SSH_PASSWORD') or None  # SSH 密码，为空时使用 SSH agent / 默认密钥
+    MONITORING_SSH_TIMEOUT = float(os.getenv('MONITORING_SSH_TIMEOUT', 10))  # 单台服务器健康检查超时时间（秒）
+    MONITORING_SSH_CONCURRENCY = int(os.getenv('MONITORING_SSH_CONCURRENCY', 32))  # 同时进行的 SSH 健康检查数
     ALERT_THRESHOLD = float(os.getenv('ALERT_THRESHOLD', 0.5))  # 告警阈值：Ping 时延（毫秒）
+    ALERT_RULE_REFRESH_INTERVAL = int(os.getenv('ALERT_RULE_REFRESH_INTERVAL', 30))  # 检查告警规则是否变更的间隔（秒）
+    ALERT_FLUSH_BATCH_SIZE = int(os.getenv('ALERT_FLUSH_BATCH_SIZE', 500))  # 告警记录批量写入的条数
+    ALERT_RAISE_AFTER = int(os.getenv('ALERT_RAISE_AFTER', 1))  # 连续异常多少次才产生告警
+    ALERT_CLEAR_AFTER = int(os.getenv('ALERT_CLEAR_AFTER', 3))  # 连续恢复多少次才解除告警
+    ALERT_FLAP_WINDOW = int(os.getenv('ALERT_FLAP_WINDOW', 3600))  # 抖动检测时间窗口（秒）
+    ALERT_FLAP_THRESHOLD = int(os.getenv('ALERT_FLAP_THRESHOLD', 4))  # 窗口内状态切换达到该次数视为抖动
+    ALERT_SETTINGS_CACHE_TTL = int(os.getenv('ALERT_SETTINGS_CACHE_TTL', 60))  # 告警设置进程内缓存时间（秒）
+
+    # 服务器可达性探测配置
+    PROBE_COUNT = int(os.getenv('PROBE_COUNT', 4))  # 每台服务器的探测包数量
+    PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', 2.0))  # 单次探测超时时间（秒）
+    PROBE_CONCURRENCY = int(os.getenv('PROBE_CONCURRENCY', 100))  # 最大并发探测数
+    DERP_PORT = int(os.getenv('DERP_PORT', 443))  # ICMP 不可用时 TCP 探测的默认 DERP 端口
+
+    # 实时事件推送（SSE）配置
+    EVENT_STREAM_KEY = os.getenv('EVENT_STREAM_KEY', 'events:stream')  # 保存事件的 Redis Stream 键名
+    EVENT_STREAM_MAXLEN = int(os.getenv('EVENT_STREAM_MAXLEN', 10000))  # Stream 保留的最近事件数（断线续传窗口）
+    EVENT_STREAM_BLOCK_MS = int(os.getenv('EVENT_STREAM_BLOCK_MS', 15000))  # 每次阻塞等待新事件的时间（毫秒），超时发送心跳
+    EVENT_STREAM_BATCH_SIZE = int(os.getenv('EVENT_STREAM_BATCH_SIZE', 100))  # 每次最多读取的事件数
+    EVENT_STREAM_MAX_SECONDS = int(os.getenv('EVENT_STREAM_MAX_SECONDS', 300))  # 单个连接的最长时间（秒），到期后由客户端自动重连
 
     # 流量监控配置
     TRAFFIC_MONITORING_INTERVAL = int(os.getenv('TRAFFIC_MONITORING_INTERVAL', 3600))  # 流量统计更新间隔（秒）
     MAX_UPLOAD_TRAFFIC = int(os.getenv('MAX_UPLOAD_TRAFFIC', 1000))  # 最大上传流量（MB）
     MAX_DOWNLOAD_TRAFFIC = int(os.getenv('MAX_DOWNLOAD_TRAFFIC', 1000))  # 最大下载流量（MB）
+    TRAFFIC_COLLECT_CONCURRENCY = int(os.getenv('TRAFFIC_COLLECT_CONCURRENCY', 32))  # 实时流量采集的最大并发抓取数
+    TRAFFIC_PUSH_INTERVAL = int(os.getenv('TRAFFIC_PUSH_INTERVAL', 15))  # 实时流量采集并推送 traffic 事件的调度间隔（秒）
+
+    # 租赁到期处理配置
+    RENTAL_EXPIRY_BATCH_SIZE = int(os.getenv('RENTAL_EXPIRY_BATCH_SIZE', 500))  # 每批处理的到期租赁数，每批单独提交
+    EXPIRY_SCHEDULER_BATCH_SIZE = int(os.getenv('EXPIRY_SCHEDULER_BATCH_SIZE', 500))  # 到期调度器每批处理的条目数
+    EXPIRY_SCHEDULER_MAX_SLEEP = float(os.getenv('EXPIRY_SCHEDULER_MAX_SLEEP', 20))  # 调度器单次最长等待时间（秒），需小于 REDIS_SOCKET_TIMEOUT
+    EXPIRY_SCHEDULER_RETRY_DELAY = float(os.getenv('EXPIRY_SCHEDULER_RETRY_DELAY', 5))  # 到期条目被其他事务锁定而跳过时，延后重试的时间（秒）
+
+    # 序列号批量生成与查询配置
+    SERIAL_GENERATE_BATCH_SIZE = int(os.getenv('SERIAL_GENERATE_BATCH_SIZE', 5000))  # 每批生成、检查并写入的序列号数，每批单独提交
+    SERIAL_GENERATE_MAX_COUNT = int(os.getenv('SERIAL_GENERATE_MAX_COUNT', 100000))  # 单次请求最多生成的序列号数
+    SERIAL_BLOOM_ERROR_RATE = float(os.getenv('SERIAL_BLOOM_ERROR_RATE', 0.001))  # 序列号布隆过滤器的误判率
+    SERIAL_BLOOM_MIN_CAPACITY = int(os.getenv('SERIAL_BLOOM_MIN_CAPACITY', 100000))  # 布隆过滤器的最小容量（序列号数）
+    SERIAL_BLOOM_MAX_AGE = int(os.getenv('SERIAL_BLOOM_MAX_AGE', 3600))  # 布隆过滤器最长使用时间（秒），到期后从数据库重建
+    SERIAL_STATUS_CACHE_TTL = int(os.getenv('SERIAL_STATUS_CACHE_TTL', 10))  # 序列号状态进程内缓存时间（秒）
+    SERIAL_STATUS_CACHE_SIZE = int(os.getenv('SERIAL_STATUS_CACHE_SIZE', 10000))  # 序列号状态缓存的最大条目数
+
+    # 限流配置（滑动窗口），格式为 "次数/秒数"
+    RATE_LIMIT_SERIAL_CHECK = os.getenv('RATE_LIMIT_SERIAL_CHECK', '30/60')  # 每个 IP 查询序列号的次数
+    RATE_LIMIT_SERIAL_CHECK_FAILURES = os.getenv('RATE_LIMIT_SERIAL_CHECK_FAILURES', '5/300')  # 每个 IP 查询不存在序列号的次数，达到后暂时禁止
+    RATE_LIMIT_SERIAL_PREFIX_FAILURES = os.getenv('RATE_LIMIT_SERIAL_PREFIX_FAILURES', '1000/60')  # 同一序列号前缀（前三位）的失败查询次数，所有 IP 合计，只对窗口内已有失败记录的 IP 生效
+    RATE_LIMIT_LOGIN = os.getenv('RATE_LIMIT_LOGIN', '20/60')  # 每个 IP 的登录请求次数
+    RATE_LIMIT_LOGIN_FAILURES = os.getenv('RATE_LIMIT_LOGIN_FAILURES', '5/900')  # 每个账号的登录失败次数，达到后暂时禁止登录
+    RATE_LIMIT_VERIFICATION_EMAIL = os.getenv('RATE_LIMIT_VERIFICATION_EMAIL', '1/60')  # 每个邮箱发送验证码的次数
+    RATE_LIMIT_VERIFICATION_EMAIL_IP = os.getenv('RATE_LIMIT_VERIFICATION_EMAIL_IP', '10/3600')  # 每个 IP 发送验证码的次数
+    RATE_LIMIT_VERIFICATION_CODE_FAILURES = os.getenv('RATE_LIMIT_VERIFICATION_CODE_FAILURES', '5/600')  # 每个邮箱验证码输错的次数，达到后暂时禁止注册
+
+    # 审计日志（log_operation）配置
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))  # 内存队列最大记录数，队列满时等待 AUDIT_ENQUEUE_TIMEOUT 秒后丢弃新记录
+    AUDIT_ENQUEUE_TIMEOUT = float(os.getenv('AUDIT_ENQUEUE_TIMEOUT', 0.25))  # 队列满时单条记录最长等待入队的时间（秒）
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 500))  # 每批写入的最大记录数
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))  # 记录在队列中最长等待多久写入（秒）
+
+    # 财务汇总配置
+    FINANCE_RECONCILE_DAYS = int(os.getenv('FINANCE_RECONCILE_DAYS', 7))  # 对账任务检查的天数（向前对齐到月初）
+
+    # exporter 指标代理配置
+    METRICS_PROXY_CACHE_TTL = float(os.getenv('METRICS_PROXY_CACHE_TTL', 5))  # exporter 响应缓存时间（秒），多个客户端共享
+    METRICS_PROXY_TIMEOUT = float(os.getenv('METRICS_PROXY_TIMEOUT', 5))  # 请求 exporter 的超时时间（秒）
+    METRICS_PROXY_POOL_SIZE = int(os.getenv('METRICS_PROXY_POOL_SIZE', 4))  # 每个 exporter 保持的 keep-alive 连接数
+    METRICS_PROXY_MAX_EXPORTERS = int(os.getenv('METRICS_PROXY_MAX_EXPORTERS', 256))  # 同时保持连接池的 exporter 数量
 
     # 配置 MySQL 默认字符集，确保支持 emoji 和特殊字符
     SQLALCHEMY_ENGINE_OPTIONS = {
@@ -5,7 +5,7 @@ from sqlalchemy import Text
 from datetime import timedelta
 from datetime import datetime
 import re
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Enum, ForeignKey, DECIMAL, JSON, UniqueConstraint, ForeignKeyConstraint, Index
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Enum, ForeignKey, DECIMAL, JSON, Float, UniqueConstraint, ForeignKeyConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -17,6 +17,37 @@ user_server_association = db.Table(
     db.UniqueConstraint('user_id', 'server_id', name='uq_user_server')  # 定义唯一约束
 )
 
+# 租赁、ACL 配置、设备绑定与服务器/容器的索引表
+# 与 JSON 字段 server_ids / container_ids 同步维护（见 app.utils.resource_index），
+# 用于按服务器或容器反查依赖它的记录；服务器/容器一侧不加外键，与 JSON 中的 ID 保持一致
+rental_servers = db.Table(
+    'rental_servers',
+    db.Column('rental_id', db.Integer, db.ForeignKey('rentals.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('server_id', db.Integer, primary_key=True),
+    db.Index('idx_rental_servers_server', 'server_id')
+)
+
+rental_containers = db.Table(
+    'rental_containers',
+    db.Column('rental_id', db.Integer, db.ForeignKey('rentals.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('container_id', db.Integer, primary_key=True),
+    db.Index('idx_rental_containers_container', 'container_id')
+)
+
+acl_config_servers = db.Table(
+    'acl_config_servers',
+    db.Column('acl_config_id', db.Integer, db.ForeignKey('acl_configs.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('server_id', db.Integer, primary_key=True),
+    db.Index('idx_acl_config_servers_server', 'server_id')
+)
+
+device_binding_containers = db.Table(
+    'device_binding_containers',
+    db.Column('device_binding_id', db.Integer, db.ForeignKey('device_bindings.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('container_id', db.Integer, primary_key=True),
+    db.Index('idx_device_binding_containers_container', 'container_id')
+)
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -120,6 +151,10 @@ class Rental(db.Model):
     
     user = db.relationship("User", back_populates="rentals")
 
+    __table_args__ = (
+        Index('idx_rental_status_end', 'status', 'end_date'),  # 到期扫描
+    )
+
 class RenewalNotification(db.Model):
     __tablename__ = 'renewal_notifications'
 
@@ -887,6 +922,8 @@ class CommissionRecord(db.Model):
     id = Column(Integer, primary_key=True, autoincrement=True)
     distributor_id = Column(Integer, ForeignKey('distributors.id'))
     serial_number_id = Column(Integer, ForeignKey('distributor_serials.id'))
+    invoice_id = Column(Integer, ForeignKey('invoices.id'))  # 结算引擎计算佣金的发票，每张发票最多一条佣金记录
+    period = Column(String(7))  # 结算周期（YYYY-MM）
     commission_amount = Column(DECIMAL(10, 2))
     status = Column(Enum('pending', 'paid', name='commission_status'), default='pending')
     payment_date = Column(DateTime)
@@ -894,11 +931,14 @@ class CommissionRecord(db.Model):
 
     distributor = relationship("Distributor")
     serial_number = relationship("DistributorSerial")
+    invoice = relationship("Invoice")
 
     __table_args__ = (
+        UniqueConstraint('invoice_id', name='uq_commission_invoice'),
         Index('idx_commission_distributor', 'distributor_id'),
         Index('idx_commission_serial', 'serial_number_id'),
         Index('idx_commission_status', 'status'),
+        Index('idx_commission_period', 'period', 'status'),
     )
 
 
@@ -916,6 +956,8 @@ class FinanceSettlement(db.Model):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     distributor_id = Column(Integer, ForeignKey('distributors.id'))
+    period = Column(String(7))  # 结算周期（YYYY-MM）
+    commission_count = Column(Integer, default=0)  # 本周期的佣金记录数
     settlement_amount = Column(DECIMAL(10, 2))
     status = Column(Enum('pending', 'paid', 'cancelled', name='settlement_status'), default='pending')
     settled_at = Column(DateTime)
@@ -924,11 +966,37 @@ class FinanceSettlement(db.Model):
     distributor = relationship("Distributor")
 
     __table_args__ = (
+        UniqueConstraint('distributor_id', 'period', name='uq_settlement_distributor_period'),
         Index('idx_settlement_distributor', 'distributor_id'),
         Index('idx_settlement_status', 'status'),
     )
 
 
+class FinanceAggregate(db.Model):
+    """
+    财务汇总：按 用户 / 分销商 / 分销商等级 与 日 / 月 预先汇总的收入数据
+    在兑换序列号、发票支付、创建佣金记录的同一事务中增量更新（见 app.utils.finance_aggregates）
+    """
+    __tablename__ = 'finance_aggregates'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    scope = Column(Enum('user', 'distributor', 'level', name='finance_aggregate_scope'), nullable=False)
+    scope_key = Column(String(64), nullable=False)  # 用户 ID、分销商 ID 或分销商等级（Distributor.role）
+    period = Column(Enum('day', 'month', name='finance_aggregate_period'), nullable=False)
+    period_start = Column(db.Date, nullable=False)  # 日汇总为当天，月汇总为当月 1 日（UTC）
+    serial_count = Column(Integer, nullable=False, default=0)  # 兑换的序列号数量
+    serial_days = Column(Integer, nullable=False, default=0)  # 兑换的序列号天数合计
+    invoice_count = Column(Integer, nullable=False, default=0)  # 已支付发票数量
+    invoice_amount = Column(DECIMAL(14, 2), nullable=False, default=0)  # 已支付发票金额
+    commission_amount = Column(DECIMAL(14, 2), nullable=False, default=0)  # 佣金金额
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('scope', 'scope_key', 'period', 'period_start', name='uq_finance_aggregate'),
+        Index('idx_finance_aggregate_period', 'scope', 'period', 'period_start'),
+    )
+
+
 class ContainerManagementLog(db.Model):
     __tablename__ = 'container_management_logs'
     
@@ -1128,6 +1196,33 @@ class MonitoringLog(db.Model):
     )
 
 
+class MetricDefinition(db.Model):
+    __tablename__ = 'metric_definitions'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(64), unique=True, nullable=False)  # 指标名，如 cpu_usage
+    unit = Column(String(32))  # 单位，如 %、ms、bytes
+    description = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ServerMetric(db.Model):
+    __tablename__ = 'server_metrics'
+
+    # 复合主键即 InnoDB 聚簇索引：同一服务器同一指标的样本按时间顺序连续存放
+    server_id = Column(Integer, ForeignKey('servers.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+    metric_id = Column(Integer, ForeignKey('metric_definitions.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+    ts = Column(DateTime, primary_key=True)
+    value = Column(Float, nullable=False)
+
+    server = relationship("Server")
+    metric = relationship("MetricDefinition")
+
+    __table_args__ = (
+        Index('idx_server_metric_metric_ts', 'metric_id', 'ts'),  # 全部服务器按指标和时间范围查询
+    )
+
+
 class SystemAlert(db.Model):
     __tablename__ = 'system_alerts'
     
@@ -1140,6 +1235,7 @@ class SystemAlert(db.Model):
     details = Column(JSON, default=dict)  # 存储详细信息
     status = Column(Enum('active', 'acknowledged', 'resolved', name='alert_status'), default='active')
     rule_id = Column(Integer, ForeignKey('alarm_rules.id', ondelete='SET NULL'), nullable=True)
+    fingerprint = Column(String(191))  # 去重指纹：alert_type:target_type:target_id:rule_id
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     resolved_at = Column(DateTime)
@@ -1154,6 +1250,7 @@ class SystemAlert(db.Model):
         Index('idx_alert_status', 'status'),
         Index('idx_alert_created', 'created_at'),
         Index('idx_alert_target', 'target_type', 'target_id'),
+        Index('idx_alert_fingerprint', 'fingerprint', 'status'),
     )
 
 
@@ -9,7 +9,6 @@ import os
 
 # 定义蓝图
 acl_bp = Blueprint('acl', __name__)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # 城市映射表，提供城市名到拼音和代码的映射
 CITY_NAME_MAPPING = {
@@ -2,57 +2,161 @@ from flask import Blueprint, jsonify, request, Response
 from datetime import datetime
 from app.models import SystemAlert, User, Server, db, AlarmRule
 from app import db
+from app.config import Config
 from app.utils.logging_utils import log_operation
 from app.utils.notifications_utils import send_notification_email
 from app.utils.docker_utils import check_docker_health, get_docker_traffic
-from app.utils.monitoring_utils import check_server_health
+from app.utils.monitoring_utils import check_server_health, record_server_health
+from app.utils.alert_utils import alert_deduplicator, load_alert_settings, publish_alert_settings
+from app.utils.event_utils import publish_alert_event, publish_event, serialize_alert
+from app.utils.metrics_proxy import fetch_metrics, filter_metrics, buffer_stream, gzip_stream
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import redis
 import json
-import os
+import base64
+from sqlalchemy import func, or_, and_
 import requests
 import re
 
 # 定义蓝图
 alerts_bp = Blueprint('alerts', __name__, url_prefix='/api')
 
-# 实时告警
-@alerts_bp.route('/alerts/realtime', methods=['GET'])
-@jwt_required()  # 需要身份验证
-def get_realtime_alerts():
+# 告警列表分页参数
+DEFAULT_ALERT_PAGE_SIZE = 50
+MAX_ALERT_PAGE_SIZE = 500
+# 总数统计上限：超过该值只返回估计值，避免大表 COUNT(*) 全表扫描
+ALERT_COUNT_LIMIT = 10000
+
+
+def _encode_alert_cursor(alert):
+    return base64.urlsafe_b64encode(f"{alert.created_at.isoformat()}|{alert.id}".encode()).decode()
+
+
+def _decode_alert_cursor(cursor):
+    created_at, _, alert_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition('|')
+    return datetime.fromisoformat(created_at), int(alert_id)
+
+
+def _parse_list(name):
+    values = {value.strip() for raw in request.args.getlist(name) for value in raw.split(',')}
+    values.discard('')
+    return values
+
+
+def _filtered_alert_query(default_status=None):
     """
-    获取实时系统告警，并包含服务器信息
+    根据查询参数构造告警查询（不含分页）
+    支持 status、severity、alert_type、target_type、target_id、server_id、since、until
     """
-    active_alerts = SystemAlert.query.filter_by(status="active").all()
-    alert_data = []
-    
-    for alert in active_alerts:
-        alert_info = {
+    query = SystemAlert.query
+
+    statuses = _parse_list('status') or ({default_status} if default_status else set())
+    if statuses:
+        query = query.filter(SystemAlert.status.in_(statuses))  # idx_alert_status
+    severities = _parse_list('severity')
+    if severities:
+        query = query.filter(SystemAlert.severity.in_(severities))
+    alert_types = _parse_list('alert_type')
+    if alert_types:
+        query = query.filter(SystemAlert.alert_type.in_(alert_types))
+
+    server_ids = _parse_list('server_id')
+    if server_ids:
+        query = query.filter(SystemAlert.target_type == 'server', SystemAlert.target_id.in_([int(v) for v in server_ids]))
+    target_type = request.args.get('target_type')
+    if target_type:
+        query = query.filter(SystemAlert.target_type == target_type)  # idx_alert_target
+    target_ids = _parse_list('target_id')
+    if target_ids:
+        query = query.filter(SystemAlert.target_id.in_([int(v) for v in target_ids]))
+
+    since = request.args.get('since')
+    if since:
+        query = query.filter(SystemAlert.created_at >= datetime.fromisoformat(since))  # idx_alert_created
+    until = request.args.get('until')
+    if until:
+        query = query.filter(SystemAlert.created_at < datetime.fromisoformat(until))
+    return query
+
+
+def _list_alerts(default_status=None):
+    """
+    按 (created_at, id) 倒序的键集分页查询告警，并批量加载服务器信息
+    :return: (告警列表, 下一页游标, 总数, 总数是否为估计值)
+    """
+    limit = min(max(request.args.get('limit', DEFAULT_ALERT_PAGE_SIZE, type=int), 1), MAX_ALERT_PAGE_SIZE)
+    query = _filtered_alert_query(default_status)
+
+    # 总数只统计到 ALERT_COUNT_LIMIT 条，超过时返回估计值
+    total = db.session.query(func.count()).select_from(
+        query.with_entities(SystemAlert.id).limit(ALERT_COUNT_LIMIT).subquery()
+    ).scalar()
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        cursor_created_at, cursor_id = _decode_alert_cursor(cursor)
+        query = query.filter(or_(
+            SystemAlert.created_at < cursor_created_at,
+            and_(SystemAlert.created_at == cursor_created_at, SystemAlert.id < cursor_id)
+        ))
+    alerts = query.order_by(SystemAlert.created_at.desc(), SystemAlert.id.desc()).limit(limit + 1).all()
+    next_cursor = _encode_alert_cursor(alerts[limit - 1]) if len(alerts) > limit else None
+    alerts = alerts[:limit]
+
+    # 一次查询加载本页涉及的所有服务器
+    server_ids = {alert.target_id for alert in alerts if alert.target_type == 'server' and alert.target_id}
+    servers = {
+        server.id: {"id": server.id, "name": server.server_name, "ip": server.ip_address, "region": server.region}
+        for server in Server.query.with_entities(
+            Server.id, Server.server_name, Server.ip_address, Server.region
+        ).filter(Server.id.in_(server_ids)).all()
+    } if server_ids else {}
+
+    alert_data = [
+        {
             "id": alert.id,
-            "server_id": alert.server_id,
+            "server_id": alert.target_id if alert.target_type == 'server' else None,
             "alert_type": alert.alert_type,
             "message": alert.message,
-            "timestamp": alert.timestamp,
+            "severity": alert.severity,
             "status": alert.status,
-            "server_info": None
+            "created_at": alert.created_at.isoformat() if alert.created_at else None,
+            "updated_at": alert.updated_at.isoformat() if alert.updated_at else None,
+            "resolved_at": alert.resolved_at.isoformat() if alert.resolved_at else None,
+            "resolved_by": alert.resolved_by,
+            "details": alert.details or {},
+            "server_info": servers.get(alert.target_id) if alert.target_type == 'server' else None
         }
-        
-        if alert.server_id:
-            server = Server.query.get(alert.server_id)
-            if server:
-                alert_info["server_info"] = {
-                    "id": server.id,
-                    "name": server.server_name,
-                    "ip": server.ip_address,
-                    "region": server.region
-                }
-        
-        alert_data.append(alert_info)
+        for alert in alerts
+    ]
+    return alert_data, next_cursor, total, total >= ALERT_COUNT_LIMIT
+
+
+# 实时告警
+@alerts_bp.route('/alerts/realtime', methods=['GET'])
+@jwt_required()  # 需要身份验证
+def get_realtime_alerts():
+    """
+    获取实时系统告警（默认只返回 active 状态），并包含服务器信息
+    支持过滤与键集分页，参数同 GET /alerts
+    """
+    try:
+        alert_data, next_cursor, total, estimated = _list_alerts(default_status='active')
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid query parameter: {str(e)}"}), 400
 
-    if not alert_data:
-        return jsonify({"success": True, "message": "No active alerts"}), 200
+    for alert in alert_data:
+        alert["timestamp"] = alert["created_at"]
 
-    return jsonify({"success": True, "alerts": alert_data}), 200
+    if not alert_data and not request.args.get('cursor'):
+        return jsonify({"success": True, "message": "No active alerts", "alerts": [], "total": 0}), 200
+
+    return jsonify({
+        "success": True,
+        "alerts": alert_data,
+        "next_cursor": next_cursor,
+        "total": total,
+        "total_is_estimate": estimated
+    }), 200
 
 
 # 添加告警
@@ -96,6 +200,7 @@ def add_alert():
         )
         db.session.add(db_alert)
         db.session.commit()
+        publish_alert_event(db_alert, "created")
 
         # 发送邮件通知给管理员
         send_notification_email(
@@ -149,22 +254,22 @@ def check_monthly_traffic():
 
     total_traffic = sum(container.upload_traffic + container.download_traffic for container in user.containers)
     if total_traffic > monthly_traffic_limit:
-        # 触发流量告警
-        alert = SystemAlert(
-            server_id=None,
-            alert_type="Monthly Traffic Limit Exceeded",
+        # 触发流量告警（同一用户的重复告警只累加次数）
+        result = alert_deduplicator.raise_alert(
+            alert_type="traffic",
+            target_type="user",
+            target_id=user.id,
             message=f"Your total monthly traffic has exceeded the limit of {monthly_traffic_limit} MB.",
-            timestamp=datetime.utcnow(),
-            status="active"
+            details={"total_traffic": total_traffic, "monthly_traffic_limit": monthly_traffic_limit}
         )
-        db.session.add(alert)
-        db.session.commit()
 
-        # 发送邮件通知
-        send_notification_email(user.email, "Traffic Alert", f"Your total monthly traffic has exceeded the limit of {monthly_traffic_limit} MB.")
-        log_operation(user_id=user.id, operation="check_monthly_traffic", status="success", details="Traffic alert triggered")
-        return jsonify({"success": True, "message": "Monthly traffic alert triggered"}), 200
+        # 仅新告警发送邮件通知
+        if result["notify"]:
+            send_notification_email(user.email, "Traffic Alert", f"Your total monthly traffic has exceeded the limit of {monthly_traffic_limit} MB.")
+            log_operation(user_id=user.id, operation="check_monthly_traffic", status="success", details="Traffic alert triggered")
+        return jsonify({"success": True, "message": "Monthly traffic alert triggered", "action": result["action"]}), 200
 
+    alert_deduplicator.clear_alert(alert_type="traffic", target_type="user", target_id=user.id)
     return jsonify({"success": True, "message": "Traffic is within limits"}), 200
 
 
@@ -184,25 +289,28 @@ def check_server_health_status():
     if not server:
         return jsonify({"success": False, "message": "Server not found"}), 404
 
-    health_status = check_server_health(server.ip)
-    if not health_status['healthy']:
-        # 触发服务器健康告警
-        alert = SystemAlert(
-            server_id=server.id,
-            alert_type="Server Health Issue",
-            message=f"Server {server.ip} is down or experiencing issues.",
-            timestamp=datetime.utcnow(),
-            status="active"
+    health_status = check_server_health(server.ip_address, Config.MONITORING_SSH_USER, Config.MONITORING_SSH_PASSWORD,
+                                        Config.MONITORING_SSH_TIMEOUT)
+    # 检查结果写入指标表，指标阈值由告警规则引擎评估
+    record_server_health({server.id: health_status})
+    if health_status is None:
+        # 触发服务器健康告警（同一服务器的重复告警只累加次数）
+        result = alert_deduplicator.raise_alert(
+            alert_type="server",
+            target_type="server",
+            target_id=server.id,
+            message=f"Server {server.ip_address} is down or experiencing issues.",
+            severity="high"
         )
-        db.session.add(alert)
-        db.session.commit()
 
-        # 发送邮件通知
-        user = User.query.get(server.user_id)
-        send_notification_email(user.email, "Server Health Alert", f"Server {server.ip} is down or experiencing issues.")
-        log_operation(user_id=user.id, operation="check_server_health", status="success", details="Server health alert triggered")
-        return jsonify({"success": True, "message": "Server health alert triggered"}), 200
+        # 仅新告警发送邮件通知
+        if result["notify"]:
+            user = User.query.get(server.user_id)
+            send_notification_email(user.email, "Server Health Alert", f"Server {server.ip_address} is down or experiencing issues.")
+            log_operation(user_id=user.id, operation="check_server_health", status="success", details="Server health alert triggered")
+        return jsonify({"success": True, "message": "Server health alert triggered", "action": result["action"]}), 200
 
+    alert_deduplicator.clear_alert(alert_type="server", target_type="server", target_id=server.id)
     return jsonify({"success": True, "message": "Server is healthy"}), 200
 
 
@@ -220,23 +328,22 @@ def check_docker_traffic_health():
 
     container = get_docker_traffic(container_id)
     if container is None or container['traffic_error']:
-        # 触发 Docker 流量异常告警
-        alert = SystemAlert(
-            server_id=None,  # 这里不涉及特定服务器
-            alert_type="Docker Traffic Issue",
-            message=f"Docker container {container_id} traffic retrieval failed or data is abnormal.",
-            timestamp=datetime.utcnow(),
-            status="active"
+        # 触发 Docker 流量异常告警（同一容器的重复告警只累加次数）
+        result = alert_deduplicator.raise_alert(
+            alert_type="docker",
+            target_type="container_traffic",
+            target_id=container_id,
+            message=f"Docker container {container_id} traffic retrieval failed or data is abnormal."
         )
-        db.session.add(alert)
-        db.session.commit()
 
-        # 发送邮件通知
-        user = User.query.get(container['user_id'])
-        send_notification_email(user.email, "Docker Traffic Alert", f"Traffic retrieval for Docker container {container_id} failed.")
-        log_operation(user_id=user.id, operation="check_docker_traffic_health", status="success", details="Docker traffic issue alert triggered")
-        return jsonify({"success": True, "message": "Docker traffic issue alert triggered"}), 200
+        # 仅新告警发送邮件通知
+        if result["notify"] and container:
+            user = User.query.get(container['user_id'])
+            send_notification_email(user.email, "Docker Traffic Alert", f"Traffic retrieval for Docker container {container_id} failed.")
+            log_operation(user_id=user.id, operation="check_docker_traffic_health", status="success", details="Docker traffic issue alert triggered")
+        return jsonify({"success": True, "message": "Docker traffic issue alert triggered", "action": result["action"]}), 200
 
+    alert_deduplicator.clear_alert(alert_type="docker", target_type="container_traffic", target_id=container_id)
     return jsonify({"success": True, "message": "Docker traffic is normal"}), 200
 
 
@@ -254,23 +361,22 @@ def check_docker_container_status():
 
     container_status = check_docker_health(container_id)
     if container_status != "running":
-        # 触发容器异常告警
-        alert = SystemAlert(
-            server_id=None,  # 不涉及特定服务器
-            alert_type="Docker Container Issue",
-            message=f"Docker container {container_id} is not running.",
-            timestamp=datetime.utcnow(),
-            status="active"
+        # 触发容器异常告警（同一容器的重复告警只累加次数）
+        result = alert_deduplicator.raise_alert(
+            alert_type="container",
+            target_type="container",
+            target_id=container_id,
+            message=f"Docker container {container_id} is not running."
         )
-        db.session.add(alert)
-        db.session.commit()
 
-        # 发送邮件通知
-        user = User.query.get(container_status['user_id'])
-        send_notification_email(user.email, "Docker Container Alert", f"Docker container {container_id} is not running.")
-        log_operation(user_id=user.id, operation="check_docker_container_status", status="success", details="Docker container issue alert triggered")
-        return jsonify({"success": True, "message": "Docker container issue alert triggered"}), 200
+        # 仅新告警发送邮件通知
+        if result["notify"]:
+            user = User.query.get(container_status['user_id'])
+            send_notification_email(user.email, "Docker Container Alert", f"Docker container {container_id} is not running.")
+            log_operation(user_id=user.id, operation="check_docker_container_status", status="success", details="Docker container issue alert triggered")
+        return jsonify({"success": True, "message": "Docker container issue alert triggered", "action": result["action"]}), 200
 
+    alert_deduplicator.clear_alert(alert_type="container", target_type="container", target_id=container_id)
     return jsonify({"success": True, "message": "Docker container is running normally"}), 200
 
 
@@ -285,8 +391,10 @@ def delete_alert(id):
         return jsonify({"success": False, "message": "Alert not found"}), 404
 
     try:
+        deleted_event = serialize_alert(alert, "deleted")
         db.session.delete(alert)
         db.session.commit()
+        publish_event("alert", deleted_event)
         log_operation(user_id=None, operation="delete_alert", details=f"Alert {id} deleted successfully")
         return jsonify({"success": True, "message": "Alert deleted successfully"}), 200
     except Exception as e:
@@ -299,156 +407,34 @@ def delete_alert(id):
 @alerts_bp.route('/alerts', methods=['GET'])
 def get_all_alerts():
     """
-    查询所有告警，包含完整信息
+    查询告警，包含完整信息
+    过滤参数：status、severity、alert_type、target_type、target_id、server_id（均可逗号分隔）、since、until（ISO 时间）
+    分页参数：limit（默认 50，最大 500）、cursor（上一页返回的 next_cursor）
     """
-    alerts = SystemAlert.query.all()
-    alert_data = []
-    
-    for alert in alerts:
-        alert_info = {
-            "id": alert.id,
-            "server_id": alert.target_id if alert.target_type == 'server' else None,
-            "alert_type": alert.alert_type,
-            "message": alert.message,
-            "severity": alert.severity,
-            "status": alert.status,
-            "created_at": alert.created_at.isoformat(),
-            "updated_at": alert.updated_at.isoformat() if alert.updated_at else None,
-            "resolved_at": alert.resolved_at.isoformat() if alert.resolved_at else None,
-            "resolved_by": alert.resolved_by,
-            "details": alert.details or {},
-            "server_info": None
-        }
-        
-        if alert.target_type == 'server' and alert.target_id:
-            server = Server.query.get(alert.target_id)
-            if server:
-                alert_info["server_info"] = {
-                    "id": server.id,
-                    "name": server.server_name,
-                    "ip": server.ip_address,
-                    "region": server.region
-                }
-        
-        alert_data.append(alert_info)
+    try:
+        alert_data, next_cursor, total, estimated = _list_alerts()
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid query parameter: {str(e)}"}), 400
 
-    return jsonify({"success": True, "alerts": alert_data}), 200
+    return jsonify({
+        "success": True,
+        "alerts": alert_data,
+        "next_cursor": next_cursor,
+        "total": total,
+        "total_is_estimate": estimated
+    }), 200
 
 
 @alerts_bp.route('/alerts/settings', methods=['GET'])
 def get_alert_settings():
-    """获取告警设置，优先从Redis获取，没有则从MySQL读取并缓存到Redis"""
+    """获取告警设置：依次读取进程内缓存、Redis、MySQL，source 字段标明来源"""
     try:
-        print("开始获取告警设置...")
-        
-        # 1. 首先从 Redis 获取设置
-        redis_client = redis.StrictRedis(
-            host=os.getenv('REDIS_HOST', 'localhost'),
-            port=6379,
-            db=0,
-            decode_responses=True  # 确保返回的数据是字符串而不是字节
-        )
-        
-        settings_json = redis_client.get('alert_settings')
-        
-        if settings_json:
-            print("从Redis中成功获取到设置")
-            return jsonify({
-                "success": True,
-                "settings": json.loads(settings_json),
-                "source": "redis"
-            })
-        
-        print("Redis中没有找到设置，从MySQL数据库获取...")
-        
-        # 2. 从MySQL数据库的derp_system.alarm_rules表获取
-        rules = AlarmRule.query.filter_by(is_active=True).all()
-        print(f"从数据库中找到{len(rules)}条规则")
-        
-        # 3. 构造设置对象
-        settings = {
-            'serverHealthCheck': True,  # 默认值
-            'dockerHealthCheck': True,
-            'trafficAlert': True,
-            'emailNotification': True,
-            'checkInterval': 5,
-            'thresholds': {
-                'traffic': 90,
-                'cpu': 80,
-                'memory': 80,
-                'disk': 85
-            },
-            'lastUpdated': datetime.utcnow().isoformat()
-        }
-        
-        # 4. 从规则中更新设置
-        for rule in rules:
-            print(f"处理规则: {rule.name}, 阈值: {rule.threshold}")
-            if rule.alert_condition == 'cpu_usage':
-                settings['thresholds']['cpu'] = float(rule.threshold)
-            elif rule.alert_condition == 'memory_usage':
-                settings['thresholds']['memory'] = float(rule.threshold)
-            elif rule.alert_condition == 'disk_usage':
-                settings['thresholds']['disk'] = float(rule.threshold)
-            elif rule.alert_condition == 'traffic_usage':
-                settings['thresholds']['traffic'] = float(rule.threshold)
-            elif rule.alert_condition == 'check_interval':
-                settings['checkInterval'] = float(rule.threshold)
-            elif rule.alert_condition == 'server_health':
-                settings['serverHealthCheck'] = rule.threshold > 0
-            elif rule.alert_condition == 'docker_health':
-                settings['dockerHealthCheck'] = rule.threshold > 0
-            elif rule.alert_condition == 'traffic_monitor':
-                settings['trafficAlert'] = rule.threshold > 0
-            elif rule.alert_condition == 'email_notify':
-                settings['emailNotification'] = rule.threshold > 0
-        
-        # 5. 将设置缓存到Redis（设置1小时过期）
-        print("将设置缓存到Redis中...")
-        redis_client.setex(
-            'alert_settings',
-            3600,  # 1小时过期
-            json.dumps(settings)
-        )
-        print("设置已成功缓存到Redis")
-        
+        settings, source = load_alert_settings()
         return jsonify({
             "success": True,
             "settings": settings,
-            "source": "mysql"
+            "source": source
         })
-        
-    except redis.RedisError as e:
-        print(f"Redis错误: {str(e)}")
-        # Redis出错时直接从MySQL读取
-        try:
-            rules = AlarmRule.query.filter_by(is_active=True).all()
-            settings = {
-                'serverHealthCheck': True,
-                'dockerHealthCheck': True,
-                'trafficAlert': True,
-                'emailNotification': True,
-                'checkInterval': 5,
-                'thresholds': {
-                    'traffic': 90,
-                    'cpu': 80,
-                    'memory': 80,
-                    'disk': 85
-                },
-                'lastUpdated': datetime.utcnow().isoformat()
-            }
-            return jsonify({
-                "success": True,
-                "settings": settings,
-                "source": "mysql_fallback"
-            })
-        except Exception as db_error:
-            print(f"数据库错误: {str(db_error)}")
-            return jsonify({
-                "success": False,
-                "message": f"获取设置失败: {str(db_error)}"
-            }), 500
-            
     except Exception as e:
         error_msg = str(e)
         print(f"获取设置时发生错误: {error_msg}")
@@ -621,27 +607,15 @@ def update_alert_settings():
         for rule in saved_rules:
             print(f"Saved rule: {rule.name}, condition: {rule.alert_condition}, threshold: {rule.threshold}")
         
-        # 同步到 Redis
-        try:
-            print("\nSyncing to Redis...")
-            redis_client = redis.StrictRedis(
-                host=os.getenv('REDIS_HOST', 'localhost'),
-                port=6379,
-                db=0
-            )
-            
-            settings = {
-                'serverHealthCheck': data['serverHealthCheck'],
-                'dockerHealthCheck': data['dockerHealthCheck'],
-                'trafficAlert': data['trafficAlert'],
-                'emailNotification': data['emailNotification'],
-                'checkInterval': data['checkInterval'],
-                'thresholds': data['thresholds']
-            }
-            redis_client.set('alert_settings', json.dumps(settings))
-            print("Redis sync completed")
-        except Exception as e:
-            print(f"Error syncing to Redis: {str(e)}")
+        # 更新缓存并通知所有进程清除本地缓存
+        publish_alert_settings({
+            'serverHealthCheck': data['serverHealthCheck'],
+            'dockerHealthCheck': data['dockerHealthCheck'],
+            'trafficAlert': data['trafficAlert'],
+            'emailNotification': data['emailNotification'],
+            'checkInterval': data['checkInterval'],
+            'thresholds': data['thresholds']
+        })
         
         return jsonify({
             "success": True,
@@ -779,6 +753,7 @@ def update_alert_status(id):
             alert.resolved_by = current_user
         
         db.session.commit()
+        publish_alert_event(alert, "resolved" if new_status == 'resolved' else "updated")
         
         # 记录操作日志
         log_operation(
@@ -838,6 +813,7 @@ def update_alert_severity(id):
         alert.details = details
         
         db.session.commit()
+        publish_alert_event(alert, "updated")
         
         # 记录操作日志
         current_user = get_jwt_identity()
@@ -890,24 +866,27 @@ def proxy_metrics(container_name):
 
         # 构建实际的metrics URL
         metrics_url = f"http://{ip}:{port}/metrics"
-        print(f"Fetching metrics from: {metrics_url}")
-        
-        # 发送请求获取metrics数据
-        response = requests.get(metrics_url, timeout=5)
-        response.raise_for_status()
-
-        # 返回数据，保持原始格式并添加CORS头
-        return Response(
-            response.text,
-            status=200,
-            mimetype='text/plain',
-            headers={
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Cache-Control': 'no-cache'
-            }
-        )
+
+        # 复用到 exporter 的 keep-alive 连接，短时间内的重复请求直接读缓存
+        body = fetch_metrics(metrics_url)
+
+        # match[]=node_cpu_seconds_total&match[]=node_memory_* 只返回这些指标族
+        chunks = filter_metrics(body, request.args.getlist('match[]') + request.args.getlist('match'))
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': '*',
+            'Access-Control-Allow-Methods': 'GET, OPTIONS',
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding'
+        }
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            chunks = gzip_stream(chunks)
+        else:
+            chunks = buffer_stream(chunks)
+
+        # 返回数据，保持原始格式
+        return Response(chunks, status=200, mimetype='text/plain', headers=headers)
 
     except requests.Timeout:
         print(f"Timeout while fetching metrics from {metrics_url}")
@@ -973,20 +952,42 @@ def create_alert():
                 'note': '原始数据太大，已被截断'
             }
         
-        # 创建告警
-        alert = SystemAlert(
-            target_type='container',
-            target_id=None,
-            alert_type=data['alert_type'],
-            message=data['message'],
-            severity=severity,
-            status=data.get('status', 'pending'),
-            created_at=datetime.utcnow(),
-            details=details  # 使用处理后的 details
-        )
-        
-        db.session.add(alert)
-        db.session.commit()
+        duplicate = False
+        if data.get('source'):
+            # 前端周期检查容器指标产生的告警：经过去重，同一容器的未解决告警只保留一条
+            if isinstance(details, str):
+                try:
+                    details = json.loads(details)
+                except ValueError:
+                    details = {"note": details}
+            result = alert_deduplicator.raise_alert(
+                alert_type=data['alert_type'],
+                target_type='container',
+                target_id=data['source'],
+                message=data['message'],
+                severity=severity,
+                details=details
+            )
+            if result["alert"] is None:
+                # 尚未达到滞回次数
+                return jsonify({"success": True, "message": "告警等待确认", "duplicate": True, "action": result["action"]}), 200
+            alert = result["alert"]
+            duplicate = result["action"] != "created"
+        else:
+            # 创建告警
+            alert = SystemAlert(
+                target_type='container',
+                target_id=None,
+                alert_type=data['alert_type'],
+                message=data['message'],
+                severity=severity,
+                status=data.get('status', 'pending'),
+                created_at=datetime.utcnow(),
+                details=details  # 使用处理后的 details
+            )
+
+            db.session.add(alert)
+            db.session.commit()
         
         # 记录操作日志
         log_operation(
@@ -998,7 +999,8 @@ def create_alert():
         
         return jsonify({
             "success": True,
-            "message": "告警创建成功",
+            "message": "告警已存在，已累加次数" if duplicate else "告警创建成功",
+            "duplicate": duplicate,
             "alert": {
                 "id": alert.id,
                 "type": alert.alert_type,
@@ -1008,7 +1010,7 @@ def create_alert():
                 "created_at": alert.created_at.isoformat(),
                 "details": alert.details
             }
-        }), 201
+        }), 200 if duplicate else 201
         
     except Exception as e:
         db.session.rollback()
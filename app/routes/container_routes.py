@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from app.utils.docker_utils import create_container, stop_container, get_container_status, list_containers, update_docker_container, update_traffic_for_container, delete_container_by_id
 from app import db
 from app.models import DockerContainer  # 假设你有一个名为 DockerContainer 的模型类
+from app.utils.resource_index import find_container_dependents
 import logging
 
 # 定义蓝图
@@ -150,6 +151,20 @@ def get_container_details(container_id):
     except Exception as e:
         return jsonify({"success": False, "message": f"Error fetching container: {str(e)}"}), 500
 
+# 查询依赖容器的租赁和设备绑定
+@container_bp.route('/api/containers/<int:container_id>/dependents', methods=['GET'])
+def get_container_dependents(container_id):
+    """
+    查询依赖指定容器的租赁和设备绑定（故障切换时使用）
+    查询参数 active_only：默认 true，只返回有效的租赁和设备绑定
+    """
+    active_only = request.args.get('active_only', 'true').lower() != 'false'
+    try:
+        dependents = find_container_dependents(container_id, active_only=active_only)
+        return jsonify({"success": True, "container_id": container_id, "data": dependents}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error fetching container dependents: {str(e)}"}), 500
+
 # 更新容器
 @container_bp.route('/api/containers/<container_name>', methods=['PUT'])
 def update_existing_container(container_name):
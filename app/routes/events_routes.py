@@ -0,0 +1,47 @@
+import re
+from flask import Blueprint, Response, request
+from flask_jwt_extended import jwt_required
+from app.utils.event_utils import EVENT_TYPES, iter_sse_events
+
+# 定义蓝图
+events_bp = Blueprint('events', __name__, url_prefix='/api')
+
+EVENT_ID_RE = re.compile(r'^\d+-\d+$')
+
+
+def _id_set(name):
+    """
+    解析可重复或逗号分隔的查询参数，如 ?server_id=1&server_id=2 或 ?server_id=1,2
+    """
+    values = {value.strip() for raw in request.args.getlist(name) for value in raw.split(',')}
+    values.discard('')
+    return values or None
+
+
+# 实时事件推送（告警状态变化、容器流量增量）
+@events_bp.route('/events/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])  # EventSource 无法设置请求头，可通过 ?jwt=<token> 认证
+def event_stream():
+    """
+    Server-Sent Events 实时事件流
+    查询参数：types（alert,traffic）、server_id、container_id、last_event_id
+    断线重连时浏览器自动携带 Last-Event-ID 请求头，从该事件之后继续推送
+    """
+    types = _id_set('types')
+    if types:
+        types &= set(EVENT_TYPES)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id and not EVENT_ID_RE.match(last_event_id):
+        last_event_id = None
+
+    events = iter_sse_events(
+        last_event_id=last_event_id,
+        types=types,
+        server_ids=_id_set('server_id'),
+        container_ids=_id_set('container_id')
+    )
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 Nginx 缓冲，事件立即送达
+    })
@@ -1,41 +1,82 @@
 from flask import Blueprint, jsonify, request
-from app.models import User, SerialNumber
-from datetime import datetime
-from sqlalchemy import func
+from app.models import User, SerialNumber, FinanceSettlement
+from app.utils.finance_aggregates import summarize_finance_aggregates, get_finance_aggregates, MEASURES
+from app.utils.commission_settlement import settle_commissions, previous_period
+from datetime import datetime, date, timedelta
 from app import db
 import random
 import string
 
 finance_bp = Blueprint('finance', __name__)
 
+FINANCE_SCOPES = ('user', 'distributor', 'level')
+FINANCE_PERIODS = ('day', 'month')
+# 未指定起始日期时默认统计的范围
+DEFAULT_STATISTICS_DAYS = {'day': 30, 'month': 365}
+
+
+def _user_orders(user_id):
+    """
+    查询用户的序列号订单（单条查询，只读取需要的列）
+    """
+    rows = db.session.query(
+        SerialNumber.code, SerialNumber.status, SerialNumber.valid_days, SerialNumber.created_at, SerialNumber.used_at
+    ).filter(SerialNumber.user_id == user_id).order_by(SerialNumber.id)
+    return [
+        {
+            "serial_number": row.code,
+            "status": row.status,
+            "duration_days": row.valid_days,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "used_at": row.used_at.isoformat() if row.used_at else None
+        }
+        for row in rows
+    ]
+
+
 # 获取财务统计数据
 @finance_bp.route('/statistics', methods=['GET'])
 def finance_statistics():
     """
-    获取财务统计数据，包括总收入（基于序列号的天数）和每个用户的总收入
+    获取财务统计数据：读取预先汇总的 finance_aggregates，不扫描序列号和发票
+    查询参数：scope（user / distributor / level，默认 user）、period（day / month，默认 month）、
+    start / end（YYYY-MM-DD，默认最近 30 天或 365 天）、limit（排行数量，默认 100）
     """
+    scope = request.args.get('scope', 'user')
+    period = request.args.get('period', 'month')
+    if scope not in FINANCE_SCOPES or period not in FINANCE_PERIODS:
+        return jsonify({"success": False, "message": f"scope must be one of {FINANCE_SCOPES}, period one of {FINANCE_PERIODS}"}), 400
     try:
-        # 总收入 = 所有序列号的持续天数总和
-        total_revenue = SerialNumber.query.with_entities(func.sum(SerialNumber.duration_days)).scalar() or 0
-
-        # 获取每个用户的收入
-        user_revenue = db.session.query(
-            User.id,
-            User.username,
-            func.sum(SerialNumber.duration_days).label("total_revenue")
-        ).join(SerialNumber).group_by(User.id).all()
-
-        user_revenue_data = [
-            {"user_id": user.id, "username": user.username, "total_revenue": user.total_revenue}
-            for user in user_revenue
-        ]
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') \
+            else end - timedelta(days=DEFAULT_STATISTICS_DAYS[period] - 1)
+    except ValueError:
+        return jsonify({"success": False, "message": "start and end must be dates in YYYY-MM-DD format"}), 400
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
 
-        return jsonify({
+    try:
+        summary = summarize_finance_aggregates(scope, period, start, end, limit=limit)
+
+        response = {
             "success": True,
-            "total_revenue": total_revenue,
-            "user_revenue": user_revenue_data,
+            "scope": scope,
+            "period": period,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            **summary,
+            # 兼容旧字段：总收入 = 兑换的序列号天数合计
+            "total_revenue": summary["totals"]["serial_days"],
             "timestamp": datetime.utcnow().isoformat()
-        }), 200
+        }
+        if scope == 'user':
+            user_ids = [int(row["scope_key"]) for row in summary["breakdown"]]
+            usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids))) if user_ids else {}
+            response["user_revenue"] = [
+                {"user_id": int(row["scope_key"]), "username": usernames.get(int(row["scope_key"])),
+                 "total_revenue": row["serial_days"]}
+                for row in summary["breakdown"]
+            ]
+        return jsonify(response), 200
     except Exception as e:
         return jsonify({"success": False, "message": f"Error fetching financial statistics: {str(e)}"}), 500
 
@@ -47,21 +88,10 @@ def user_orders(user_id):
     获取用户订单记录，包括用户的所有序列号
     """
     try:
-        user = User.query.get(user_id)
-        if not user:
+        if not db.session.query(User.id).filter(User.id == user_id).first():
             return jsonify({"success": False, "message": "User not found"}), 404
 
-        orders = [
-            {
-                "serial_number": sn.code,
-                "status": sn.status,
-                "duration_days": sn.duration_days,
-                "created_at": sn.created_at.isoformat(),
-                "used_at": sn.used_at.isoformat() if sn.used_at else None
-            }
-            for sn in user.serial_numbers
-        ]
-        return jsonify({"success": True, "orders": orders}), 200
+        return jsonify({"success": True, "orders": _user_orders(user_id)}), 200
     except Exception as e:
         return jsonify({"success": False, "message": f"Error fetching orders: {str(e)}"}), 500
 
@@ -124,34 +154,74 @@ def list_serial_numbers():
 @finance_bp.route('/user_finance/<int:user_id>', methods=['GET'])
 def get_user_finance(user_id):
     """
-    获取用户的财务信息，包括用户的总收入和订单详情
+    获取用户的财务信息：按月汇总（finance_aggregates）与订单详情
     """
     try:
-        user = User.query.get(user_id)
+        user = db.session.query(User.id, User.username).filter(User.id == user_id).first()
         if not user:
             return jsonify({"success": False, "message": "User not found"}), 404
 
-        # 获取该用户的所有序列号
-        orders = [
-            {
-                "serial_number": sn.code,
-                "status": sn.status,
-                "duration_days": sn.duration_days,
-                "created_at": sn.created_at.isoformat(),
-                "used_at": sn.used_at.isoformat() if sn.used_at else None
-            }
-            for sn in user.serial_numbers
-        ]
-        
-        # 计算该用户的总收入（基于序列号的天数）
-        total_revenue = sum(sn.duration_days for sn in user.serial_numbers)
+        monthly = get_finance_aggregates('user', 'month', scope_key=user_id)
+        totals = {name: sum((row[name] for row in monthly), 0) for name in MEASURES}
 
         return jsonify({
             "success": True,
             "user_id": user.id,
             "username": user.username,
-            "total_revenue": total_revenue,
-            "orders": orders
+            # 总收入（基于兑换的序列号天数）
+            "total_revenue": totals["serial_days"],
+            "totals": totals,
+            "monthly": [
+                {"period_start": row["period_start"].isoformat(), **{name: row[name] for name in MEASURES}}
+                for row in monthly
+            ],
+            "orders": _user_orders(user_id)
         }), 200
     except Exception as e:
         return jsonify({"success": False, "message": f"Error fetching user finance details: {str(e)}"}), 500
+
+
+# 结算分销商佣金
+@finance_bp.route('/settlements', methods=['POST'])
+def run_settlement():
+    """
+    计算一个周期的分销商佣金与结算单，可重复执行（只重算未支付的部分）
+    请求体：{"period": "YYYY-MM"}，默认上一个自然月
+    """
+    data = request.get_json(silent=True) or {}
+    period = data.get('period') or previous_period()
+    try:
+        stats = settle_commissions(period)
+        return jsonify({"success": True, "data": stats}), 200
+    except ValueError:
+        return jsonify({"success": False, "message": "period must be in YYYY-MM format"}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error settling commissions: {str(e)}"}), 500
+
+
+# 查看结算单
+@finance_bp.route('/settlements', methods=['GET'])
+def list_settlements():
+    """
+    查看一个周期的结算单，默认上一个自然月
+    """
+    period = request.args.get('period') or previous_period()
+    try:
+        rows = db.session.query(
+            FinanceSettlement.id, FinanceSettlement.distributor_id, FinanceSettlement.commission_count,
+            FinanceSettlement.settlement_amount, FinanceSettlement.status, FinanceSettlement.settled_at
+        ).filter(FinanceSettlement.period == period).order_by(FinanceSettlement.distributor_id)
+        settlements = [
+            {
+                "id": row.id,
+                "distributor_id": row.distributor_id,
+                "commission_count": row.commission_count,
+                "settlement_amount": str(row.settlement_amount),
+                "status": row.status,
+                "settled_at": row.settled_at.isoformat() if row.settled_at else None
+            }
+            for row in rows
+        ]
+        return jsonify({"success": True, "period": period, "settlements": settlements}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error fetching settlements: {str(e)}"}), 500
@@ -1,11 +1,11 @@
 from flask import Blueprint, jsonify, request
 import random
-from datetime import datetime
 from app.utils.logging_utils import log_operation
 from app.utils.monitoring_utils import generate_alerts, analyze_server_load, check_server_health
 from app.utils.docker_utils import check_docker_health, get_docker_traffic, update_docker_container
-from app.models import SystemAlert, Server, User, db
-from app.utils.notifications_utils import send_notification_email
+from app.models import Server
+from app.utils.notification_digest import notify_admins
+from app.utils.alert_utils import alert_deduplicator
 
 # 定义蓝图
 ha_bp = Blueprint('ha', __name__)
@@ -87,21 +87,23 @@ def failover():
             server_health[server]['status'] = "switched"
             server_health[server]['load'] = 0  # 清空负载
 
-            # 触发告警并通知管理员
-            alert = SystemAlert(
-                server_id=server,
-                alert_type="Server Failure",
+            # 触发告警（同一服务器的重复故障只累加次数），仅新告警通知管理员
+            result = alert_deduplicator.raise_alert(
+                alert_type="server",
+                target_type="ha_server",
+                target_id=server,
                 message=f"Server {server} has failed over to a backup server.",
-                timestamp=datetime.utcnow(),
-                status="active"
+                severity="critical",
+                details={"event": "failover", "server": server}
             )
-            db.session.add(alert)
-            db.session.commit()
-
-            # 获取管理员的联系方式并发送邮件
-            admins = User.query.filter_by(role="admin").all()
-            for admin in admins:
-                send_notification_email(admin.email, "Server Failure Notification", f"Server {server} has failed over and is now operating on a backup server.")
+            if result["notify"]:
+                # 通知进入管理员汇总，同一波故障合并为一封邮件
+                notify_admins(
+                    "Server Failure Notification",
+                    f"Server {server} has failed over and is now operating on a backup server.",
+                    severity="critical",
+                    target=f"ha_server:{server}"
+                )
 
         log_operation(user_id=None, operation="failover", status="success", details=f"Failover completed for: {unhealthy_servers}")
         return jsonify({"success": True, "message": "Failover completed", "updated_health": server_health}), 200
@@ -153,6 +155,8 @@ def disaster_recovery():
             if server in server_health:
                 server_health[server]['status'] = "healthy"
                 server_health[server]['load'] = random.uniform(10, 30)  # 恢复后随机负载
+                # 恢复正常（满足滞回次数且未抖动时解除故障切换告警）
+                alert_deduplicator.clear_alert(alert_type="server", target_type="ha_server", target_id=server)
 
         log_operation(user_id=None, operation="disaster_recovery", status="success", details=f"Disaster recovery performed for: {affected_servers}")
         return jsonify({"success": True, "message": "Disaster recovery completed", "updated_health": server_health}), 200
@@ -190,21 +194,24 @@ def replace_docker_container():
                 update_docker_container(container.id)
                 # 更新 ACL 文件
                 acl_config = update_acl_for_server(server)
-                # 记录告警并通知
-                alert = SystemAlert(
-                    server_id=server_id,
-                    alert_type="Server Failure",
-                    message=f"All containers on server {server_id} are being replaced.",
-                    timestamp=datetime.utcnow(),
-                    status="active"
-                )
-                db.session.add(alert)
-                db.session.commit()
 
-                # 发送邮件通知管理员
-                admins = User.query.filter_by(role="admin").all()
-                for admin in admins:
-                    send_notification_email(admin.email, "Server Failure Notification", f"All containers on server {server_id} have been replaced.")
+            # 每台服务器只记录一条告警，重复故障只累加次数
+            result = alert_deduplicator.raise_alert(
+                alert_type="server",
+                target_type="server",
+                target_id=server_id,
+                message=f"All containers on server {server_id} are being replaced.",
+                severity="critical",
+                details={"event": "replace_containers", "containers": len(containers)}
+            )
+            # 仅新告警发送邮件通知管理员
+            if result["notify"]:
+                notify_admins(
+                    "Server Failure Notification",
+                    f"All containers on server {server_id} have been replaced.",
+                    severity="critical",
+                    target=f"server:{server_id}"
+                )
 
             log_operation(user_id=None, operation="replace_docker_container", status="success", details=f"All containers on server {server_id} replaced.")
             return jsonify({"success": True, "message": f"All containers on server {server_id} replaced successfully"}), 200
@@ -217,21 +224,25 @@ def replace_docker_container():
                 update_docker_container(container_id)
                 # 更新 ACL 文件
                 acl_config = update_acl_for_container(container_id)
-                # 记录告警并通知
-                alert = SystemAlert(
-                    server_id=None,
-                    alert_type="Docker Container Issue",
+                # 记录告警（同一容器的重复故障只累加次数）
+                result = alert_deduplicator.raise_alert(
+                    alert_type="container",
+                    target_type="container",
+                    target_id=container_id,
                     message=f"Docker container {container_id} is not running. Replacing container.",
-                    timestamp=datetime.utcnow(),
-                    status="active"
+                    severity="high",
+                    details={"event": "replace_container", "server_id": server_id}
                 )
-                db.session.add(alert)
-                db.session.commit()
 
-                # 发送邮件通知管理员
-                admins = User.query.filter_by(role="admin").all()
-                for admin in admins:
-                    send_notification_email(admin.email, "Docker Container Issue", f"Docker container {container_id} on server {server_id} is not running. It is being replaced.")
+                # 仅新告警发送邮件通知管理员
+                if result["notify"]:
+                    # 同一台服务器上多个容器故障时合并为一封汇总邮件
+                    notify_admins(
+                        "Docker Container Issue",
+                        f"Docker container {container_id} on server {server_id} is not running. It is being replaced.",
+                        severity="high",
+                        target=f"container:{container_id}"
+                    )
 
                 log_operation(user_id=None, operation="replace_docker_container", status="success", details=f"Docker container {container_id} replaced.")
                 return jsonify({"success": True, "message": f"Docker container {container_id} replaced successfully"}), 200
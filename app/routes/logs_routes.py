@@ -1,19 +1,12 @@
 from flask import Blueprint, request, jsonify
 from app.models import UserLog, SystemLog, db
 import logging
-from logging.handlers import RotatingFileHandler
 from datetime import datetime
 
 # 定义蓝图
 logs_bp = Blueprint('logs', __name__)
 
-# 配置日志记录
 logger = logging.getLogger('app_logs')
-handler = RotatingFileHandler("system.log", maxBytes=1000000, backupCount=3)
-handler.setLevel(logging.INFO)
-formatter = logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
 # 查询系统日志
@@ -1,13 +1,12 @@
 from flask import Blueprint, jsonify, request
 from flask_mail import Message
-from app import mail, db
-from app.models import User, NotificationLog
+from app import mail
+from app.models import User
 from datetime import datetime, timedelta
-from app.utils.notifications_utils import send_email
+from app.utils.notification_queue import enqueue_emails
 import logging
 
 notifications_bp = Blueprint('notifications', __name__)
-logging.basicConfig(level=logging.INFO)
 
 # 发送租赁到期提醒
 @notifications_bp.route('/api/notifications/send_reminder', methods=['POST'])
@@ -27,48 +26,28 @@ def send_reminder():
             logging.info("No users with expiring rentals found.")
             return jsonify({"success": True, "message": "No users with expiring rentals"}), 200
 
-        failed_emails = []
-        for user in expiring_users:
-            email_subject = "Your rental service is expiring soon"
-            email_body = (
-                f"Dear {user.username},\n\n"
-                f"Your rental service will expire on {user.rental_expiry.strftime('%Y-%m-%d %H:%M:%S')} UTC. "
-                f"Please renew your service to avoid interruptions.\n\n"
-                f"Thank you for using our service."
-            )
-
-            # 使用通用邮件发送工具
-            email_sent = send_email(user.email, email_subject, email_body)
-            if not email_sent:
-                failed_emails.append(user.email)
-                # 记录通知失败的日志
-                notification_log = NotificationLog(
-                    user_id=user.id,
-                    subject=email_subject,
-                    body=email_body,
-                    status="failed",
-                    error_message="Failed to send email"
-                )
-                db.session.add(notification_log)
-            else:
-                # 记录通知成功的日志
-                notification_log = NotificationLog(
-                    user_id=user.id,
-                    subject=email_subject,
-                    body=email_body,
-                    status="success"
-                )
-                db.session.add(notification_log)
-
-        # 提交所有日志到数据库
-        db.session.commit()
-
-        if failed_emails:
-            logging.error(f"Failed to send reminder to: {', '.join(failed_emails)}")
-            return jsonify({"success": False, "message": f"Failed to send reminders to some users: {failed_emails}"}), 500
-
-        logging.info("Reminder emails sent successfully.")
-        return jsonify({"success": True, "message": "Reminder emails sent successfully"}), 200
+        messages = [
+            {
+                "recipient": user.email,
+                "subject": "Your rental service is expiring soon",
+                "body": (
+                    f"Dear {user.username},\n\n"
+                    f"Your rental service will expire on {user.rental_expiry.strftime('%Y-%m-%d %H:%M:%S')} UTC. "
+                    f"Please renew your service to avoid interruptions.\n\n"
+                    f"Thank you for using our service."
+                ),
+                "user_id": user.id
+            }
+            for user in expiring_users
+        ]
+
+        # 放入发送队列后立即返回，发送结果由 worker 批量记录到 NotificationLog
+        if not enqueue_emails(messages):
+            logging.error("Failed to queue reminder emails.")
+            return jsonify({"success": False, "message": "Failed to queue reminder emails"}), 500
+
+        logging.info(f"Queued {len(messages)} reminder email(s).")
+        return jsonify({"success": True, "message": "Reminder emails queued", "queued": len(messages)}), 200
 
     except Exception as e:
         # 捕获异常并记录日志
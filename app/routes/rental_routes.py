@@ -1,65 +1,170 @@
-from flask import Blueprint, request, jsonify 
-from app.models import SerialNumber, UserContainer, UserHistory, Rental, DockerContainer, UserTraffic, Server, User, user_server_association, RenewalRecord
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from app.models import SerialNumber, UserContainer, Rental, User, RenewalRecord
 from app.utils.email_utils import send_expiry_notification
 from app.utils.logging_utils import log_operation
+from app.utils.tasks import process_expired_rentals
+from app.utils.rental_utils import redeem_serial, rental_days_of, claim_serial
 from app import db
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from sqlalchemy import select, or_
+import json
 
 # 定义蓝图
 rental_bp = Blueprint('rental', __name__)
 
+# 租赁列表可返回的字段：字段名 -> 查询列
+RENTAL_FIELDS = {
+    "id": Rental.id,
+    "user_id": Rental.user_id,
+    "username": User.username,
+    "email": User.email,
+    "status": Rental.status,
+    "start_date": Rental.start_date,
+    "end_date": Rental.end_date,
+    "expired_at": Rental.expired_at,
+    "server_ids": Rental.server_ids,
+    "container_ids": Rental.container_ids,
+    "traffic_limit": Rental.traffic_limit,
+    "traffic_usage": Rental.traffic_usage,
+    "traffic_reset_date": Rental.traffic_reset_date,
+    "serial_number_id": Rental.serial_number_id,
+    "serial_code": SerialNumber.code,
+    "serial_number_expiry": Rental.serial_number_expiry,
+    "renewed_at": Rental.renewed_at,
+    "renewal_count": Rental.renewal_count,
+    "container_status": Rental.container_status,
+    "server_status": Rental.server_status,
+    "payment_status": Rental.payment_status,
+    "payment_date": Rental.payment_date,
+    "tenant_id": Rental.tenant_id,
+    "created_at": Rental.created_at,
+    "updated_at": Rental.updated_at
+}
+DEFAULT_RENTAL_PAGE_SIZE = 100
+MAX_RENTAL_PAGE_SIZE = 1000
+# 流式导出时每次从数据库读取的行数
+RENTAL_STREAM_CHUNK = 1000
+
+
+def _parse_list(name):
+    values = {value.strip() for raw in request.args.getlist(name) for value in raw.split(',')}
+    values.discard('')
+    return values
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _rental_query():
+    """
+    根据查询参数构造租赁查询（只选择请求的字段，按 id 倒序）
+    过滤参数：status、payment_status、user_id（均可逗号分隔）、user（用户名或邮箱前缀）、serial（序列号前缀）、
+    end_after、end_before（ISO 时间）、cursor（上一页最后一条的 id）
+    :return: (查询语句, 字段名列表)
+    :raises ValueError: 参数格式错误
+    """
+    fields = [name for name in request.args.get('fields', '').split(',') if name.strip()]
+    fields = [name.strip() for name in fields] or list(RENTAL_FIELDS)
+    unknown = [name for name in fields if name not in RENTAL_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields.insert(0, "id")  # 键集分页需要 id
+
+    user_filter = request.args.get('user', '').strip()
+    serial_filter = request.args.get('serial', '').strip()
+    query = select(*[RENTAL_FIELDS[name].label(name) for name in fields]).select_from(Rental)
+    # 只在需要时关联序列号和用户表
+    if serial_filter or "serial_code" in fields:
+        query = query.outerjoin(SerialNumber, Rental.serial_number_id == SerialNumber.id)
+    if user_filter or {"username", "email"} & set(fields):
+        query = query.outerjoin(User, Rental.user_id == User.id)
+
+    statuses = _parse_list('status')
+    if statuses:
+        query = query.where(Rental.status.in_(statuses))
+    payment_statuses = _parse_list('payment_status')
+    if payment_statuses:
+        query = query.where(Rental.payment_status.in_(payment_statuses))
+    user_ids = _parse_list('user_id')
+    if user_ids:
+        query = query.where(Rental.user_id.in_([int(value) for value in user_ids]))
+    if user_filter:
+        query = query.where(or_(User.username.startswith(user_filter, autoescape=True),
+                                User.email.startswith(user_filter, autoescape=True)))
+    if serial_filter:
+        query = query.where(SerialNumber.code.startswith(serial_filter, autoescape=True))
+    end_after = request.args.get('end_after')
+    if end_after:
+        query = query.where(Rental.end_date >= datetime.fromisoformat(end_after))
+    end_before = request.args.get('end_before')
+    if end_before:
+        query = query.where(Rental.end_date < datetime.fromisoformat(end_before))
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.where(Rental.id < int(cursor))
+    return query.order_by(Rental.id.desc()), fields
+
+
+def _stream_rentals(query, fields, ndjson):
+    """
+    以服务器端游标分块读取并逐行输出，内存占用与结果集大小无关
+    """
+    result = db.session.execute(query.execution_options(yield_per=RENTAL_STREAM_CHUNK))
+    if not ndjson:
+        yield '{"success": true, "data": ['
+    first = True
+    for row in result:
+        line = json.dumps({name: _json_value(value) for name, value in zip(fields, row)}, ensure_ascii=False)
+        if ndjson:
+            yield line + "\n"
+        else:
+            yield line if first else "," + line
+        first = False
+    if not ndjson:
+        yield ']}'
+
+
 @rental_bp.route('/api/rentals/all', methods=['GET'])
 def get_all_rentals():
     """
-    获取全部租赁关系的数据表，包含指定字段的信息，以及序列号字符串和用户名/邮箱
+    获取租赁关系列表，包含序列号字符串和用户名/邮箱
+    - 过滤：status、payment_status、user_id、user、serial、end_after、end_before
+    - 字段投影：fields=id,status,end_date（默认全部字段）
+    - 分页：按 id 倒序的键集分页，limit（默认 100，最大 1000）、cursor（上一页返回的 next_cursor）
+    - 导出：format=ndjson 或 stream=true 时不分页，流式返回全部匹配记录
     """
     try:
-        # 查询所有租赁关系，并通过 JOIN 查询序列号和用户数据
-        rentals = (
-            db.session.query(
-                Rental,
-                SerialNumber.code.label("serial_code"),
-                User.username.label("username"),
-                User.email.label("email")
+        query, fields = _rental_query()
+        output_format = request.args.get('format', 'json')
+        stream = request.args.get('stream', '').lower() in ('1', 'true')
+        if output_format not in ('json', 'ndjson'):
+            raise ValueError("format must be json or ndjson")
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid query parameter: {str(e)}"}), 400
+
+    try:
+        if output_format == 'ndjson' or stream:
+            ndjson = output_format == 'ndjson'
+            return Response(
+                stream_with_context(_stream_rentals(query, fields, ndjson)),
+                mimetype='application/x-ndjson' if ndjson else 'application/json'
             )
-            .join(SerialNumber, Rental.serial_number_id == SerialNumber.id, isouter=True)
-            .join(User, Rental.user_id == User.id, isouter=True)
-            .all()
-        )
 
-        # 序列化数据
+        limit = min(max(request.args.get('limit', DEFAULT_RENTAL_PAGE_SIZE, type=int), 1), MAX_RENTAL_PAGE_SIZE)
+        rows = db.session.execute(query.limit(limit + 1)).all()
+        next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
         rental_data = [
-            {
-                "id": rental.Rental.id,
-                "user_id": rental.Rental.user_id,
-                "username": rental.username,
-                "email": rental.email,
-                "status": rental.Rental.status,
-                "start_date": rental.Rental.start_date,
-                "end_date": rental.Rental.end_date,
-                "expired_at": rental.Rental.expired_at,
-                "server_ids": rental.Rental.server_ids,
-                "container_ids": rental.Rental.container_ids,
-                "traffic_limit": rental.Rental.traffic_limit,
-                "traffic_usage": rental.Rental.traffic_usage,
-                "traffic_reset_date": rental.Rental.traffic_reset_date,
-                "serial_number_id": rental.Rental.serial_number_id,
-                "serial_code": rental.serial_code,
-                "serial_number_expiry": rental.Rental.serial_number_expiry,
-                "renewed_at": rental.Rental.renewed_at,
-                "renewal_count": rental.Rental.renewal_count,
-                "container_status": rental.Rental.container_status,
-                "server_status": rental.Rental.server_status,
-                "payment_status": rental.Rental.payment_status,
-                "payment_date": rental.Rental.payment_date,
-                "tenant_id": rental.Rental.tenant_id,
-                "created_at": rental.Rental.created_at,
-                "updated_at": rental.Rental.updated_at
-            }
-            for rental in rentals
+            {name: _json_value(value) for name, value in zip(fields, row)}
+            for row in rows[:limit]
         ]
-
-        return jsonify({"success": True, "data": rental_data}), 200
+        return jsonify({"success": True, "data": rental_data, "next_cursor": next_cursor}), 200
 
     except Exception as e:
         log_operation(
@@ -93,125 +198,18 @@ def create_rental():
         return jsonify({"success": False, "message": "Missing required fields"}), 400
 
     try:
-        # 查找该用户是否已经有有效的租赁记录
-        existing_rental = Rental.query.filter_by(user_id=user_id, status='active').first()
-        if existing_rental:
-            # 如果用户已有租赁记录，则不能选择服务器和容器，返回错误信息
-            log_operation(
-                user_id=user_id,
-                operation="create_rental",
-                status="failed",
-                details=f"User {user_id} already has an active rental, cannot proceed with server and container selection."
-            )
-            return jsonify({"success": False, "message": "User already has an active rental. Cannot proceed with server and container selection."}), 400
-
-        # 查找对应的序列号
-        serial_number = SerialNumber.query.filter_by(code=serial_code, status='unused').first()
-        if not serial_number:
-            log_operation(
-                user_id=None,
-                operation="create_rental",
-                status="failed",
-                details=f"Invalid or used serial code: {serial_code}"
-            )
-            return jsonify({"success": False, "message": "Invalid or used serial code"}), 404
-
-        # 从序列号的前四位提取天数（例如 '180D' -> 180）
-        rental_days = int(serial_code[:3])  # 假设序列号的前4位表示租赁天数
-        if rental_days <= 0:
-            log_operation(
-                user_id=None,
-                operation="create_rental",
-                status="failed",
-                details=f"Invalid rental days in serial code: {serial_code}"
-            )
-            return jsonify({"success": False, "message": "Invalid rental days in serial code"}), 400
-
-        # 激活序列号并更新状态
-        serial_number.status = 'used'
-        serial_number.user_id = user_id
-        serial_number.start_date = datetime.utcnow()
-        serial_number.end_date = datetime.utcnow() + timedelta(days=rental_days)  # 根据序列号的天数设置结束日期
-        serial_number.used_at = datetime.utcnow()  # 更新使用时间
-        
-        # 创建租赁记录
-        rental = Rental(
-            id=None,
-            user_id=user_id,
-            tenant_id=None,
-            serial_number_id=serial_number.id,
-            serial_number_expiry=serial_number.end_date,
-            status='active',
-            payment_status='pending',
-            payment_date=None,
-            start_date=serial_number.start_date,
-            end_date=serial_number.end_date,
-            expired_at=None,
-            traffic_limit=traffic_limit,
-            traffic_usage=0,
-            traffic_reset_date=None,
-            renewal_count=0,
-            renewed_at=None,
-            container_status='active',
-            server_status='active',
-            server_ids=[server_id],
-            container_ids=[container_id],
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
-        db.session.add(rental)
-
-        # 更新容器信息
-        docker_container = DockerContainer.query.get(container_id)
-        if docker_container:
-            docker_container.status = "running"
-            docker_container.user_id = user_id
-
-        # 更新服务器的用户数
-        server = Server.query.get(server_id)  # 查询 `servers` 表
-        if server:
-            server.user_count += 1
-
-        # **新增：将容器数据写入 `user_containers` 表**
-        user_container = UserContainer(
-            id=None,
-            user_id=user_id,
-            container_id=container_id,
-            status='active',
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow(),
-            expiry_date=serial_number.end_date
-        )
-        db.session.add(user_container)
-
-        # 新增：更新 User 表的 rental_expiry
-        user = User.query.get(user_id)
-        if user:
-            user.rental_expiry = serial_number.end_date  # 更新租赁过期时间为序列号的结束时间
-            db.session.commit()  # 提交 User 表的更新
-
-        # 新增：检查并插入 user_server_association 关系表（避免重复）
-        existing_association = db.session.query(user_server_association).filter_by(user_id=user_id, server_id=server_id).first()
-        if not existing_association:
-            # 如果没有找到相同的记录，插入新记录
-            db.session.execute(
-                user_server_association.insert().values(user_id=user_id, server_id=server_id)
-            )
-
-        # 提交事务
-        db.session.commit()
-
+        # 领取序列号、创建租赁和关联记录在同一事务中完成
+        result, status_code = redeem_serial(serial_code, user_id, server_id, container_id, traffic_limit=traffic_limit)
         log_operation(
-            user_id=user_id,
+            user_id=user_id if result["success"] else None,
             operation="create_rental",
-            status="success",
-            details=f"Rental created for user {user_id} with serial code {serial_code}"
+            status="success" if result["success"] else "failed",
+            details=f"Rental created for user {user_id} with serial code {serial_code}" if result["success"]
+            else f"{result['message']}: serial code {serial_code}, user {user_id}"
         )
-
-        return jsonify({"success": True, "message": "Rental created successfully"}), 200
+        return jsonify(result), status_code
 
     except Exception as e:
-        db.session.rollback()
         log_operation(
             user_id=None,
             operation="create_rental",
@@ -242,20 +240,9 @@ def renew_rental():
         return jsonify({"success": False, "message": "Missing required data"}), 400
 
     try:
-        # 查找新的序列号，并确保是未使用的
-        serial_number = SerialNumber.query.filter_by(code=serial_code, status='unused').first()
-        if not serial_number:
-            log_operation(
-                user_id=None,
-                operation="renew_rental",
-                status="failed",
-                details=f"Invalid or used serial code: {serial_code}"
-            )
-            return jsonify({"success": False, "message": "Invalid or used serial code"}), 404
-
-        # 获取租赁时长，假设序列号前4个字符代表天数（例如：180D -> 180）
-        rental_days = int(serial_code[:3])  # 提取租赁天数（例如 '180D' -> 180）
-        if rental_days <= 0:
+        # 获取租赁时长，序列号前3个字符代表天数（例如：180XXXX -> 180）
+        rental_days = rental_days_of(serial_code)
+        if rental_days is None:
             log_operation(
                 user_id=None,
                 operation="renew_rental",
@@ -264,9 +251,10 @@ def renew_rental():
             )
             return jsonify({"success": False, "message": "Invalid rental days in serial code"}), 400
 
-        # 查找用户的租赁记录，不再验证serial_code是否属于此用户
-        rental = Rental.query.filter_by(user_id=user_id, status='active').first()
+        # 查找并锁定用户的租赁记录，不再验证serial_code是否属于此用户
+        rental = Rental.query.filter_by(user_id=user_id, status='active').with_for_update().first()
         if not rental:
+            db.session.rollback()
             log_operation(
                 user_id=None,
                 operation="renew_rental",
@@ -281,12 +269,17 @@ def renew_rental():
         # 计算新的 `end_date`，即在当前 `end_date` 上加上续约的天数
         new_end_date = new_start_date + timedelta(days=rental_days)
 
-        # 更新序列号的 `start_date` 和 `end_date`
-        serial_number.status = 'used'
-        serial_number.user_id = rental.user_id
-        serial_number.start_date = new_start_date  # 新的 `start_date` 是当前租赁的结束时间
-        serial_number.end_date = new_end_date  # 新的 `end_date` 是当前租赁结束时间加上续约时长
-        serial_number.used_at = datetime.utcnow()  # 更新使用时间
+        # 原子地领取序列号，并发请求中只有一个能成功
+        serial_number_id = claim_serial(serial_code, rental.user_id, new_start_date, new_end_date)
+        if serial_number_id is None:
+            db.session.rollback()
+            log_operation(
+                user_id=None,
+                operation="renew_rental",
+                status="failed",
+                details=f"Invalid or used serial code: {serial_code}"
+            )
+            return jsonify({"success": False, "message": "Invalid or used serial code"}), 404
 
         # 更新租赁记录的 `end_date`
         rental.end_date = new_end_date
@@ -294,8 +287,8 @@ def renew_rental():
 
         # 创建续费记录并保存
         renewal_record = RenewalRecord(
-            user_id=serial_number.user_id,
-            serial_number_id=serial_number.id,
+            user_id=rental.user_id,
+            serial_number_id=serial_number_id,
             renewal_amount=renewal_amount,
             renewal_period=rental_days,  # 续费时长以序列号为准
             renewal_date=datetime.utcnow(),
@@ -304,14 +297,14 @@ def renew_rental():
         db.session.add(renewal_record)
 
         # 更新容器的过期时间为新的租赁结束时间
-        user_container = UserContainer.query.filter_by(user_id=serial_number.user_id, container_id=rental.container_ids[0]).first()
+        user_container = UserContainer.query.filter_by(user_id=rental.user_id, container_id=rental.container_ids[0]).first()
         if user_container:
             user_container.expiry_date = rental.end_date  # 更新容器的过期时间为新的租赁结束时间
 
         # 新增：将容器数据写入 `user_containers` 表
         new_user_container = UserContainer(
             id=None,
-            user_id=serial_number.user_id,
+            user_id=rental.user_id,
             container_id=rental.container_ids[0],  # 假设容器与租赁的关联
             status='active',
             created_at=datetime.utcnow(),
@@ -321,7 +314,7 @@ def renew_rental():
         db.session.add(new_user_container)
 
         # 新增：更新 User 表的 rental_expiry
-        user = User.query.get(serial_number.user_id)
+        user = User.query.get(rental.user_id)
         if user:
             user.rental_expiry = rental.end_date  # 更新租赁过期时间为最新的结束时间
 
@@ -412,7 +405,8 @@ def send_expiry_notifications():
         email_sent = send_expiry_notification(
             email=email,
             days_to_expiry=days_to_expiry,
-            expiry_date=expiry_date
+            expiry_date=expiry_date,
+            user_id=user_id
         )
 
         if not email_sent:
@@ -428,10 +422,10 @@ def send_expiry_notifications():
             user_id=user_id,
             operation="send_expiry_notification",
             status="success",
-            details=f"Expiry notification sent to {email}"
+            details=f"Expiry notification queued for {email}"
         )
 
-        return jsonify({"success": True, "message": "Expiry notification sent successfully"}), 200
+        return jsonify({"success": True, "message": "Expiry notification queued"}), 200
 
     except Exception as e:
         log_operation(
@@ -448,48 +442,25 @@ def send_expiry_notifications():
 def check_expiry():
     """
     检测租赁到期的用户并释放资源
+    分批处理，每批单独提交；可选参数 batch_size、max_batches、after_id（上次返回的 last_id）
     """
     try:
-        expired_rentals = Rental.query.filter(
-            Rental.status == 'active',
-            Rental.end_date < datetime.utcnow()
-        ).all()
-
-        if not expired_rentals:
-            log_operation(user_id=None, operation="rental_expiry", details="No expired rentals found.")
-            return jsonify({"success": True, "message": "No expired rentals"}), 200
-
-        for rental in expired_rentals:
-            rental.status = 'expired'
-
-            # 删除用户的容器
-            user_containers = DockerContainer.query.filter_by(user_id=rental.user_id).all()
-            for container in user_containers:
-                db.session.delete(container)
-
-            # 删除用户的流量记录
-            user_traffic = UserTraffic.query.filter_by(user_id=rental.user_id).all()
-            for traffic in user_traffic:
-                db.session.delete(traffic)
-
-            # 删除租赁历史记录
-            user_history = UserHistory.query.filter_by(user_id=rental.user_id).all()
-            for history in user_history:
-                db.session.delete(history)
-
-            log_operation(
-                user_id=rental.user_id,
-                operation="rental_expiry",
-                details=f"Rental expired for user {rental.user_id} and resources released"
-            )
-
-        db.session.commit()
-        return jsonify({"success": True, "message": "Expired rentals processed successfully"}), 200
+        batch_size = request.args.get('batch_size', type=int)
+        max_batches = request.args.get('max_batches', type=int)
+        after_id = request.args.get('after_id', 0, type=int)
+        if (batch_size is not None and batch_size <= 0) or (max_batches is not None and max_batches <= 0):
+            return jsonify({"success": False, "message": "batch_size and max_batches must be positive"}), 400
+
+        stats = process_expired_rentals(batch_size=batch_size, max_batches=max_batches, after_id=after_id)
+        if not stats["processed"]:
+            return jsonify({"success": True, "message": "No expired rentals", **stats}), 200
+        return jsonify({"success": True, "message": "Expired rentals processed successfully", **stats}), 200
     except Exception as e:
         db.session.rollback()  # 回滚事务
         log_operation(
             user_id=None,
             operation="rental_expiry",
+            status="failed",
             details=f"Error processing expired rentals: {str(e)}"
         )
         return jsonify({"success": False, "message": f"Database error: {str(e)}"}), 500
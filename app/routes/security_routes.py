@@ -4,7 +4,6 @@ import logging
 
 # 定义蓝图
 security_bp = Blueprint('security', __name__)
-logging.basicConfig(level=logging.INFO)
 
 @security_bp.route('/api/security/user_acl_info/<int:user_id>', methods=['GET'])
 def get_user_acl_info(user_id):
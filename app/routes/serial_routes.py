@@ -1,57 +1,63 @@
-from flask import Blueprint, jsonify, request 
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from app.models import SerialNumber
 from app import db
-import random
-import string
-from datetime import datetime, timedelta
+from app.config import Config
+from app.utils.serial_utils import create_serial_numbers
+from app.utils.serial_lookup import get_serial_status, invalidate_serial_status, publish_serials_changed
+from app.utils.logging_utils import log_operation
+from datetime import datetime
 import logging
-import redis
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-
-# 初始化 Flask-Limiter
-limiter = Limiter(get_remote_address)
-
-# 初始化 Redis 客户端
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
+from app.utils.rate_limit import check_rate_limits, record_failures, too_many_requests, window_count
 
 # 定义蓝图
 serial_bp = Blueprint('serial', __name__)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# 配置限流，每分钟最多 5 次请求
-@limiter.limit("5 per minute")
 @serial_bp.route('/api/serial/check/<serial_code>', methods=['GET'])
 def check_serial(serial_code):
     """
-    检查序列号状态，并侦测暴力猜测行为
+    检查序列号状态，并限制暴力猜测：
+    - 每个 IP 的查询次数（RATE_LIMIT_SERIAL_CHECK）
+    - 每个 IP 查询不存在序列号的次数（RATE_LIMIT_SERIAL_CHECK_FAILURES）
+    - 同一前缀（前三位，即租赁天数）的失败查询次数，防止多个 IP 分布式猜测（RATE_LIMIT_SERIAL_PREFIX_FAILURES）；
+      该计数是所有 IP 合计，只对窗口内已有失败记录的 IP 生效，没有失败记录的正常查询不受影响
     """
     ip_address = request.remote_addr
-    
-    # 检查暴力行为
-    if is_suspected_brute_force(ip_address):
-        log_operation(None, "check_serial", "failed", f"Brute force attempt detected from IP: {ip_address}")
-        return jsonify({"success": False, "message": "Too many failed attempts. You are temporarily banned."}), 403
-    
+    prefix = serial_code[:3]
+
+    # 检查失败次数（不计数），并计入本次查询
+    rules = [
+        ("serial_check_failures", ip_address, 0),
+        ("serial_check", ip_address),
+    ]
+    suspect = window_count("serial_check_failures", ip_address) > 0
+    if suspect:
+        rules.append(("serial_prefix_failures", prefix, 0))
+    limited = check_rate_limits(rules)
+    if not limited.allowed:
+        detail = f" (prefix {prefix} under distributed guessing)" if suspect else ""
+        log_operation(None, "check_serial", "failed", f"Brute force attempt detected from IP: {ip_address}{detail}")
+        return too_many_requests(limited, "Too many attempts. Please try again later.")
+
     try:
-        # 查找序列号
-        serial_number = SerialNumber.query.filter_by(code=serial_code).first()
+        # 查找序列号：先查状态缓存和布隆过滤器，不存在的序列号不访问数据库
+        serial_number, _ = get_serial_status(serial_code)
         if not serial_number:
-            log_failed_attempt(ip_address)
+            record_failures([("serial_check_failures", ip_address), ("serial_prefix_failures", prefix)])
             return jsonify({"success": False, "message": "Serial number not found"}), 404
 
         # 检查序列号是否过期
         current_time = datetime.utcnow()
-        expired = serial_number.expires_at < current_time if serial_number.expires_at else False
+        expires_at = serial_number["expires_at"]
+        expired = expires_at < current_time if expires_at else False
 
         # 返回序列号的详细信息
         return jsonify({
             "success": True,
-            "serial_code": serial_number.code,
-            "status": serial_number.status,
-            "valid_days": serial_number.valid_days,
-            "created_at": serial_number.created_at.isoformat(),
-            "expires_at": serial_number.expires_at.isoformat() if serial_number.expires_at else None,
+            "serial_code": serial_number["serial_code"],
+            "status": serial_number["status"],
+            "valid_days": serial_number["valid_days"],
+            "created_at": serial_number["created_at"].isoformat() if serial_number["created_at"] else None,
+            "expires_at": expires_at.isoformat() if expires_at else None,
             "expired": expired
         }), 200
     except Exception as e:
@@ -63,48 +69,47 @@ def check_serial(serial_code):
 @serial_bp.route('/api/serial/generate', methods=['POST'])
 def generate_serial():
     """
-    生成序列号
+    批量生成序列号，format=csv（查询参数或请求体）时边生成边以 CSV 流式返回
     """
-    data = request.json
-    count = data.get('count', 1)  # 序列号数量
-    valid_days = data.get('valid_days', 30)  # 序列号有效天数
-    prefix = data.get('prefix', '')  # 序列号的前半部分，从请求的 JSON 获取
+    data = request.json or {}
+    try:
+        count = int(data.get('count', 1))  # 序列号数量
+        valid_days = int(data.get('valid_days', 30))  # 序列号有效天数
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Invalid parameters"}), 400
+    prefix = data.get('prefix', '') or ''  # 序列号的前半部分，从请求的 JSON 获取
+    distributor_id = data.get('distributor_id')
+    output_format = (request.args.get('format') or data.get('format') or 'json').lower()
 
     # 序列号后半部分长度
     serial_length = 6  # 后半部分长度可以自行定义为6位，或者根据需求调整
 
     # 参数验证
-    if count <= 0 or valid_days <= 0:
+    if count <= 0 or valid_days <= 0 or output_format not in ('json', 'csv'):
         return jsonify({"success": False, "message": "Invalid parameters"}), 400
+    if count > Config.SERIAL_GENERATE_MAX_COUNT:
+        return jsonify({"success": False, "message": f"count must not exceed {Config.SERIAL_GENERATE_MAX_COUNT}"}), 400
+
+    batches = create_serial_numbers(count, valid_days, prefix=prefix, length=serial_length, distributor_id=distributor_id)
+
+    if output_format == 'csv':
+        def _csv():
+            yield "serial_code\n"
+            try:
+                for codes in batches:
+                    yield "\n".join(codes) + "\n"
+            except Exception as e:
+                # 响应已开始发送，无法再返回错误状态码；已返回的序列号均已提交
+                logging.error(f"Error generating serial numbers: {e}")
+
+        return Response(
+            stream_with_context(_csv()),
+            mimetype='text/csv',
+            headers={"Content-Disposition": f"attachment; filename=serial_numbers_{datetime.utcnow():%Y%m%d%H%M%S}.csv"}
+        )
 
-    serial_numbers = []
     try:
-        for _ in range(count):
-            # 确保序列号唯一性
-            while True:
-                # 拼接前半部分和后半部分（6位随机字符）
-                suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=serial_length))
-                code = prefix + suffix  # 完整的序列号
-
-                # 检查序列号是否唯一
-                existing_serial = SerialNumber.query.filter_by(code=code).first()
-                if not existing_serial:  # 如果序列号不重复，跳出循环
-                    break
-
-            # 创建新的序列号对象并加入数据库
-            expires_at = datetime.utcnow() + timedelta(days=valid_days)  # 设置过期时间
-            serial_number = SerialNumber(
-                code=code,
-                valid_days=valid_days,
-                status='unused',  # 默认状态为 "unused"
-                activated_at=datetime.utcnow(),
-                expires_at=expires_at
-            )
-            db.session.add(serial_number)
-            serial_numbers.append(code)  # 将生成的序列号加入返回的列表
-
-        # 提交事务
-        db.session.commit()
+        serial_numbers = [code for codes in batches for code in codes]
         logging.info(f"Generated {count} serial numbers successfully.")
         return jsonify({"success": True, "serial_numbers": serial_numbers}), 201
     except Exception as e:
@@ -112,24 +117,6 @@ def generate_serial():
         logging.error(f"Error generating serial numbers: {e}")
         return jsonify({"success": False, "message": f"Error generating serial numbers: {str(e)}"}), 500
 
-# 检测暴力猜解行为
-def is_suspected_brute_force(ip_address):
-    """
-    判断某个 IP 地址是否发生暴力猜解行为
-    """
-    failed_attempts = redis_client.get(f"failed_attempts:{ip_address}")
-    if failed_attempts and int(failed_attempts) > 5:  # 超过 5 次失败尝试
-        return True
-    return False
-
-def log_failed_attempt(ip_address):
-    """
-    记录每次失败的尝试
-    """
-    redis_client.incr(f"failed_attempts:{ip_address}")
-    redis_client.expire(f"failed_attempts:{ip_address}", 300)  # 设置 5 分钟过期时间
-
-
 # 用户封禁或删除
 def ban_user(user_id):
     """
@@ -161,6 +148,7 @@ def update_serial_number(id):
         serial.status = status if status else serial.status
         serial.expires_at = expires_at if expires_at else serial.expires_at
         db.session.commit()
+        invalidate_serial_status([serial.code])
         return jsonify({"success": True, "message": "Serial number updated successfully"}), 200
     except Exception as e:
         db.session.rollback()
@@ -194,6 +182,10 @@ def delete_serial_numbers():
             db.session.delete(serial)
         
         db.session.commit()
+
+        # 清除状态缓存，并通知所有进程重建布隆过滤器
+        invalidate_serial_status([serial.code for serial in serials_to_delete])
+        publish_serials_changed("deleted")
         return jsonify({"success": True, "message": f"{len(serials_to_delete)} serial numbers deleted successfully"}), 200
 
     except Exception as e:
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app.models import Server, ServerCategory
 from app.utils.server_utils import ping_server, monitor_server_health  # 更新为新的导入
+from app.utils.resource_index import find_server_dependents
 from app import db
 import logging
 import subprocess
@@ -251,6 +252,22 @@ def server_status(server_id):
         return jsonify({"success": False, "message": f"Error getting server status: {str(e)}"}), 500
 
 
+# 查询依赖服务器的租赁和 ACL 配置
+@server_bp.route('/api/server/<int:server_id>/dependents', methods=['GET'])
+def server_dependents(server_id):
+    """
+    查询依赖指定服务器的租赁和 ACL 配置（故障切换时使用）
+    查询参数 active_only：默认 true，只返回有效的租赁和 ACL 配置
+    """
+    active_only = request.args.get('active_only', 'true').lower() != 'false'
+    try:
+        dependents = find_server_dependents(server_id, active_only=active_only)
+        return jsonify({"success": True, "server_id": server_id, "data": dependents}), 200
+    except Exception as e:
+        logging.error(f"Error getting dependents for server {server_id}: {e}")
+        return jsonify({"success": False, "message": f"Error getting server dependents: {str(e)}"}), 500
+
+
 # 监控服务器健康
 @server_bp.route('/api/server/health_check', methods=['GET'])
 def health_check():
@@ -258,8 +275,12 @@ def health_check():
     监控所有服务器的健康状况
     """
     try:
-        # 监控所有服务器的健康状况
-        results = monitor_server_health()
+        # 并发探测所有服务器，探测包数量、超时和并发数可通过查询参数覆盖
+        results = monitor_server_health(
+            count=request.args.get('count', type=int),
+            timeout=request.args.get('timeout', type=float),
+            concurrency=request.args.get('concurrency', type=int)
+        )
         logging.info("Health check completed successfully")
         return jsonify({"success": True, "health_check_results": results}), 200
     except Exception as e:
@@ -1,13 +1,14 @@
 from flask import Blueprint, jsonify, request
 from app.models import SerialNumber, UserContainer, UserHistory, Rental, DockerContainer, UserTraffic, Server, User
 from app import db
+from app.utils.logging_utils import get_audit_metrics
+from app.utils.log_config import get_logging_metrics
 from datetime import datetime, timedelta
 import logging
 
 # 定义蓝图
 system_bp = Blueprint('system', __name__)
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # 获取系统概览
 @system_bp.route('/system/overview', methods=['GET'])
@@ -142,3 +143,21 @@ def set_server_category():
     except Exception as e:
         logging.error(f"Error updating server category: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# 审计日志写入指标
+@system_bp.route('/system/audit_metrics', methods=['GET'])
+def audit_metrics():
+    """
+    审计日志队列深度、丢弃数、写入数等指标（本进程）
+    """
+    return jsonify({"success": True, "data": get_audit_metrics()}), 200
+
+
+# 应用日志队列指标
+@system_bp.route('/system/log_metrics', methods=['GET'])
+def log_metrics():
+    """
+    应用日志（QueueHandler）队列深度与丢弃数（本进程）
+    """
+    return jsonify({"success": True, "data": get_logging_metrics()}), 200
@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request
-import requests  # 正确导入 requests 库
 from app import db
+from app.utils.traffic_utils import extract_ip_from_container_name, fetch_traffic_metrics
 from app.models import Server, DockerContainer, DockerContainerTraffic, ServerTraffic, ServerTrafficMonitoring, UserTraffic, Rental
 from datetime import datetime, timedelta
 import logging
@@ -200,16 +200,6 @@ def save_traffic():
         db.session.rollback()  # 回滚事务
         return jsonify({'error': 'Internal server error'}), 500
 
-# 从容器名称提取 IP 地址
-def extract_ip_from_container_name(container_name):
-    """
-    从容器名称中提取 IP 地址，假设容器名称格式为 "120_79_137_248_derper_4"
-    """
-    parts = container_name.split('_')
-    if len(parts) >= 4:  # 确保容器名称包含 IP 地址
-        return '.'.join(parts[:4])  # 提取前三个部分并将它们连接成 IP 地址
-    return None  # 如果容器名称格式不正确，返回 None
-
 # 实时流量监控（所有容器）
 @traffic_bp.route('/api/traffic/realtime', methods=['GET'])
 def realtime_traffic():
@@ -283,38 +273,6 @@ def get_realtime_traffic(container_id):
         logging.error(f"Error fetching realtime traffic for container {container_id}: {str(e)}")
         return jsonify({"success": False, "message": f"Error fetching realtime traffic: {str(e)}"}), 500
 
-# 从 metrics 提取流量数据
-def fetch_traffic_metrics(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        metrics = {}
-
-        # 处理返回的多行文本数据
-        for line in response.text.splitlines():
-            # 检查上传流量
-            if "node_network_transmit_bytes_total" in line:
-                # 解析 eth0 设备的上传流量
-                if 'eth0' in line:
-                    metrics["upload_traffic"] = float(line.split(" ")[1])
-
-            # 检查下载流量
-            elif "node_network_receive_bytes_total" in line:
-                # 解析 eth0 设备的下载流量
-                if 'eth0' in line:
-                    metrics["download_traffic"] = float(line.split(" ")[1])
-
-        # 如果找到了上传和下载流量，就返回 metrics
-        if "upload_traffic" in metrics and "download_traffic" in metrics:
-            return metrics
-        else:
-            logging.error("Could not extract traffic data from metrics.")
-            return None
-
-    except Exception as e:
-        logging.error(f"Error fetching metrics from {url}: {str(e)}")
-        return None
-
 @traffic_bp.route('/api/traffic/history/<int:user_id>', methods=['GET'])
 def traffic_history(user_id):
     """
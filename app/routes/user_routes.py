@@ -4,13 +4,12 @@ from app.utils.auth_utils import hash_password, check_password, generate_jwt, ge
 from app.utils.email_utils import send_verification_email, validate_verification_code
 from app import db
 from app.utils.logging_utils import log_operation  # 引入统一日志记录工具
-import logging
+from app.utils.rate_limit import check_rate_limits, record_failures, reset_rate_limit, too_many_requests, rate_limit
 import os
 import traceback
 
 # 定义蓝图
 user_bp = Blueprint('user', __name__)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # 验证必填字段
 def validate_required_fields(data, fields):
@@ -123,8 +122,18 @@ def add_user():
 
     email = data.get('email')
     verification_code = data.get('verification_code')
+    if not isinstance(email, str):
+        log_operation(None, "add_user", "failed", "Invalid email type")
+        return jsonify({"success": False, "message": "Invalid email"}), 400
+
+    # 验证码输错次数过多时暂时禁止，防止暴力猜测验证码
+    limited = check_rate_limits([("verification_code_failures", email.strip().lower(), 0)])
+    if not limited.allowed:
+        log_operation(None, "add_user", "failed", f"Too many invalid verification codes for email: {email}")
+        return too_many_requests(limited, "Too many invalid verification codes. Please try again later.")
 
     if not validate_verification_code(email, verification_code):
+        record_failures([("verification_code_failures", email.strip().lower())])
         log_operation(None, "add_user", "failed", f"Invalid or expired verification code for email: {email}")
         return jsonify({"success": False, "message": "Invalid or expired verification code"}), 400
 
@@ -148,6 +157,7 @@ def add_user():
 
 
 @user_bp.route('/api/login', methods=['POST'])
+@rate_limit("login")
 def login():
     data = request.json
     required_fields = ['email', 'password']
@@ -159,13 +169,26 @@ def login():
 
     email = data.get('email')
     password = data.get('password')
+    if not isinstance(email, str):
+        log_operation(None, "login", "failed", "Invalid email type")
+        return jsonify({"success": False, "message": "Invalid email"}), 400
+    account_key = email.strip().lower()
+
+    # 本 IP 的登录请求数由 @rate_limit("login") 限制；这里检查该账号的失败次数（不计数）
+    limited = check_rate_limits([("login_failures", account_key, 0)])
+    if not limited.allowed:
+        log_operation(None, "login", "failed", f"Too many login attempts for email: {email}")
+        return too_many_requests(limited, "Too many login attempts. Please try again later.")
 
     # 查找用户
     user = User.query.filter_by(email=email).first()
     if not user or not check_password(password, user.password):
+        record_failures([("login_failures", account_key)])
         log_operation(None, "login", "failed", f"Invalid credentials for email: {email}")
         return jsonify({"success": False, "message": "Invalid credentials"}), 401
 
+    reset_rate_limit("login_failures", account_key)
+
     # 更新 last_login 字段为当前时间
     user.last_login = db.func.now()  # 使用数据库的当前时间函数
 
@@ -204,58 +227,10 @@ def login():
         "user": user_data
     }), 200
 
-    data = request.json
-    required_fields = ['email', 'password']
-    missing_fields = validate_required_fields(data, required_fields)
-
-    if missing_fields:
-        log_operation(None, "login", "failed", f"Missing fields: {', '.join(missing_fields)}")
-        return jsonify({"success": False, "message": f"Missing fields: {', '.join(missing_fields)}"}), 400
-
-    email = data.get('email')
-    password = data.get('password')
-
-    # 查找用户
-    user = User.query.filter_by(email=email).first()
-    if not user or not check_password(password, user.password):
-        log_operation(None, "login", "failed", f"Invalid credentials for email: {email}")
-        return jsonify({"success": False, "message": "Invalid credentials"}), 401
-
-    # 生成 JWT 和 Refresh Token
-    token = generate_jwt({"user_id": user.id})
-    refresh_token = generate_refresh_token({"user_id": user.id})
-
-    # 日志记录
-    log_operation(user.id, "login", "success", f"Login successful for email: {email}")
-    
-    # 构造用户信息返回
-    user_data = {
-        'id': user.id,
-        'username': user.username,
-        'email': user.email,
-        'role': user.role,
-        'rental_expiry': user.rental_expiry if user.rental_expiry is None else user.rental_expiry.strftime('%Y-%m-%d %H:%M:%S'),
-        'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'updated_at': user.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'is_banned': user.is_banned,  # 0 或 1
-        'banned_reason': user.banned_reason if user.banned_reason else None,
-        'last_login': user.last_login.strftime('%Y-%m-%d %H:%M:%S') if user.last_login else None,
-        'is_verified': user.is_verified,  # 0 或 1
-        'verification_token': user.verification_token if user.verification_token else None,
-        'password_encrypted': user.password_encrypted  # 0 或 1
-    }
-    
-    return jsonify({
-        "success": True,
-        "message": "Login successful",
-        "token": token,
-        "refresh_token": refresh_token,
-        "user": user_data
-    }), 200
-
 
 # 发送邮箱验证码
 @user_bp.route('/api/send_verification_email', methods=['POST'])
+@rate_limit("verification_email_ip")
 def send_verification_email_route():
     data = request.json
     email = data.get('email')
@@ -263,12 +238,21 @@ def send_verification_email_route():
     if not email:
         log_operation(None, "send_verification_email", "failed", "Email is required")
         return jsonify({"success": False, "message": "Email is required"}), 400
+    if not isinstance(email, str):
+        log_operation(None, "send_verification_email", "failed", "Invalid email type")
+        return jsonify({"success": False, "message": "Invalid email"}), 400
 
     existing_user = User.query.filter_by(email=email).first()
     if existing_user:
         log_operation(None, "send_verification_email", "failed", f"Attempt to send verification code to registered email: {email}")
         return jsonify({"success": False, "message": "Email already registered"}), 400
 
+    # 限制同一邮箱的发送频率（同一 IP 的发送频率由 @rate_limit("verification_email_ip") 限制）
+    limited = check_rate_limits([("verification_email", email.strip().lower())])
+    if not limited.allowed:
+        log_operation(None, "send_verification_email", "failed", f"Verification email rate limited for {email}")
+        return too_many_requests(limited, "Verification email requested too frequently. Please try again later.")
+
     success = send_verification_email(email)
     if success:
         log_operation(None, "send_verification_email", "success", f"Verification email sent successfully to {email}")
@@ -0,0 +1,1002 @@
+import json
+import logging
+import operator
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+import redis
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.orm import Session
+from app import db
+from app.config import Config
+from app.models import AlarmRule, AlarmLog, SystemAlert
+from app.utils.event_utils import publish_alert_event
+from app.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 支持的比较运算符
+COMPARATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# 告警条件语法：<指标名> [<运算符> <阈值>] [for <时长><s|m|h>]
+# 例如 "cpu_usage"（阈值取 threshold 列，运算符默认 >）、"memory_usage >= 90 for 5m"
+CONDITION_RE = re.compile(
+    r'^\s*(?P<metric>[A-Za-z_][A-Za-z0-9_]*)'
+    r'(?:\s*(?P<comparator>>=|<=|==|!=|>|<)\s*(?P<threshold>-?\d+(?:\.\d+)?))?'
+    r'(?:\s+for\s+(?P<duration>\d+)\s*(?P<unit>[smh]))?\s*$',
+    re.IGNORECASE
+)
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+# 告警设置页保存的开关与参数规则，不是指标条件
+SETTING_CONDITIONS = {
+    "check_interval",
+    "server_health", "docker_health", "traffic_monitor", "email_notify",
+    "server_health_check", "docker_health_check", "traffic_alert_switch", "email_notification_switch",
+}
+
+# 没有配置任何规则时使用的默认规则（与原先硬编码的阈值一致）
+DEFAULT_RULES = [
+    {"name": "High CPU usage detected!", "alert_condition": "cpu_usage", "threshold": Config.HIGH_LOAD_THRESHOLD, "severity": "high"},
+    {"name": "High memory usage detected!", "alert_condition": "memory_usage", "threshold": 80.0, "severity": "high"},
+    {"name": "Disk usage is critically high!", "alert_condition": "disk_usage", "threshold": 90.0, "severity": "critical"},
+    {"name": "High server load detected!", "alert_condition": "load_average", "threshold": 5.0, "severity": "high"},
+]
+
+
+class CompiledRule:
+    """
+    编译后的告警规则（评估计划中的一项）
+    """
+    __slots__ = ("rule_id", "name", "metric", "comparator", "threshold", "duration", "severity", "check")
+
+    def __init__(self, rule_id, name, metric, comparator, threshold, duration, severity):
+        self.rule_id = rule_id
+        self.name = name
+        self.metric = metric
+        self.comparator = comparator
+        self.threshold = threshold
+        self.duration = duration
+        self.severity = severity
+        self.check = COMPARATORS[comparator]
+
+    def describe(self, value):
+        """
+        生成告警消息
+        """
+        message = f"{self.name}: {self.metric} {value} {self.comparator} {self.threshold}"
+        if self.duration:
+            message += f" for {int(self.duration.total_seconds())}s"
+        return message
+
+
+def compile_rule(rule_id, name, alert_condition, threshold, severity="medium"):
+    """
+    把一条规则编译为评估计划项
+    :return: CompiledRule；开关类规则或无法解析的条件返回 None
+    """
+    if not alert_condition or alert_condition.strip() in SETTING_CONDITIONS:
+        return None
+    match = CONDITION_RE.match(alert_condition)
+    if not match:
+        logger.warning(f"Ignoring alarm rule {rule_id} with unsupported condition: {alert_condition!r}")
+        return None
+
+    value = match.group("threshold")
+    if value is None:
+        if threshold is None:
+            logger.warning(f"Ignoring alarm rule {rule_id} without threshold: {alert_condition!r}")
+            return None
+        value = threshold
+    duration = timedelta(seconds=int(match.group("duration")) * DURATION_UNITS[match.group("unit").lower()]) \
+        if match.group("duration") else timedelta(0)
+
+    return CompiledRule(
+        rule_id=rule_id,
+        name=name,
+        metric=match.group("metric"),
+        comparator=match.group("comparator") or ">",
+        threshold=float(value),
+        duration=duration,
+        severity=severity or "medium"
+    )
+
+
+def compile_rules(rules):
+    """
+    把 AlarmRule 行（或同结构的字典）编译为按指标分组的评估计划
+    :return: {指标名: [CompiledRule]}
+    """
+    plan = {}
+    for rule in rules:
+        get = rule.get if isinstance(rule, dict) else lambda key: getattr(rule, key, None)
+        compiled = compile_rule(get("id"), get("name"), get("alert_condition"), get("threshold"), get("severity"))
+        if compiled:
+            plan.setdefault(compiled.metric, []).append(compiled)
+    return plan
+
+
+DEFAULT_PLAN = compile_rules(DEFAULT_RULES)
+
+
+def _to_number(value):
+    """
+    把指标值转换为浮点数，兼容 "85%" 这类字符串
+    """
+    if isinstance(value, str):
+        value = value.strip().rstrip('%')
+    return float(value)
+
+
+class AlertRuleEngine:
+    """
+    告警规则引擎：
+    - 把启用的 AlarmRule 编译为内存中的评估计划，只有规则变更时才重新编译；
+    - 以流式方式逐条评估指标样本，按 (规则, 服务器) 维护持续超限状态以支持 "for N 分钟" 条件；
+    - 触发的告警先缓存，批量交给 AlertDeduplicator（去重、滞回、抖动抑制）；告警打开后每个样本都上报，
+      超限累加出现次数，恢复计入解除次数，告警解除后不再跟踪该序列；新产生的告警同时写入 AlarmLog。
+    """
+
+    def __init__(self, refresh_interval=None, flush_size=None):
+        self.refresh_interval = Config.ALERT_RULE_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        self.flush_size = flush_size or Config.ALERT_FLUSH_BATCH_SIZE
+        self._lock = threading.RLock()
+        self._plan = {}
+        self._fingerprint = None
+        self._checked_at = 0.0
+        # (rule_id 或指标名, server_id) -> {"since": 首次超限时间, "fired": 是否已上报, "recovered": 最近样本是否恢复}
+        self._series = {}
+
+    @property
+    def plan(self):
+        """
+        当前评估计划；数据库中没有任何指标规则时使用 DEFAULT_PLAN
+        """
+        return self._plan or DEFAULT_PLAN
+
+    def refresh(self, session=None, force=False):
+        """
+        规则有变更时重新编译评估计划。
+        变更通过 (规则数, 最大 ID, 最近更新时间) 指纹检测，且最多每 refresh_interval 秒检查一次。
+        :return: 是否重新编译了计划
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return False
+
+        session = session or db.session
+        fingerprint = tuple(session.query(
+            func.count(AlarmRule.id), func.max(AlarmRule.id), func.max(AlarmRule.updated_at)
+        ).filter(AlarmRule.is_active.is_(True)).one())
+
+        with self._lock:
+            self._checked_at = now
+            if not force and fingerprint == self._fingerprint:
+                return False
+
+            rules = session.query(
+                AlarmRule.id, AlarmRule.name, AlarmRule.alert_condition, AlarmRule.threshold, AlarmRule.severity
+            ).filter(AlarmRule.is_active.is_(True)).all()
+            self._plan = compile_rules([row._asdict() for row in rules])
+            self._fingerprint = fingerprint
+
+            # 丢弃已删除或已变更规则的持续超限状态
+            keys = {self._series_key(rule, None)[0] for metric_rules in self.plan.values() for rule in metric_rules}
+            self._series = {key: state for key, state in self._series.items() if key[0] in keys}
+
+        logger.info(f"Compiled {sum(len(rules) for rules in self._plan.values())} alarm rules")
+        return True
+
+    def threshold_for(self, metric, default=None):
+        """
+        获取某指标最严格的阈值（用于 SQL 端的预筛选）
+        """
+        thresholds = [rule.threshold for rule in self.plan.get(metric, ()) if rule.comparator in (">", ">=")]
+        return min(thresholds) if thresholds else default
+
+    @staticmethod
+    def _series_key(rule, server_id):
+        return (rule.rule_id if rule.rule_id is not None else rule.metric, server_id)
+
+    def check(self, metrics):
+        """
+        无状态地按当前计划检查一组指标（不考虑持续时间），不写入数据库
+        :param metrics: {指标名: 数值}
+        :return: [(CompiledRule, 数值)]
+        """
+        breaches = []
+        for metric, value in metrics.items():
+            for rule in self.plan.get(metric, ()):
+                try:
+                    if rule.check(_to_number(value), rule.threshold):
+                        breaches.append((rule, value))
+                except (TypeError, ValueError):
+                    continue
+        return breaches
+
+    def _pending(self, session):
+        """
+        会话中待写入的告警缓存，每个会话（即每个事务）一份，flush 只写入本会话的告警
+        :return: {"raises": [(告警字典, AlarmLog 字典或 None)], "clears": {_series_key: 恢复样本数}, "keys": [新触发的 _series_key]}
+        """
+        return session.info.setdefault(PENDING_INFO_KEY, {}).setdefault(
+            self, {"raises": [], "clears": {}, "keys": []}
+        )
+
+    def _pending_count(self, session):
+        """
+        会话中待写入的超限、恢复样本数
+        """
+        with self._lock:
+            pending = session.info.get(PENDING_INFO_KEY, {}).get(self)
+            return len(pending["raises"]) + len(pending["clears"]) if pending else 0
+
+    def evaluate(self, server_id, ts, metrics, session=None):
+        """
+        流式评估一台服务器的一组样本，满足条件时把告警缓存到会话中，由 flush 写入
+        :param server_id: 服务器 ID
+        :param ts: 采样时间
+        :param metrics: {指标名: 数值}
+        :param session: 告警写入所用的会话，默认 db.session
+        :return: 本次新触发的 [(CompiledRule, 数值)]
+        """
+        session = session or db.session
+        fired = []
+        with self._lock:
+            pending = self._pending(session)
+            for metric, value in metrics.items():
+                for rule in self.plan.get(metric, ()):
+                    try:
+                        breached = rule.check(_to_number(value), rule.threshold)
+                    except (TypeError, ValueError):
+                        continue
+
+                    key = self._series_key(rule, server_id)
+                    state = self._series.get(key)
+                    if not breached:
+                        if state and state["fired"]:
+                            # 已上报的告警：恢复样本交给去重器计数，连续 clear_after 次后解除
+                            state["recovered"] = True
+                            pending["clears"][key] = pending["clears"].get(key, 0) + 1
+                        else:
+                            # 未触发过，清除持续超限状态
+                            self._series.pop(key, None)
+                        continue
+
+                    if state is None:
+                        state = self._series[key] = {"since": ts, "fired": False, "recovered": False}
+                    if state["fired"]:
+                        # 告警未解除期间再次超限：累加出现次数，之前的恢复样本不再计数
+                        state["recovered"] = False
+                        pending["clears"].pop(key, None)
+                        self._queue(pending, rule, server_id, ts, value)
+                    elif ts - state["since"] >= rule.duration:
+                        state["fired"] = True
+                        fired.append((rule, value))
+                        self._queue(pending, rule, server_id, ts, value, new=True)
+                        pending["keys"].append(key)
+        return fired
+
+    def rearm(self, keys):
+        """
+        告警未能写入（事务回滚）时恢复这些序列的未触发状态，下一个超限样本会再次触发
+        :param keys: _series_key 列表
+        """
+        with self._lock:
+            for key in keys:
+                state = self._series.get(key)
+                if state:
+                    state["fired"] = False
+
+    @staticmethod
+    def _fingerprint_for(key):
+        """
+        (规则, 服务器) 序列的告警指纹；默认规则没有 rule_id，用指标名区分
+        """
+        return alert_fingerprint("server", "server", key[1], key[0])
+
+    def _queue(self, pending, rule, server_id, ts, value, new=False):
+        message = rule.describe(value)
+        log = {
+            "rule_id": rule.rule_id,
+            "server_id": server_id,
+            "alert_type": rule.metric,
+            "message": message,
+            "status": "active",
+            "created_at": ts
+        } if new else None
+        pending["raises"].append(({
+            "alert_type": "server",
+            "severity": rule.severity,
+            "target_id": server_id,
+            "target_type": "server",
+            "message": message,
+            "details": {
+                "metric": rule.metric,
+                "value": value,
+                "comparator": rule.comparator,
+                "threshold": rule.threshold,
+                "duration_seconds": int(rule.duration.total_seconds())
+            },
+            "rule_id": rule.rule_id,
+            "fingerprint": self._fingerprint_for(self._series_key(rule, server_id))
+        }, log))
+        if new:
+            logger.warning(f"Alarm rule triggered on server {server_id}: {message}")
+
+    def evaluate_samples(self, samples, session=None, commit=True):
+        """
+        批量评估样本并写入触发的告警
+        :param samples: (server_id, ts, {指标名: 数值}) 元组的可迭代对象
+        :param commit: 是否在写入后提交事务
+        :return: 新产生的告警数量
+        """
+        session = session or db.session
+        self.refresh(session)
+        written = 0
+        for server_id, ts, metrics in samples:
+            self.evaluate(server_id, ts, metrics, session)
+            if self._pending_count(session) >= self.flush_size:
+                written += self.flush(session, commit=commit)
+        return written + self.flush(session, commit=commit)
+
+    def flush(self, session=None, commit=True):
+        """
+        把本会话缓存的超限、恢复样本批量交给 AlertDeduplicator，新产生的告警写入 AlarmLog
+        :return: 新产生的告警数量
+        """
+        session = session or db.session
+        with self._lock:
+            pending = session.info.get(PENDING_INFO_KEY, {}).pop(self, None)
+            if not pending or (not pending["raises"] and not pending["clears"]):
+                return 0
+            raises, clears, keys = pending["raises"], pending["clears"], pending["keys"]
+            # 事务提交前这些序列的触发状态都未确认，回滚时恢复（见 _rearm_on_rollback）
+            _register_rollback_tracking()
+            session.info.setdefault(UNCONFIRMED_INFO_KEY, []).append((self, keys))
+
+        try:
+            results = alert_deduplicator.raise_alerts([alert for alert, _ in raises], session, commit=False)
+            logs = [log for (_, log), result in zip(raises, results) if log and result["action"] == "created"]
+            if logs:
+                session.execute(insert(AlarmLog), logs)
+            cleared = alert_deduplicator.clear_alerts([
+                self._fingerprint_for(key) for key, count in clears.items() for _ in range(count)
+            ], session, commit=False)
+            if commit:
+                session.commit()
+        except Exception:
+            if commit:
+                session.rollback()
+            raise
+
+        # 告警已解除（或已没有未解决告警）且仍处于恢复状态的序列不再跟踪
+        with self._lock:
+            for key in clears:
+                state = self._series.get(key)
+                if state and state["recovered"] and cleared.get(self._fingerprint_for(key)) in ("resolved", "none"):
+                    self._series.pop(key, None)
+        return sum(1 for result in results if result["action"] == "created")
+
+
+# session.info 中待写入的告警缓存：{AlertRuleEngine: AlertRuleEngine._pending 的结构}
+PENDING_INFO_KEY = "alert_engine_pending"
+# session.info 中尚未提交的已触发序列：[(AlertRuleEngine, [_series_key])]
+UNCONFIRMED_INFO_KEY = "alert_engine_unconfirmed"
+# session.info 中等待事务提交后写入指纹索引的状态：{AlertDeduplicator: {指纹: 状态}}
+STAGED_STATES_INFO_KEY = "alert_dedup_staged_states"
+
+_rollback_tracking_registered = False
+
+
+def _confirm_on_commit(session):
+    session.info.pop(UNCONFIRMED_INFO_KEY, None)
+    for deduplicator, states in (session.info.pop(STAGED_STATES_INFO_KEY, None) or {}).items():
+        deduplicator._save_states(states)
+
+
+def _rearm_on_rollback(session, previous_transaction):
+    for engine, keys in session.info.pop(UNCONFIRMED_INFO_KEY, None) or ():
+        engine.rearm(keys)
+    # 尚未写入的告警和指纹状态随事务一起丢弃，对应序列恢复为未触发
+    for engine, pending in (session.info.pop(PENDING_INFO_KEY, None) or {}).items():
+        engine.rearm(pending["keys"])
+    session.info.pop(STAGED_STATES_INFO_KEY, None)
+
+
+def _register_rollback_tracking():
+    """
+    注册会话事件：
+    - 事务提交后把暂存的告警指纹状态写入 Redis 索引；
+    - 告警写入所在事务回滚时丢弃暂存的状态并恢复规则引擎的触发状态，否则该告警不会再次产生
+    """
+    global _rollback_tracking_registered
+    if _rollback_tracking_registered:
+        return
+    event.listen(Session, "after_commit", _confirm_on_commit)
+    event.listen(Session, "after_soft_rollback", _rearm_on_rollback)
+    _rollback_tracking_registered = True
+
+
+# 进程内共享的规则引擎
+alert_engine = AlertRuleEngine()
+
+
+# ---------------------------------------------------------------------------
+# 告警去重、滞回与抖动抑制
+# ---------------------------------------------------------------------------
+
+# 未解决告警的指纹索引（Redis 哈希：指纹 -> 状态 JSON）
+FINGERPRINT_INDEX_KEY = "alerts:fingerprints"
+
+redis_client = get_redis_client()
+
+
+def _as_int(value):
+    """
+    target_id 列为整数，非数字的目标标识（如 "server_1"）只保留在指纹中
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def alert_fingerprint(alert_type, target_type, target_id, rule_id=None):
+    """
+    生成告警指纹，同一指纹的未解决告警只保留一条
+    """
+    return ":".join("" if part is None else str(part) for part in (alert_type, target_type, target_id, rule_id))
+
+
+class AlertDeduplicator:
+    """
+    告警去重层：
+    - 按 (alert_type, target_type, target_id, rule_id) 指纹去重，重复出现时只累加 details.occurrences；
+    - 未解决告警的指纹索引保存在 Redis，Redis 不可用时退回进程内字典，索引缺失时以数据库为准；
+    - 滞回：连续异常 raise_after 次才产生告警，连续恢复 clear_after 次才解除告警；
+    - 抖动：flap_window 秒内状态切换达到 flap_threshold 次视为抖动，抖动期间不解除告警、不再发送通知。
+    """
+
+    def __init__(self, raise_after=None, clear_after=None, flap_window=None, flap_threshold=None):
+        self.raise_after = raise_after or Config.ALERT_RAISE_AFTER
+        self.clear_after = clear_after or Config.ALERT_CLEAR_AFTER
+        self.flap_window = flap_window or Config.ALERT_FLAP_WINDOW
+        self.flap_threshold = flap_threshold or Config.ALERT_FLAP_THRESHOLD
+        self._lock = threading.RLock()
+        self._local = {}
+
+    def _load_state(self, fingerprint, session):
+        return self._load_states([fingerprint], session)[fingerprint]
+
+    def _store_states(self, session, states, commit):
+        """
+        保存指纹状态：commit 为 True 时（事务已提交）直接写入；
+        否则暂存到 session.info，调用方提交后再写入 Redis（见 _confirm_on_commit），回滚则丢弃
+        """
+        if commit:
+            self._save_states(states)
+            return
+        _register_rollback_tracking()
+        session.info.setdefault(STAGED_STATES_INFO_KEY, {}).setdefault(self, {}).update(states)
+
+    def _is_flapping(self, state, now):
+        transitions = [ts for ts in state.get("transitions", []) if now - ts < self.flap_window]
+        state["transitions"] = transitions
+        return len(transitions) >= self.flap_threshold
+
+    @staticmethod
+    def _open_alert(session, fingerprint, alert_id=None):
+        """
+        获取指纹对应的未解决告警：优先按索引中的 ID 读取，否则按指纹查询数据库
+        """
+        alert = session.get(SystemAlert, alert_id) if alert_id else None
+        if alert is None or alert.status == 'resolved':
+            alert = session.query(SystemAlert).filter(
+                SystemAlert.fingerprint == fingerprint,
+                SystemAlert.status.in_(['active', 'acknowledged'])
+            ).order_by(SystemAlert.id.desc()).first()
+        return alert
+
+    def raise_alert(self, alert_type, target_type, target_id, message, severity="medium",
+                    rule_id=None, details=None, session=None, commit=True):
+        """
+        上报一次异常
+        :return: {"action": created|deduplicated|pending, "alert": SystemAlert 或 None, "notify": 是否需要发送通知}
+        """
+        session = session or db.session
+        fingerprint = alert_fingerprint(alert_type, target_type, target_id, rule_id)
+        now = time.time()
+
+        with self._lock:
+            state = self._load_state(fingerprint, session)
+            state["clear_streak"] = 0
+            flapping = self._is_flapping(state, now)
+            alert = self._open_alert(session, fingerprint, state.get("alert_id")) \
+                if state.get("alert_id") or state.get("raise_streak", 0) + 1 >= self.raise_after else None
+
+            if alert is not None:
+                # 重复告警：累加出现次数，不插入新行
+                alert_details = dict(alert.details or {})
+                alert_details["occurrences"] = alert_details.get("occurrences", 1) + 1
+                alert_details["last_seen"] = datetime.utcnow().isoformat()
+                alert_details["flapping"] = flapping
+                alert.details = alert_details
+                alert.message = message
+                alert.updated_at = datetime.utcnow()
+                state.update({"alert_id": alert.id, "raise_streak": 0})
+                action, notify = "deduplicated", False
+            else:
+                state["raise_streak"] = state.get("raise_streak", 0) + 1
+                if state["raise_streak"] < self.raise_after:
+                    self._store_states(session, {fingerprint: state}, commit)
+                    return {"action": "pending", "alert": None, "notify": False}
+
+                alert = SystemAlert(
+                    alert_type=alert_type,
+                    target_type=target_type,
+                    target_id=_as_int(target_id),
+                    message=message,
+                    severity=severity,
+                    rule_id=rule_id,
+                    fingerprint=fingerprint,
+                    details={**(details or {}), "occurrences": 1, "flapping": flapping},
+                    status="active",
+                    created_at=datetime.utcnow()
+                )
+                session.add(alert)
+                session.flush()
+                state["transitions"].append(now)
+                state.update({"alert_id": alert.id, "raise_streak": 0})
+                action, notify = "created", not flapping
+
+            if commit:
+                session.commit()
+            self._store_states(session, {fingerprint: state}, commit)
+
+        publish_alert_event(alert, "created" if action == "created" else "updated")
+        if flapping:
+            logger.warning(f"Alert {fingerprint} is flapping, notifications suppressed")
+        return {"action": action, "alert": alert, "notify": notify}
+
+    def clear_alert(self, alert_type, target_type, target_id, rule_id=None, session=None, commit=True):
+        """
+        上报一次恢复正常
+        :return: {"action": resolved|pending|flapping|none, "alert": 被解除的告警或 None}
+        """
+        session = session or db.session
+        fingerprint = alert_fingerprint(alert_type, target_type, target_id, rule_id)
+        now = time.time()
+
+        with self._lock:
+            state = self._load_state(fingerprint, session)
+            if not state.get("alert_id"):
+                # 没有未解决的告警，只需清除未达到滞回次数的异常计数
+                if state.get("raise_streak") or state.get("transitions"):
+                    state["raise_streak"] = 0
+                    self._store_states(session, {fingerprint: state if state.get("transitions") else None}, commit)
+                return {"action": "none", "alert": None}
+
+            state["clear_streak"] = state.get("clear_streak", 0) + 1
+            if state["clear_streak"] < self.clear_after:
+                self._store_states(session, {fingerprint: state}, commit)
+                return {"action": "pending", "alert": None}
+            if self._is_flapping(state, now):
+                # 抖动期间保持告警打开
+                self._store_states(session, {fingerprint: state}, commit)
+                return {"action": "flapping", "alert": None}
+
+            alert = self._open_alert(session, fingerprint, state["alert_id"])
+            if alert is not None:
+                alert.status = "resolved"
+                alert.resolved_at = datetime.utcnow()
+                if commit:
+                    session.commit()
+            state["transitions"].append(now)
+            state.update({"alert_id": None, "clear_streak": 0, "raise_streak": 0})
+            self._store_states(session, {fingerprint: state}, commit)
+
+        if alert is not None:
+            publish_alert_event(alert, "resolved")
+        return {"action": "resolved" if alert is not None else "none", "alert": alert}
+
+
+    def _load_states(self, fingerprints, session):
+        """
+        批量读取指纹状态（一次 HMGET），Redis 不可用时使用进程内状态；本会话暂存、尚未提交的状态优先
+        """
+        staged = session.info.get(STAGED_STATES_INFO_KEY, {}).get(self, {})
+        states = {
+            fingerprint: json.loads(json.dumps(staged[fingerprint] or {}))
+            for fingerprint in fingerprints if fingerprint in staged
+        }
+        fingerprints = [fingerprint for fingerprint in fingerprints if fingerprint not in states]
+        if not fingerprints:
+            return states
+        try:
+            for fingerprint, raw in zip(fingerprints, redis_client.hmget(FINGERPRINT_INDEX_KEY, fingerprints)):
+                if raw is not None:
+                    states[fingerprint] = json.loads(raw)
+        except redis.RedisError as e:
+            logger.debug(f"Alert fingerprint index unavailable, using local state: {e}")
+        for fingerprint in fingerprints:
+            if fingerprint not in states:
+                states[fingerprint] = dict(self._local.get(fingerprint) or {})
+        return states
+
+    def _save_states(self, states):
+        """
+        批量保存指纹状态（一个 pipeline），空状态从索引中删除
+        """
+        for fingerprint, state in states.items():
+            if state:
+                self._local[fingerprint] = state
+            else:
+                self._local.pop(fingerprint, None)
+        try:
+            pipeline = redis_client.pipeline(transaction=False)
+            saved = {fingerprint: json.dumps(state) for fingerprint, state in states.items() if state}
+            removed = [fingerprint for fingerprint, state in states.items() if not state]
+            if saved:
+                pipeline.hset(FINGERPRINT_INDEX_KEY, mapping=saved)
+            if removed:
+                pipeline.hdel(FINGERPRINT_INDEX_KEY, *removed)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.debug(f"Alert fingerprint index unavailable, state kept locally: {e}")
+
+    @staticmethod
+    def _open_alerts(session, fingerprints, chunk_size=1000):
+        """
+        批量获取指纹对应的未解决告警（每 chunk_size 个指纹一次查询）
+        :return: {指纹: (id, details)}，同一指纹有多条时取最新的一条
+        """
+        open_alerts = {}
+        fingerprints = list(fingerprints)
+        for start in range(0, len(fingerprints), chunk_size):
+            rows = session.query(SystemAlert.id, SystemAlert.fingerprint, SystemAlert.details).filter(
+                SystemAlert.fingerprint.in_(fingerprints[start:start + chunk_size]),
+                SystemAlert.status.in_(['active', 'acknowledged'])
+            ).order_by(SystemAlert.id).all()
+            open_alerts.update({row.fingerprint: (row.id, row.details) for row in rows})
+        return open_alerts
+
+    def raise_alerts(self, alerts, session=None, commit=True):
+        """
+        批量上报异常（规则引擎、generate_system_alerts 等批量来源使用），去重、滞回、抖动规则与 raise_alert 相同；
+        未解决告警一次查询载入，新告警批量插入，重复告警批量更新。
+        :param alerts: 告警字典列表，键为 alert_type、target_type、target_id、message、severity、rule_id、details，
+                       可带 fingerprint 覆盖默认指纹
+        :param commit: 是否在写入后提交事务
+        :return: 与 alerts 顺序一致的 [{"action": created|deduplicated|pending, "fingerprint": 指纹, "notify": 是否需要通知}]
+        """
+        if not alerts:
+            return []
+        session = session or db.session
+        now = time.time()
+        timestamp = datetime.utcnow()
+        fingerprints = [
+            alert.get("fingerprint") or alert_fingerprint(
+                alert["alert_type"], alert["target_type"], alert["target_id"], alert.get("rule_id")
+            )
+            for alert in alerts
+        ]
+
+        results = []
+        events = []
+        with self._lock:
+            unique = list(dict.fromkeys(fingerprints))
+            states = self._load_states(unique, session)
+            open_alerts = self._open_alerts(session, unique)
+            updates = {}  # 告警 ID -> 更新的列
+            inserts = {}  # 指纹 -> 新告警
+
+            for fingerprint, alert in zip(fingerprints, alerts):
+                state = states[fingerprint]
+                state["clear_streak"] = 0
+                flapping = self._is_flapping(state, now)
+
+                if fingerprint in inserts:
+                    # 同一批次内的重复告警
+                    row = inserts[fingerprint]
+                    row["details"]["occurrences"] += 1
+                    row["message"] = alert["message"]
+                    results.append({"action": "deduplicated", "fingerprint": fingerprint, "notify": False})
+                    continue
+
+                if fingerprint in open_alerts:
+                    alert_id, details = open_alerts[fingerprint]
+                    row = updates.setdefault(alert_id, {"id": alert_id, "details": dict(details or {})})
+                    row["details"]["occurrences"] = row["details"].get("occurrences", 1) + 1
+                    row["details"]["last_seen"] = timestamp.isoformat()
+                    row["details"]["flapping"] = flapping
+                    row.update({"message": alert["message"], "updated_at": timestamp})
+                    state.update({"alert_id": alert_id, "raise_streak": 0})
+                    events.append(({**alert, **row, "fingerprint": fingerprint, "status": "active"}, "updated"))
+                    results.append({"action": "deduplicated", "fingerprint": fingerprint, "notify": False})
+                    continue
+
+                state["raise_streak"] = state.get("raise_streak", 0) + 1
+                if state["raise_streak"] < self.raise_after:
+                    results.append({"action": "pending", "fingerprint": fingerprint, "notify": False})
+                    continue
+
+                inserts[fingerprint] = {
+                    "alert_type": alert["alert_type"],
+                    "target_type": alert["target_type"],
+                    "target_id": _as_int(alert["target_id"]),
+                    "message": alert["message"],
+                    "severity": alert.get("severity") or "medium",
+                    "rule_id": alert.get("rule_id"),
+                    "fingerprint": fingerprint,
+                    "details": {**(alert.get("details") or {}), "occurrences": 1, "flapping": flapping},
+                    "status": "active",
+                    "created_at": timestamp,
+                    "updated_at": timestamp
+                }
+                state["transitions"].append(now)
+                state["raise_streak"] = 0
+                results.append({"action": "created", "fingerprint": fingerprint, "notify": not flapping})
+
+            if updates:
+                session.execute(update(SystemAlert), list(updates.values()))
+            if inserts:
+                session.execute(insert(SystemAlert), list(inserts.values()))
+                # 新告警的 ID 写入指纹索引（MySQL 批量插入不返回 ID，再查询一次）
+                for fingerprint, (alert_id, _) in self._open_alerts(session, inserts).items():
+                    states[fingerprint]["alert_id"] = alert_id
+                    inserts[fingerprint]["id"] = alert_id
+                events.extend((row, "created") for row in inserts.values())
+            if commit:
+                session.commit()
+            self._store_states(session, states, commit)
+
+        for alert, action in events:
+            publish_alert_event(alert, action)
+        flapping = [result["fingerprint"] for result in results if result["action"] == "created" and not result["notify"]]
+        if flapping:
+            logger.warning(f"{len(flapping)} alert(s) are flapping, notifications suppressed")
+        return results
+
+    def clear_alerts(self, fingerprints, session=None, commit=True):
+        """
+        批量上报恢复正常，滞回与抖动规则与 clear_alert 相同；同一指纹出现多次按多次恢复计数
+        :param fingerprints: 告警指纹列表（alert_fingerprint）
+        :param commit: 是否在写入后提交事务
+        :return: {指纹: resolved|pending|flapping|none}（同一指纹取最后一次的结果）
+        """
+        if not fingerprints:
+            return {}
+        session = session or db.session
+        now = time.time()
+        timestamp = datetime.utcnow()
+
+        actions = {}
+        with self._lock:
+            unique = list(dict.fromkeys(fingerprints))
+            states = self._load_states(unique, session)
+            # 索引缺失时以数据库为准
+            open_alerts = self._open_alerts(session, unique)
+            resolved = {}
+
+            for fingerprint in fingerprints:
+                state = states[fingerprint]
+                if fingerprint in resolved:
+                    actions[fingerprint] = "none"
+                    continue
+                alert_id = state.get("alert_id") or open_alerts.get(fingerprint, (None,))[0]
+                if not alert_id:
+                    # 没有未解决的告警，只需清除未达到滞回次数的异常计数
+                    if state.get("raise_streak") or state.get("transitions"):
+                        state["raise_streak"] = 0
+                        if not state.get("transitions"):
+                            states[fingerprint] = state = {}
+                    actions[fingerprint] = "none"
+                    continue
+
+                state["alert_id"] = alert_id
+                state["clear_streak"] = state.get("clear_streak", 0) + 1
+                if state["clear_streak"] < self.clear_after:
+                    actions[fingerprint] = "pending"
+                    continue
+                if self._is_flapping(state, now):
+                    # 抖动期间保持告警打开
+                    actions[fingerprint] = "flapping"
+                    continue
+
+                state.setdefault("transitions", []).append(now)
+                state.update({"alert_id": None, "clear_streak": 0, "raise_streak": 0})
+                resolved[fingerprint] = True
+                actions[fingerprint] = "resolved" if fingerprint in open_alerts else "none"
+
+            if resolved:
+                session.execute(
+                    update(SystemAlert)
+                    .where(SystemAlert.fingerprint.in_(list(resolved)), SystemAlert.status.in_(['active', 'acknowledged']))
+                    .values(status="resolved", resolved_at=timestamp, updated_at=timestamp),
+                    execution_options={"synchronize_session": False}
+                )
+            if commit:
+                session.commit()
+            self._store_states(session, states, commit)
+
+        for fingerprint in resolved:
+            if fingerprint in open_alerts:
+                alert_id, details = open_alerts[fingerprint]
+                publish_alert_event({
+                    "id": alert_id, "fingerprint": fingerprint, "details": details, "status": "resolved",
+                    "resolved_at": timestamp, "updated_at": timestamp
+                }, "resolved")
+        return actions
+
+
+# 进程内共享的告警去重器
+alert_deduplicator = AlertDeduplicator()
+
+
+# ---------------------------------------------------------------------------
+# 告警设置缓存：进程内（TTL）-> Redis -> AlarmRule
+# ---------------------------------------------------------------------------
+
+SETTINGS_CACHE_KEY = "alert_settings"
+SETTINGS_INVALIDATE_CHANNEL = "alert_settings:invalidate"
+# Redis 中缓存的过期时间（秒）
+SETTINGS_REDIS_TTL = 3600
+
+# 开关类规则：alert_condition -> 设置项（兼容设置页保存的两种命名）
+SETTING_SWITCHES = {
+    "server_health": "serverHealthCheck",
+    "server_health_check": "serverHealthCheck",
+    "docker_health": "dockerHealthCheck",
+    "docker_health_check": "dockerHealthCheck",
+    "traffic_monitor": "trafficAlert",
+    "traffic_alert_switch": "trafficAlert",
+    "email_notify": "emailNotification",
+    "email_notification_switch": "emailNotification",
+}
+# 阈值类规则：alert_condition -> thresholds 中的键
+SETTING_THRESHOLDS = {
+    "cpu_usage": "cpu",
+    "memory_usage": "memory",
+    "disk_usage": "disk",
+    "traffic_usage": "traffic",
+}
+
+_settings_cache = {"value": None, "expires_at": 0.0}
+_settings_lock = threading.Lock()
+_settings_listener = None
+
+
+def default_alert_settings():
+    """
+    没有任何规则时的默认告警设置
+    """
+    return {
+        'serverHealthCheck': True,
+        'dockerHealthCheck': True,
+        'trafficAlert': True,
+        'emailNotification': True,
+        'checkInterval': 5,
+        'thresholds': {
+            'traffic': 90,
+            'cpu': 80,
+            'memory': 80,
+            'disk': 85
+        },
+        'lastUpdated': datetime.utcnow().isoformat()
+    }
+
+
+def build_alert_settings(session=None):
+    """
+    从启用的 AlarmRule 构造告警设置
+    """
+    session = session or db.session
+    settings = default_alert_settings()
+    rules = session.query(AlarmRule.alert_condition, AlarmRule.threshold).filter(AlarmRule.is_active.is_(True)).all()
+    for rule in rules:
+        if rule.threshold is None:
+            continue
+        if rule.alert_condition in SETTING_THRESHOLDS:
+            settings['thresholds'][SETTING_THRESHOLDS[rule.alert_condition]] = float(rule.threshold)
+        elif rule.alert_condition in SETTING_SWITCHES:
+            settings[SETTING_SWITCHES[rule.alert_condition]] = rule.threshold > 0
+        elif rule.alert_condition == 'check_interval':
+            settings['checkInterval'] = float(rule.threshold)
+    return settings
+
+
+def _set_local_settings(settings):
+    with _settings_lock:
+        _settings_cache["value"] = settings
+        _settings_cache["expires_at"] = time.monotonic() + Config.ALERT_SETTINGS_CACHE_TTL
+
+
+def _clear_local_settings():
+    with _settings_lock:
+        _settings_cache["value"] = None
+        _settings_cache["expires_at"] = 0.0
+
+
+def _listen_for_invalidation():
+    """
+    订阅设置变更广播，收到后清除本进程缓存；连接断开时自动重连
+    """
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(SETTINGS_INVALIDATE_CHANNEL)
+            while True:
+                # 带超时轮询，避免空闲连接触发 socket_timeout
+                if pubsub.get_message(timeout=10):
+                    _clear_local_settings()
+        except redis.RedisError as e:
+            logger.debug(f"Alert settings invalidation listener disconnected: {e}")
+            # 断线期间的广播可能丢失，清除本地缓存，下次读取时回源
+            _clear_local_settings()
+            time.sleep(5)
+
+
+def _ensure_settings_listener():
+    global _settings_listener
+    if _settings_listener is None:
+        with _settings_lock:
+            if _settings_listener is None:
+                _settings_listener = threading.Thread(
+                    target=_listen_for_invalidation, name="alert-settings-listener", daemon=True
+                )
+                _settings_listener.start()
+
+
+def load_alert_settings(session=None):
+    """
+    读取告警设置：进程内缓存命中时只是一次字典查找，
+    未命中时依次读取 Redis 和 AlarmRule，并回填上层缓存
+    :return: (设置字典, 来源 local / redis / mysql)
+    """
+    _ensure_settings_listener()
+    cached = _settings_cache["value"]
+    if cached is not None and time.monotonic() < _settings_cache["expires_at"]:
+        return cached, "local"
+
+    try:
+        raw = redis_client.get(SETTINGS_CACHE_KEY)
+        if raw:
+            settings = json.loads(raw)
+            _set_local_settings(settings)
+            return settings, "redis"
+    except redis.RedisError as e:
+        logger.warning(f"Redis unavailable when reading alert settings: {e}")
+
+    settings = build_alert_settings(session)
+    _set_local_settings(settings)
+    try:
+        redis_client.setex(SETTINGS_CACHE_KEY, SETTINGS_REDIS_TTL, json.dumps(settings))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache alert settings in Redis: {e}")
+    return settings, "mysql"
+
+
+def publish_alert_settings(settings):
+    """
+    保存设置后更新 Redis 缓存，并广播失效通知，所有进程的本地缓存随之清除
+    """
+    settings = {**settings, 'lastUpdated': datetime.utcnow().isoformat()}
+    _set_local_settings(settings)
+    try:
+        pipeline = redis_client.pipeline()
+        pipeline.setex(SETTINGS_CACHE_KEY, SETTINGS_REDIS_TTL, json.dumps(settings))
+        pipeline.publish(SETTINGS_INVALIDATE_CHANNEL, "updated")
+        pipeline.execute()
+    except redis.RedisError as e:
+        # Redis 不可用时其它进程的本地缓存最多在 ALERT_SETTINGS_CACHE_TTL 秒后过期
+        logger.warning(f"Failed to broadcast alert settings update: {e}")
+    return settings
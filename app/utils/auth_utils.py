@@ -4,15 +4,13 @@ from datetime import datetime, timedelta
 from app.config import Config
 import logging
 
-# 设置日志级别
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("auth_utils")
+logger = logging.getLogger(__name__)
 
 # 加密密码
 def hash_password(password):
     try:
         hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(12)).decode('utf-8')
-        logger.info("Password hashed successfully.")
+        logger.debug("Password hashed successfully.")
         return hashed
     except Exception as e:
         logger.exception("Error hashing password.")
@@ -22,7 +20,7 @@ def hash_password(password):
 def check_password(password, hashed_password):
     try:
         result = bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
-        logger.info(f"Password check {'succeeded' if result else 'failed'}.")
+        logger.debug(f"Password check {'succeeded' if result else 'failed'}.")
         return result
     except Exception as e:
         logger.exception("Error checking password.")
@@ -33,7 +31,7 @@ def generate_jwt(payload, expiration_hours=24):
     try:
         payload['exp'] = datetime.utcnow() + timedelta(hours=expiration_hours)
         token = jwt.encode(payload, Config.SECRET_KEY, algorithm="HS256")
-        logger.info("JWT generated successfully.")
+        logger.debug("JWT generated successfully.")
         return token
     except Exception as e:
         logger.exception("Error generating JWT.")
@@ -43,7 +41,7 @@ def generate_jwt(payload, expiration_hours=24):
 def decode_jwt(token):
     try:
         decoded = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
-        logger.info("JWT decoded successfully.")
+        logger.debug("JWT decoded successfully.")
         return decoded
     except jwt.ExpiredSignatureError:
         logger.warning("JWT has expired.")
@@ -67,7 +65,7 @@ def generate_refresh_token(user_id, expiration_days=7):
             "exp": datetime.utcnow() + timedelta(days=expiration_days)
         }
         token = jwt.encode(payload, Config.SECRET_KEY, algorithm="HS256")
-        logger.info("Refresh token generated successfully.")
+        logger.debug("Refresh token generated successfully.")
         return token
     except Exception as e:
         logger.exception("Error generating refresh token.")
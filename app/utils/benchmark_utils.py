@@ -0,0 +1,683 @@
+"""
+性能基准测试工具。
+
+在独立的基准数据库（默认 SQLite 内存库，可通过 BENCHMARK_DATABASE_URL 指向一个临时 MySQL 库）
+中建表、写入模拟数据并计时，测试结束后删除建出的表。请勿指向生产数据库。
+
+用法：
+    python -m app.utils.benchmark_utils fleet_load --servers 2000 --samples 30
+    python -m app.utils.benchmark_utils system_alerts --servers 1000 --samples 10,30,60
+    python -m app.utils.benchmark_utils rental_expiry --rentals 20000 --batch-size 500
+    python -m app.utils.benchmark_utils serial_redemption --serials 200 --attempts 1000 --threads 32
+    python -m app.utils.benchmark_utils serial_generation --count 100000 --batch-size 5000
+    python -m app.utils.benchmark_utils finance_statistics --serials 200000 --users 5000 --days 90
+    python -m app.utils.benchmark_utils commission_settlement --serials 1000000 --invoices 200000
+    python -m app.utils.benchmark_utils audit_log --records 20000 --threads 8
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkConfig(Config):
+    """
+    基准测试使用的配置：独立数据库，不带 MySQL 专用的连接参数
+    """
+    SQLALCHEMY_DATABASE_URI = os.getenv('BENCHMARK_DATABASE_URL', 'sqlite://')
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+
+@contextmanager
+def benchmark_database(*models, database_url=None):
+    """
+    创建基准测试应用上下文，并为指定模型建表，退出时删除这些表
+    :param models: 需要建表的模型类（或 Table 对象）
+    :param database_url: 覆盖 BenchmarkConfig 的数据库地址
+    """
+    from app import create_app, db
+
+    config = BenchmarkConfig
+    if database_url:
+        config = type("BenchmarkConfig", (BenchmarkConfig,), {"SQLALCHEMY_DATABASE_URI": database_url})
+    app = create_app(config)
+    tables = [getattr(model, "__table__", model) for model in models]
+    with app.app_context():
+        db.metadata.create_all(db.engine, tables=tables)
+        try:
+            yield db
+        finally:
+            db.session.remove()
+            db.metadata.drop_all(db.engine, tables=tables)
+
+
+@contextmanager
+def count_queries(engine):
+    """
+    统计代码块内实际发送到数据库的语句数
+    """
+    counter = {"queries": 0}
+
+    def _before_cursor_execute(*args, **kwargs):
+        counter["queries"] += 1
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+def _seed_servers(db, server_count):
+    """
+    写入模拟服务器
+    """
+    from app.models import Server
+
+    db.session.execute(insert(Server), [
+        {
+            "id": server_id,
+            "server_name": f"bench-{server_id}",
+            "ip_address": f"10.{server_id // 65536 % 256}.{server_id // 256 % 256}.{server_id % 256}",
+            "region": random.choice(["SH", "BJ", "GZ", "HZ"]),
+            "status": "healthy"
+        }
+        for server_id in range(1, server_count + 1)
+    ])
+    db.session.commit()
+
+
+def benchmark_fleet_load(servers=2000, samples=30, window_minutes=60):
+    """
+    基准测试：analyze_all_server_loads 在模拟监控数据集上的耗时与查询次数
+    :param servers: 服务器数量
+    :param samples: 每台服务器在时间窗口内的样本数
+    :param window_minutes: 统计窗口（分钟）
+    """
+    from app.models import Server, MetricDefinition, ServerMetric
+    from app.utils.metrics_store import record_samples
+    from app.utils.monitoring_utils import analyze_all_server_loads
+
+    with benchmark_database(Server, MetricDefinition, ServerMetric) as db:
+        _seed_servers(db, servers)
+        now = datetime.utcnow()
+        step = window_minutes * 60 / (samples + 1)
+        rows = record_samples(
+            (
+                server_id,
+                now - timedelta(seconds=step * (index + 1)),
+                {"load_average": round(random.uniform(0, 8), 2), "cpu_usage": round(random.uniform(0, 100), 2)}
+            )
+            for server_id in range(1, servers + 1)
+            for index in range(samples)
+        )
+
+        with count_queries(db.engine) as counter:
+            started = time.perf_counter()
+            result = analyze_all_server_loads(window_minutes=window_minutes)
+            elapsed = time.perf_counter() - started
+
+        return {
+            "benchmark": "fleet_load",
+            "servers": servers,
+            "samples_per_server": samples,
+            "rows": rows,
+            "success": result["success"],
+            "results": len(result.get("data", [])),
+            "queries": counter["queries"],
+            "seconds": round(elapsed, 4)
+        }
+
+
+def _int_list(value):
+    """
+    解析逗号分隔的整数列表参数，如 "10,30,60"
+    """
+    return [int(item) for item in str(value).split(",") if item.strip()]
+
+
+def benchmark_system_alerts(servers=1000, samples="10,30,60", breach_ratio=0.2):
+    """
+    基准测试：generate_system_alerts 的耗时与查询次数随样本数的变化
+    :param servers: 服务器数量
+    :param samples: 每台服务器在评估窗口内的样本数，逗号分隔可测多组
+    :param breach_ratio: 超过阈值的服务器比例，其中一半预置了未解决告警
+    """
+    from app.models import Server, MetricDefinition, ServerMetric, SystemAlert, AlarmRule
+    from app.utils.metrics_store import record_samples
+    from app.utils.monitoring_utils import generate_system_alerts, THRESHOLD
+
+    runs = []
+    for sample_count in _int_list(samples):
+        with benchmark_database(Server, MetricDefinition, ServerMetric, SystemAlert, AlarmRule) as db:
+            _seed_servers(db, servers)
+            now = datetime.utcnow()
+            step = 600 / (sample_count + 1)
+            breaching = set(random.sample(range(1, servers + 1), int(servers * breach_ratio)))
+            rows = record_samples(
+                (
+                    server_id,
+                    now - timedelta(seconds=step * (index + 1)),
+                    {"cpu_usage": round(random.uniform(THRESHOLD, 100) if server_id in breaching
+                                        else random.uniform(0, THRESHOLD), 2)}
+                )
+                for server_id in range(1, servers + 1)
+                for index in range(sample_count)
+            )
+            # 一半超限服务器已有未解决告警，用于验证去重
+            existing = sorted(breaching)[::2]
+            if existing:
+                db.session.execute(insert(SystemAlert), [
+                    {
+                        "alert_type": "server",
+                        "severity": "critical",
+                        "target_id": server_id,
+                        "target_type": "server",
+                        "message": f"Server {server_id} is overloaded",
+                        "details": {"metric": "cpu_usage"},
+                        "fingerprint": f"server:server:{server_id}:cpu_usage",
+                        "status": "active",
+                        "created_at": now
+                    }
+                    for server_id in existing
+                ])
+                db.session.commit()
+
+            with count_queries(db.engine) as counter:
+                started = time.perf_counter()
+                result = generate_system_alerts()
+                elapsed = time.perf_counter() - started
+
+            runs.append({
+                "samples": rows,
+                "success": result["success"],
+                "breached": result.get("data", {}).get("breached"),
+                "created": result.get("data", {}).get("created"),
+                "deduplicated": result.get("data", {}).get("deduplicated"),
+                "queries": counter["queries"],
+                "seconds": round(elapsed, 4)
+            })
+
+    return {"benchmark": "system_alerts", "servers": servers, "runs": runs}
+
+
+def _seed_users(db, user_count):
+    """
+    写入模拟用户
+    """
+    from app.models import User
+
+    db.session.execute(insert(User), [
+        {
+            "id": user_id,
+            "username": f"bench-user-{user_id}",
+            "email": f"bench-user-{user_id}@example.com",
+            "password": "x",
+            "role": "user"
+        }
+        for user_id in range(1, user_count + 1)
+    ])
+    db.session.commit()
+
+
+def benchmark_rental_expiry(rentals=20000, expired_ratio=0.5, batch_size=500):
+    """
+    基准测试：process_expired_rentals 分批处理到期租赁的吞吐量与查询次数
+    :param rentals: 租赁数量（每个租赁属于不同用户，各有一个容器、一条流量与一条历史记录）
+    :param expired_ratio: 已到期租赁的比例
+    :param batch_size: 每批处理的租赁数
+    """
+    from app.models import User, Server, Rental, DockerContainer, UserTraffic, UserHistory, SystemLog
+    from app.utils.tasks import process_expired_rentals
+
+    with benchmark_database(User, Server, Rental, DockerContainer, UserTraffic, UserHistory, SystemLog) as db:
+        _seed_users(db, rentals)
+        now = datetime.utcnow()
+        expired = set(random.sample(range(1, rentals + 1), int(rentals * expired_ratio)))
+        db.session.execute(insert(Rental), [
+            {
+                "id": user_id,
+                "user_id": user_id,
+                "status": "active",
+                "start_date": now - timedelta(days=30),
+                "end_date": now - timedelta(hours=1) if user_id in expired else now + timedelta(days=1)
+            }
+            for user_id in range(1, rentals + 1)
+        ])
+        db.session.execute(insert(DockerContainer), [
+            {"container_id": f"bench-{user_id}", "container_name": f"bench-{user_id}", "user_id": user_id, "status": "running"}
+            for user_id in range(1, rentals + 1)
+        ])
+        db.session.execute(insert(UserTraffic), [{"user_id": user_id} for user_id in range(1, rentals + 1)])
+        db.session.execute(insert(UserHistory), [
+            {"user_id": user_id, "action": "rental_start"} for user_id in range(1, rentals + 1)
+        ])
+        db.session.commit()
+
+        with count_queries(db.engine) as counter:
+            stats = process_expired_rentals(batch_size=batch_size, now=now)
+
+        return {
+            "benchmark": "rental_expiry",
+            "rentals": rentals,
+            "expired": len(expired),
+            "containers_left": db.session.query(DockerContainer).count(),
+            "queries": counter["queries"],
+            **stats
+        }
+
+
+def benchmark_serial_redemption(serials=200, attempts=1000, threads=32):
+    """
+    并发压测：多个线程同时兑换同一批序列号，验证每个序列号只被兑换一次
+    默认的 SQLite 内存库只有一个共享连接，无法体现并发，此时改用临时 SQLite 文件库；
+    设置 BENCHMARK_DATABASE_URL 指向临时 MySQL 库可测试行锁下的实际吞吐量
+    :param serials: 序列号数量
+    :param attempts: 兑换请求总数（每个请求使用不同用户，随机选择序列号，多数请求会争抢同一序列号）
+    :param threads: 并发线程数
+    """
+    from app.models import (User, Server, SerialNumber, Rental, DockerContainer, UserContainer, user_server_association,
+                            rental_servers, rental_containers, FinanceAggregate, Distributor)
+
+    database_url, database_file = None, None
+    if BenchmarkConfig.SQLALCHEMY_DATABASE_URI == 'sqlite://':
+        fd, database_file = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        database_url = f"sqlite:///{database_file}"
+
+    # rental_servers / rental_containers 由 resource_index 在兑换的同一次 flush 中写入，
+    # finance_aggregates 在同一事务中增量更新（按分销商汇总时读取 distributors）
+    models = (User, Server, SerialNumber, Rental, DockerContainer, UserContainer, user_server_association,
+              rental_servers, rental_containers, FinanceAggregate, Distributor)
+    try:
+        with benchmark_database(*models, database_url=database_url) as db:
+            return _run_serial_redemption(db, serials, attempts, threads)
+    finally:
+        if database_file:
+            os.remove(database_file)
+
+
+def _run_serial_redemption(db, serials, attempts, threads):
+    """
+    写入模拟数据，按线程分配兑换请求并同时开始，统计结果
+    """
+    from flask import current_app
+    from sqlalchemy import func
+    from app.models import Server, SerialNumber, Rental, DockerContainer, FinanceAggregate
+    from app.utils.rental_utils import redeem_serial
+
+    _seed_users(db, attempts)
+    _seed_servers(db, 1)
+    db.session.execute(insert(DockerContainer), [
+        {"id": 1, "container_id": "bench-1", "container_name": "bench-1", "status": "stopped"}
+    ])
+    codes = [f"030BENCH{serial_id:08d}" for serial_id in range(1, serials + 1)]
+    db.session.execute(insert(SerialNumber), [{"code": code, "status": "unused"} for code in codes])
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    plan = [(user_id, random.choice(codes)) for user_id in range(1, attempts + 1)]
+    outcomes = Counter()
+    redeemed = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def _worker(jobs):
+        barrier.wait()
+        with app.app_context():
+            for user_id, code in jobs:
+                try:
+                    result, status_code = redeem_serial(code, user_id, server_id=1, container_id=1)
+                except Exception as e:
+                    logger.warning(f"Redemption error for user {user_id}: {e}")
+                    result, status_code = {"success": False}, "error"
+                with lock:
+                    outcomes[status_code] += 1
+                    if result["success"]:
+                        redeemed[code] += 1
+            db.session.remove()
+
+    workers = [threading.Thread(target=_worker, args=(plan[index::threads],)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+
+    used = db.session.query(SerialNumber).filter_by(status="used").count()
+    rentals = db.session.query(Rental).count()
+    # 兑换时增量更新的按用户按日汇总应与实际兑换数一致
+    aggregated = db.session.query(func.coalesce(func.sum(FinanceAggregate.serial_count), 0)).filter(
+        FinanceAggregate.scope == "user", FinanceAggregate.period == "day"
+    ).scalar()
+    double_redeemed = sorted(code for code, count in redeemed.items() if count > 1)
+    return {
+        "benchmark": "serial_redemption",
+        "database": db.engine.url.get_backend_name(),
+        "serials": serials,
+        "attempts": attempts,
+        "threads": threads,
+        "succeeded": sum(redeemed.values()),
+        "outcomes": {str(key): value for key, value in outcomes.items()},
+        "serials_used": used,
+        "rentals_created": rentals,
+        "user_count": db.session.query(Server.user_count).filter_by(id=1).scalar(),
+        "aggregated_serials": int(aggregated),
+        "double_redeemed": double_redeemed,
+        # 兑换报错（如缺表）时成功数为 0，同样视为不一致
+        "consistent": not double_redeemed and not outcomes["error"] and used == rentals == aggregated == sum(redeemed.values()) > 0,
+        "seconds": round(seconds, 4),
+        "per_second": round(attempts / seconds, 1) if seconds else None
+    }
+
+
+def benchmark_serial_generation(count=100000, batch_size=5000, existing=10000):
+    """
+    基准测试：create_serial_numbers 批量生成序列号的吞吐量与查询次数
+    :param count: 生成的序列号数量
+    :param batch_size: 每批数量
+    :param existing: 预先写入的序列号数量（参与碰撞检查）
+    """
+    from app.models import SerialNumber
+    from app.utils.serial_utils import create_serial_numbers, random_codes
+
+    with benchmark_database(SerialNumber) as db:
+        # 预先写入的序列号使碰撞检查在有数据的唯一索引上执行
+        if existing:
+            db.session.execute(insert(SerialNumber), [
+                {"code": "030" + code, "status": "unused"} for code in set(random_codes(existing, 6))
+            ])
+            db.session.commit()
+        before = db.session.query(SerialNumber).count()
+
+        started = time.perf_counter()
+        with count_queries(db.engine) as counter:
+            generated = [code for codes in create_serial_numbers(count, 30, prefix="030", length=6, batch_size=batch_size)
+                         for code in codes]
+        seconds = time.perf_counter() - started
+
+        return {
+            "benchmark": "serial_generation",
+            "count": count,
+            "batch_size": batch_size,
+            "existing": before,
+            "generated": len(generated),
+            "unique": len(set(generated)),
+            "rows": db.session.query(SerialNumber).count(),
+            "queries": counter["queries"],
+            "seconds": round(seconds, 4),
+            "per_second": round(len(generated) / seconds, 1) if seconds else None
+        }
+
+
+def benchmark_finance_statistics(serials=200000, users=5000, distributors=50, days=90, events=1000):
+    """
+    基准测试：财务统计从原始数据聚合与读取 finance_aggregates 汇总行的耗时对比，以及增量更新与对账的开销
+    :param serials: 已兑换的序列号数量（兑换时间分布在最近 days 天内）
+    :param users: 用户数量
+    :param distributors: 分销商数量（一半序列号属于分销商）
+    :param days: 数据覆盖的天数
+    :param events: 增量记录的兑换、发票支付、佣金次数
+    """
+    from sqlalchemy import func
+    from app.models import User, Distributor, SerialNumber, Invoice, DistributorSerial, CommissionRecord, FinanceAggregate
+    from app.utils.finance_aggregates import (record_serial_redeemed, reconcile_finance_aggregates,
+                                              summarize_finance_aggregates)
+
+    models = (User, Distributor, SerialNumber, Invoice, DistributorSerial, CommissionRecord, FinanceAggregate)
+    with benchmark_database(*models) as db:
+        _seed_users(db, users)
+        roles = ["distributor", "golden_distributor", "platinum_distributor"]
+        db.session.execute(insert(Distributor), [
+            {"id": distributor_id, "username": f"bench-dist-{distributor_id}", "email": f"bench-dist-{distributor_id}@example.com",
+             "role": roles[distributor_id % 3], "commission_rate": 10, "distributor_mode": "mode1"}
+            for distributor_id in range(1, distributors + 1)
+        ])
+        now = datetime.utcnow()
+        for offset in range(0, serials, 10000):
+            db.session.execute(insert(SerialNumber), [
+                {
+                    "code": f"030B{serial_id:010d}",
+                    "status": "used",
+                    "user_id": random.randint(1, users),
+                    "distributor_id": random.randint(1, distributors) if serial_id % 2 else None,
+                    "valid_days": 30,
+                    "used_at": now - timedelta(seconds=random.randint(0, days * 86400 - 1))
+                }
+                for serial_id in range(offset + 1, min(offset + 10000, serials) + 1)
+            ])
+        db.session.commit()
+
+        started = time.perf_counter()
+        initial = reconcile_finance_aggregates(days=days, repair=True)
+        build_seconds = time.perf_counter() - started
+
+        start = (now - timedelta(days=days)).date()
+        started = time.perf_counter()
+        raw = db.session.query(SerialNumber.user_id, func.sum(SerialNumber.valid_days)).filter(
+            SerialNumber.used_at >= start).group_by(SerialNumber.user_id).all()
+        raw_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        with count_queries(db.engine) as counter:
+            summary = summarize_finance_aggregates("user", "month", start, now.date(), limit=100)
+        aggregate_seconds = time.perf_counter() - started
+
+        # 增量更新：兑换走 record_serial_redeemed，发票和佣金走会话事件
+        started = time.perf_counter()
+        for i in range(events):
+            user_id, distributor_id = random.randint(1, users), random.randint(1, distributors)
+            db.session.execute(insert(SerialNumber).values(
+                code=f"030E{i:010d}", status="used", user_id=user_id, distributor_id=distributor_id, valid_days=30, used_at=now))
+            record_serial_redeemed(db.session.connection(), user_id, distributor_id, 30, now)
+            invoice = Invoice(user_id=random.randint(1, users), amount=10, status="pending")
+            db.session.add(invoice)
+            db.session.flush()
+            invoice.status = "paid"
+            db.session.add(CommissionRecord(distributor_id=random.randint(1, distributors), commission_amount=1))
+            db.session.commit()
+        event_seconds = time.perf_counter() - started
+        # 增量更新后的汇总应与原始数据一致
+        after = reconcile_finance_aggregates(days=days)
+
+        return {
+            "benchmark": "finance_statistics",
+            "serials": serials,
+            "users": users,
+            "aggregate_rows": db.session.query(FinanceAggregate).count(),
+            "build_seconds": round(build_seconds, 4),
+            "initial_mismatches": len(initial["mismatches"]),
+            "raw_query_seconds": round(raw_seconds, 4),
+            "raw_users": len(raw),
+            "aggregate_query_seconds": round(aggregate_seconds, 4),
+            "aggregate_queries": counter["queries"],
+            "total_serial_days": summary["totals"]["serial_days"],
+            "events": events,
+            "event_ms": round(event_seconds / events * 1000, 3) if events else None,
+            "mismatches_after_events": len(after["mismatches"])
+        }
+
+
+def benchmark_commission_settlement(serials=1000000, users=200000, distributors=1000, invoices=200000):
+    """
+    基准测试：settle_commissions 对一个月的全部分销商结算的耗时、查询次数，以及重复执行的结果是否一致
+    :param serials: 已兑换的序列号数量（80% 属于分销商，兑换时间在结算月之前或月内）
+    :param users: 用户数量
+    :param distributors: 分销商数量
+    :param invoices: 结算月内已支付的发票数量
+    """
+    from app.models import (User, Distributor, SerialNumber, Invoice, DistributorSerial, CommissionRecord,
+                            FinanceSettlement, FinanceAggregate)
+    from app.utils.commission_settlement import settle_commissions
+    from app.utils.finance_aggregates import reconcile_finance_aggregates
+
+    period_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    period = period_start.strftime("%Y-%m")
+    models = (User, Distributor, SerialNumber, Invoice, DistributorSerial, CommissionRecord, FinanceSettlement,
+              FinanceAggregate)
+    with benchmark_database(*models) as db:
+        _seed_users(db, users)
+        roles = ["distributor", "golden_distributor", "platinum_distributor"]
+        db.session.execute(insert(Distributor), [
+            {"id": distributor_id, "username": f"bench-dist-{distributor_id}", "email": f"bench-dist-{distributor_id}@example.com",
+             "role": roles[distributor_id % 3], "commission_rate": random.choice([5, 10, 15]), "distributor_mode": "mode1"}
+            for distributor_id in range(1, distributors + 1)
+        ])
+        for offset in range(0, serials, 50000):
+            db.session.execute(insert(SerialNumber), [
+                {
+                    "code": f"030S{serial_id:010d}",
+                    "status": "used",
+                    "user_id": random.randint(1, users),
+                    "distributor_id": random.randint(1, distributors) if random.random() < 0.8 else None,
+                    "valid_days": 30,
+                    "used_at": period_start - timedelta(seconds=random.randint(-86400 * 10, 86400 * 60))
+                }
+                for serial_id in range(offset + 1, min(offset + 50000, serials) + 1)
+            ])
+        for offset in range(0, invoices, 50000):
+            db.session.execute(insert(Invoice), [
+                {
+                    "user_id": random.randint(1, users),
+                    "amount": random.choice([10, 30, 90]),
+                    "status": "paid",
+                    "payment_time": period_start + timedelta(seconds=random.randint(86400 * 11, 86400 * 25))
+                }
+                for _ in range(offset, min(offset + 50000, invoices))
+            ])
+        db.session.commit()
+
+        with count_queries(db.engine) as counter:
+            first = settle_commissions(period)
+        queries = counter["queries"]
+        second = settle_commissions(period)
+
+        # 标记一个结算单为已支付后再次执行：该分销商的佣金和结算单保持不变
+        paid = db.session.query(FinanceSettlement).order_by(FinanceSettlement.id).first()
+        paid_id, paid_amount = (paid.id, paid.settlement_amount) if paid else (None, None)
+        if paid:
+            paid.status = "paid"
+            db.session.commit()
+        third = settle_commissions(period)
+        paid_after = db.session.get(FinanceSettlement, paid_id) if paid_id else None
+
+        return {
+            "benchmark": "commission_settlement",
+            "serials": serials,
+            "invoices": invoices,
+            "distributors": distributors,
+            "queries": queries,
+            "first_run": first,
+            "second_run": second,
+            "third_run_with_paid_settlement": third,
+            "paid_settlement_unchanged": paid_after is not None and paid_after.settlement_amount == paid_amount,
+            "commission_records": db.session.query(CommissionRecord).count(),
+            "settlements": db.session.query(FinanceSettlement).count(),
+            # 模拟数据直接写入，未生成序列号和发票的汇总，只比较佣金
+            "commission_aggregate_mismatches": sum(
+                1 for item in reconcile_finance_aggregates(days=1)["mismatches"]
+                if item["expected"]["commission_amount"] != item["stored"]["commission_amount"]
+            )
+        }
+
+
+def benchmark_audit_log(records=20000, threads=8):
+    """
+    基准测试：log_operation 入队的调用耗时与后台批量写入，对比每条记录单独提交的写法
+    :param records: 日志记录总数
+    :param threads: 并发调用的线程数
+    """
+    from flask import current_app
+    from app.models import User, SystemLog
+    from app.utils.logging_utils import log_operation, shutdown_audit_writer, get_audit_metrics
+
+    with benchmark_database(User, SystemLog) as db:
+        _seed_users(db, 100)
+        app = current_app._get_current_object()
+
+        # 对照：每条记录在会话中单独 add + commit
+        baseline = min(records, 2000)
+        started = time.perf_counter()
+        for i in range(baseline):
+            db.session.add(SystemLog(level="info", operation="bench", message="success", user_id=i % 100 + 1))
+            db.session.commit()
+        commit_seconds = time.perf_counter() - started
+        db.session.query(SystemLog).delete()
+        db.session.commit()
+
+        per_thread = records // threads
+
+        def _worker():
+            with app.app_context():
+                for i in range(per_thread):
+                    log_operation(i % 100 + 1, "bench", "success", f"record {i}")
+
+        before = get_audit_metrics()
+        started = time.perf_counter()
+        workers = [threading.Thread(target=_worker) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        enqueue_seconds = time.perf_counter() - started
+        shutdown_audit_writer()
+        drain_seconds = time.perf_counter() - started
+        after = get_audit_metrics()
+
+        return {
+            "benchmark": "audit_log",
+            "records": per_thread * threads,
+            "threads": threads,
+            "commit_per_record_us": round(commit_seconds / baseline * 1e6, 1),
+            "enqueue_per_record_us": round(enqueue_seconds / (per_thread * threads) * 1e6, 1),
+            "drain_seconds": round(drain_seconds, 4),
+            "enqueue_waits": after["enqueue_waits"] - before["enqueue_waits"],
+            "written": after["written"] - before["written"],
+            "dropped": after["dropped"] - before["dropped"],
+            "batches": after["batches"] - before["batches"],
+            "rows": db.session.query(SystemLog).count()
+        }
+
+
+# 基准测试注册表：名称 -> (函数, 参数定义)
+BENCHMARKS = {
+    "fleet_load": (benchmark_fleet_load, {"servers": int, "samples": int, "window_minutes": int}),
+    "system_alerts": (benchmark_system_alerts, {"servers": int, "samples": str, "breach_ratio": float}),
+    "rental_expiry": (benchmark_rental_expiry, {"rentals": int, "expired_ratio": float, "batch_size": int}),
+    "serial_redemption": (benchmark_serial_redemption, {"serials": int, "attempts": int, "threads": int}),
+    "serial_generation": (benchmark_serial_generation, {"count": int, "batch_size": int, "existing": int}),
+    "finance_statistics": (benchmark_finance_statistics, {"serials": int, "users": int, "distributors": int,
+                                                          "days": int, "events": int}),
+    "commission_settlement": (benchmark_commission_settlement, {"serials": int, "users": int, "distributors": int,
+                                                                "invoices": int}),
+    "audit_log": (benchmark_audit_log, {"records": int, "threads": int}),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DERP management performance benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    for name, (func, params) in BENCHMARKS.items():
+        subparser = subparsers.add_parser(name, help=func.__doc__.strip().splitlines()[0])
+        for param, param_type in params.items():
+            subparser.add_argument(f"--{param.replace('_', '-')}", dest=param, type=param_type)
+
+    args = vars(parser.parse_args(argv))
+    func, _ = BENCHMARKS[args.pop("benchmark")]
+    result = func(**{key: value for key, value in args.items() if value is not None})
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
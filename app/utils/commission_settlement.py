@@ -0,0 +1,193 @@
+"""
+分销商佣金结算引擎。
+
+按月（period = 'YYYY-MM'）对全部分销商一次性计算佣金，全部使用集合运算（INSERT ... SELECT），
+不在 Python 中逐行处理：
+1. 周期内已支付的发票（按 payment_time）归属于发票用户在支付前最后一次兑换的、带分销商的序列号
+   （SerialNumber.user_id / distributor_id / used_at）；
+2. 佣金 = 发票金额 × Distributor.commission_rate / 100，每张发票写入一条 CommissionRecord；
+3. 按分销商汇总写入 FinanceSettlement（每个分销商每个周期一行）。
+
+可重复执行：每次重算该周期内未支付的佣金记录和结算单（先删除再写入），已支付的结算单及其分销商保持不变；
+CommissionRecord.invoice_id 唯一，同一张发票不会重复计算佣金。
+佣金变化同步记入财务汇总（finance_aggregates）。
+
+用法：
+    python -m app.utils.commission_settlement --period 2025-01
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import date, datetime
+from celery import shared_task
+from sqlalchemy import Date, delete, exists, func, insert, literal, select
+from app.utils.finance_aggregates import add_finance_deltas
+
+logger = logging.getLogger(__name__)
+
+
+def parse_period(period):
+    """
+    解析结算周期 'YYYY-MM'
+    :return: (周期起始时间, 下一周期起始时间)
+    :raises ValueError: 格式错误
+    """
+    start = datetime.strptime(period, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def previous_period(today=None):
+    """
+    上一个自然月的结算周期
+    """
+    today = today or datetime.utcnow().date()
+    first = today.replace(day=1)
+    last_month = date(first.year - 1, 12, 1) if first.month == 1 else first.replace(month=first.month - 1)
+    return last_month.strftime("%Y-%m")
+
+
+def _commission_totals(connection, period, frozen, status='pending'):
+    """
+    按分销商和日期汇总周期内的佣金记录（用于同步财务汇总）
+    """
+    from app.models import CommissionRecord
+
+    created_on = func.date(CommissionRecord.created_at, type_=Date)
+    query = select(CommissionRecord.distributor_id, created_on, func.sum(CommissionRecord.commission_amount)).where(
+        CommissionRecord.period == period, CommissionRecord.status == status
+    ).group_by(CommissionRecord.distributor_id, created_on)
+    if frozen:
+        query = query.where(CommissionRecord.distributor_id.notin_(frozen))
+    return connection.execute(query).all()
+
+
+def settle_commissions(period, now=None):
+    """
+    计算一个周期的分销商佣金与结算单（单个事务，提交一次）
+    :param period: 结算周期 'YYYY-MM'
+    :return: 统计信息字典
+    :raises ValueError: 周期格式错误
+    """
+    from app import db
+    from app.models import SerialNumber, Invoice, Distributor, CommissionRecord, FinanceSettlement
+
+    start, end = parse_period(period)
+    now = now or datetime.utcnow()
+    started = time.perf_counter()
+    try:
+        connection = db.session.connection()
+
+        # 已支付结算单的分销商本周期不再重算
+        frozen = connection.execute(
+            select(FinanceSettlement.distributor_id).where(
+                FinanceSettlement.period == period, FinanceSettlement.status == 'paid'
+            )
+        ).scalars().all()
+
+        # 1. 删除本周期未支付的佣金记录（同步从财务汇总中扣除）
+        removed = _commission_totals(connection, period, frozen)
+        stmt = delete(CommissionRecord).where(CommissionRecord.period == period, CommissionRecord.status == 'pending')
+        if frozen:
+            stmt = stmt.where(CommissionRecord.distributor_id.notin_(frozen))
+        deleted = connection.execute(stmt).rowcount
+
+        # 2. 发票归属的分销商：发票用户在支付前最后一次兑换的带分销商的序列号
+        attributed = select(SerialNumber.distributor_id).where(
+            SerialNumber.user_id == Invoice.user_id,
+            SerialNumber.distributor_id.isnot(None),
+            SerialNumber.used_at <= Invoice.payment_time
+        ).order_by(SerialNumber.used_at.desc(), SerialNumber.id.desc()).limit(1).correlate(Invoice).scalar_subquery()
+        sales = select(
+            Invoice.id.label("invoice_id"), Invoice.amount.label("amount"), attributed.label("distributor_id")
+        ).where(
+            Invoice.status == 'paid',
+            Invoice.payment_time >= start,
+            Invoice.payment_time < end,
+            ~exists().where(CommissionRecord.invoice_id == Invoice.id)
+        ).subquery()
+        commissions = select(
+            sales.c.distributor_id,
+            sales.c.invoice_id,
+            literal(period),
+            func.round(sales.c.amount * Distributor.commission_rate / 100, 2),
+            literal('pending'),
+            literal(now)
+        ).join(Distributor, Distributor.id == sales.c.distributor_id)
+        if frozen:
+            commissions = commissions.where(Distributor.id.notin_(frozen))
+        created = connection.execute(
+            insert(CommissionRecord).from_select(
+                ["distributor_id", "invoice_id", "period", "commission_amount", "status", "created_at"], commissions
+            )
+        ).rowcount
+
+        # 3. 重建本周期未支付的结算单
+        stmt = delete(FinanceSettlement).where(FinanceSettlement.period == period, FinanceSettlement.status != 'paid')
+        connection.execute(stmt)
+        totals = select(
+            CommissionRecord.distributor_id,
+            literal(period),
+            func.count(),
+            func.sum(CommissionRecord.commission_amount),
+            literal('pending'),
+            literal(now)
+        ).where(CommissionRecord.period == period).group_by(CommissionRecord.distributor_id)
+        if frozen:
+            totals = totals.where(CommissionRecord.distributor_id.notin_(frozen))
+        settlements = connection.execute(
+            insert(FinanceSettlement).from_select(
+                ["distributor_id", "period", "commission_count", "settlement_amount", "status", "created_at"], totals
+            )
+        ).rowcount
+
+        # 4. 财务汇总：减去删除的佣金，加上新写入的佣金
+        added = _commission_totals(connection, period, frozen)
+        add_finance_deltas(connection, [
+            ("distributor", distributor_id, day, {"commission_amount": -amount}) for distributor_id, day, amount in removed
+        ] + [
+            ("distributor", distributor_id, day, {"commission_amount": amount}) for distributor_id, day, amount in added
+        ])
+
+        amount = sum((row[2] for row in added), 0)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    stats = {
+        "period": period,
+        "frozen_distributors": len(frozen),
+        "commissions_deleted": deleted,
+        "commissions_created": created,
+        "settlements": settlements,
+        "pending_amount": str(amount),
+        "seconds": round(time.perf_counter() - started, 4)
+    }
+    logger.info(f"Commission settlement for {period}: {stats}")
+    return stats
+
+
+@shared_task(name="finance.settle_commissions", ignore_result=True)
+def settle_commissions_task(period=None):
+    """
+    Celery 任务：结算指定周期，默认上一个自然月（可由 celery beat 每月调度）
+    """
+    return settle_commissions(period or previous_period())
+
+
+def main(argv=None):
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Distributor commission settlement")
+    parser.add_argument("--period", default=None, help="settlement period YYYY-MM (default: previous month)")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        print(json.dumps(settle_commissions(args.period or previous_period()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,7 @@ import paramiko
 import logging
 from app.config import Config  # 引入 Config
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger('docker_utils')
+logger = logging.getLogger(__name__)
 
 
 class DockerSSHManager:
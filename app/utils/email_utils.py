@@ -4,15 +4,14 @@ import logging
 from flask_mail import Message
 from app import mail
 import os
-import redis
 import traceback
 from datetime import datetime
+from app.utils.redis_utils import get_redis_client
+from app.utils.notification_queue import enqueue_email
 
-# 初始化 Redis 连接
-redis_client = redis.StrictRedis(host=os.getenv('REDIS_HOST', 'localhost'), port=6379, db=0)
+# 共享连接池的 Redis 客户端
+redis_client = get_redis_client()
 
-# 日志配置
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 生成随机验证码
@@ -95,9 +94,10 @@ def validate_verification_code(email, code):
         return False
 
 # 发送续费提醒邮件
-def send_expiry_notification(email, days_to_expiry, expiry_date):
+def send_expiry_notification(email, days_to_expiry, expiry_date, user_id=None):
     """
     发送续费提醒邮件 - 纯通知功能，不需要验证码
+    邮件放入发送队列后立即返回，由 Celery worker 发送
     """
     try:
         subject = "【重要】您的服务即将到期"  # 更醒目的主题
@@ -124,15 +124,9 @@ def send_expiry_notification(email, days_to_expiry, expiry_date):
 + 祝您使用愉快！
         """
 
-        msg = Message(
-            subject=subject,
-            sender=os.getenv('MAIL_USERNAME'),
-            recipients=[email]
-        )
-        msg.body = body
-
-        mail.send(msg)
-        logger.info(f"Expiry notification sent to {email}")
+        if not enqueue_email(email, subject, body, user_id=user_id):
+            return False
+        logger.info(f"Expiry notification queued for {email}")
         return True
 
     except Exception as e:
@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+from datetime import datetime
+import redis
+from app.config import Config
+from app.utils.redis_utils import get_redis_client, get_stream_client
+
+logger = logging.getLogger(__name__)
+
+# 实时事件保存在 Redis Stream 中：生产者 XADD 一次，任意数量的 SSE 连接各自按事件 ID 读取，
+# 断线重连时从 Last-Event-ID 之后继续读取
+redis_client = get_redis_client(decode_responses=True)
+# SSE 连接的 XREAD BLOCK 使用独立连接池，不与发布事件共用连接
+stream_client = get_stream_client()
+
+EVENT_TYPES = ("alert", "traffic")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def publish_event(event_type, data):
+    """
+    发布一条实时事件
+    :param event_type: 事件类型（alert 或 traffic）
+    :param data: 事件内容字典，server_id / container_id 字段用于客户端过滤
+    :return: 事件 ID；Redis 不可用时返回 None（事件推送失败不影响业务流程）
+    """
+    fields = {
+        "type": event_type,
+        "server_id": "" if data.get("server_id") is None else str(data["server_id"]),
+        "container_id": "" if data.get("container_id") is None else str(data["container_id"]),
+        "data": json.dumps(data, default=_json_default, ensure_ascii=False)
+    }
+    try:
+        return redis_client.xadd(Config.EVENT_STREAM_KEY, fields, maxlen=Config.EVENT_STREAM_MAXLEN, approximate=True)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to publish {event_type} event: {e}")
+        return None
+
+
+def serialize_alert(alert, action):
+    """
+    把告警转换为事件内容（alert 可以是 SystemAlert 对象或批量写入时使用的字典）
+    """
+    get = alert.get if isinstance(alert, dict) else lambda key: getattr(alert, key, None)
+    target_type = get("target_type")
+    return {
+        "action": action,
+        "id": get("id"),
+        "alert_type": get("alert_type"),
+        "target_type": target_type,
+        "target_id": get("target_id"),
+        "server_id": get("target_id") if target_type == "server" else None,
+        "container_id": get("target_id") if target_type == "container" else None,
+        "message": get("message"),
+        "severity": get("severity"),
+        "status": get("status"),
+        "details": get("details") or {},
+        "fingerprint": get("fingerprint"),
+        "created_at": get("created_at"),
+        "updated_at": get("updated_at"),
+        "resolved_at": get("resolved_at")
+    }
+
+
+def publish_alert_event(alert, action):
+    """
+    发布告警状态变化事件
+    :param action: created / updated / resolved / deleted
+    """
+    return publish_event("alert", serialize_alert(alert, action))
+
+
+def _format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+def _matches(fields, types, server_ids, container_ids):
+    if types and fields.get("type") not in types:
+        return False
+    if server_ids and fields.get("server_id") not in server_ids:
+        return False
+    if container_ids and fields.get("type") == "traffic" and fields.get("container_id") not in container_ids:
+        return False
+    return True
+
+
+def _is_trimmed(last_event_id):
+    """
+    判断 last_event_id 之后的事件是否已被 MAXLEN 裁剪（客户端落后太多）
+    """
+    info = redis_client.xinfo_stream(Config.EVENT_STREAM_KEY)
+    first = info.get("first-entry")
+    if not first or info.get("length", 0) < Config.EVENT_STREAM_MAXLEN:
+        # Stream 尚未达到保留上限，不会有事件被裁剪
+        return False
+    first_ms, _, first_seq = first[0].partition("-")
+    last_ms, _, last_seq = last_event_id.partition("-")
+    return (int(last_ms), int(last_seq or 0)) < (int(first_ms), int(first_seq or 0))
+
+
+def iter_sse_events(last_event_id=None, types=None, server_ids=None, container_ids=None, max_seconds=None):
+    """
+    生成 SSE 响应内容
+    :param last_event_id: 从该事件 ID 之后开始推送，默认只推送新事件
+    :param types: 只推送这些类型的事件
+    :param server_ids: 只推送这些服务器的事件（字符串集合）
+    :param container_ids: 只推送这些容器的流量事件（字符串集合）
+    :param max_seconds: 连接最长时间，到期后结束响应，由客户端携带 Last-Event-ID 重连
+
+    背压：每个连接按自己的速度从 Stream 中批量读取，服务端不为慢客户端堆积队列；
+    同一批次中同一容器只推送最新的流量事件；落后超过 Stream 保留窗口时推送 reset 事件，
+    客户端应重新拉取一次全量数据。
+    """
+    deadline = time.monotonic() + (max_seconds or Config.EVENT_STREAM_MAX_SECONDS)
+    # 客户端断线后 3 秒重连
+    yield "retry: 3000\n\n"
+
+    try:
+        cursor = last_event_id
+        if cursor and _is_trimmed(cursor):
+            cursor = None
+            yield "event: reset\ndata: {\"reason\": \"events expired\"}\n\n"
+        if not cursor:
+            # 只推送新事件：从当前最后一条事件之后开始读取（不用 "$"，避免两次读取之间的事件丢失）
+            latest = redis_client.xrevrange(Config.EVENT_STREAM_KEY, count=1)
+            cursor = latest[0][0] if latest else "0-0"
+    except (redis.RedisError, ValueError) as e:
+        logger.error(f"Error opening event stream: {e}")
+        yield "event: unavailable\ndata: {\"message\": \"event stream unavailable\"}\n\n"
+        return
+
+    while time.monotonic() < deadline:
+        try:
+            response = stream_client.xread(
+                {Config.EVENT_STREAM_KEY: cursor},
+                count=Config.EVENT_STREAM_BATCH_SIZE,
+                block=Config.EVENT_STREAM_BLOCK_MS
+            )
+        except redis.RedisError as e:
+            logger.error(f"Error reading event stream: {e}")
+            yield "event: unavailable\ndata: {\"message\": \"event stream unavailable\"}\n\n"
+            return
+
+        if not response:
+            # 心跳注释，保持连接并及时发现已断开的客户端
+            yield ": keepalive\n\n"
+            continue
+
+        entries = response[0][1]
+        cursor = entries[-1][0]
+
+        # 同一批次内的流量事件按容器合并，只保留最新一条
+        latest_traffic = {}
+        for event_id, fields in entries:
+            if fields.get("type") == "traffic":
+                latest_traffic[fields.get("container_id")] = event_id
+
+        for event_id, fields in entries:
+            if fields.get("type") == "traffic" and latest_traffic.get(fields.get("container_id")) != event_id:
+                continue
+            if _matches(fields, types, server_ids, container_ids):
+                yield _format_sse(event_id, fields.get("type"), fields.get("data"))
@@ -0,0 +1,312 @@
+"""
+到期调度器。
+
+即将到期的 Rental.end_date、SerialNumber.expires_at、UserContainer.expiry_date 保存在 Redis 有序集合中
+（成员 "<类型>:<ID>"，分数为到期时间戳）。调度进程只读取集合头部，在最近的到期时间醒来，
+分批处理已到期的条目，不再全表扫描。
+
+会话提交时自动同步截止时间：新建、续费（截止时间变化）会重新安排，状态变为非有效或删除时移出集合。
+序列号只在未使用（unused）时调度；兑换（claim_serial 的 Core UPDATE 不经过会话事件）时通过 track_expiry_change 移出集合。
+
+用法：
+    python -m app.utils.expiry_scheduler            # 常驻运行
+    python -m app.utils.expiry_scheduler --rebuild  # 从数据库重建调度集合后运行
+"""
+import argparse
+import logging
+import math
+import time
+from datetime import datetime
+import redis
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 共享连接池的 Redis 客户端
+redis_client = get_redis_client(decode_responses=True)
+
+SCHEDULE_KEY = "expiry:schedule"
+# 有新的到期时间写入时推送一个唤醒信号，调度进程提前醒来重新计算等待时间
+WAKEUP_KEY = "expiry:wakeup"
+
+# 只在分数未变化时移除条目：处理期间被续费（分数已更新）的条目保留在集合中
+REMOVE_IF_UNCHANGED = redis_client.register_script("""
+local removed = 0
+for i = 1, #ARGV, 2 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+""")
+
+# 只在分数未变化时改为重试时间：被其他事务锁定而跳过的条目稍后重新处理，期间被续费的条目保持新的截止时间
+RESCHEDULE_IF_UNCHANGED = redis_client.register_script("""
+local rescheduled = 0
+for i = 2, #ARGV, 2 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[i])
+        rescheduled = rescheduled + 1
+    end
+end
+return rescheduled
+""")
+
+_tracking_registered = False
+
+
+def _tracked_models():
+    """
+    需要调度的模型：模型 -> (类型, 截止时间字段, 判断是否仍需调度的函数)
+    """
+    from app.models import Rental, SerialNumber, UserContainer
+
+    return {
+        Rental: ("rental", "end_date", lambda obj: obj.status == 'active'),
+        SerialNumber: ("serial", "expires_at", lambda obj: obj.status == 'unused'),
+        UserContainer: ("user_container", "expiry_date", lambda obj: obj.status == 'active'),
+    }
+
+
+def _timestamp(value):
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+def schedule_expiries(entries):
+    """
+    写入或移除到期条目
+    :param entries: [(类型, ID, 截止时间)]，截止时间为 None 表示移出集合
+    """
+    if not entries:
+        return
+    pipeline = redis_client.pipeline()
+    mapping = {f"{kind}:{item_id}": _timestamp(deadline) for kind, item_id, deadline in entries if deadline}
+    removed = [f"{kind}:{item_id}" for kind, item_id, deadline in entries if not deadline]
+    if mapping:
+        pipeline.zadd(SCHEDULE_KEY, mapping)
+        pipeline.lpush(WAKEUP_KEY, 1)
+        pipeline.ltrim(WAKEUP_KEY, 0, 0)
+    if removed:
+        pipeline.zrem(SCHEDULE_KEY, *removed)
+    pipeline.execute()
+
+
+def track_expiry_change(session, kind, item_id, deadline):
+    """
+    记录一个会话事件看不到的截止时间变化（如 Core UPDATE），提交后写入 Redis，回滚时丢弃
+    :param kind: 类型，如 "serial"
+    :param item_id: ID
+    :param deadline: 新的截止时间，None 表示移出集合
+    """
+    session.info.setdefault("expiry_changes", {})[(kind, item_id)] = deadline
+
+
+def _collect_changes(session, flush_context):
+    """
+    flush 后记录截止时间或状态发生变化的对象，提交后统一写入 Redis
+    """
+    tracked = _tracked_models()
+    changes = session.info.setdefault("expiry_changes", {})
+    for obj in list(session.new) + list(session.dirty):
+        spec = tracked.get(type(obj))
+        if not spec:
+            continue
+        kind, field, is_active = spec
+        state = inspect(obj)
+        if obj not in session.new and not any(
+            state.attrs[name].history.has_changes() for name in (field, "status")
+        ):
+            continue
+        deadline = getattr(obj, field)
+        changes[(kind, obj.id)] = deadline if deadline and is_active(obj) else None
+    for obj in session.deleted:
+        spec = tracked.get(type(obj))
+        if spec:
+            changes[(spec[0], obj.id)] = None
+
+
+def _apply_changes(session):
+    changes = session.info.pop("expiry_changes", None)
+    if not changes:
+        return
+    try:
+        schedule_expiries([(kind, item_id, deadline) for (kind, item_id), deadline in changes.items()])
+    except redis.RedisError as e:
+        # 调度集合未同步时，条目仍会被 /api/rental/check_expiry 或重建集合后处理
+        logger.warning(f"Failed to update expiry schedule for {len(changes)} item(s): {e}")
+
+
+def _discard_changes(session):
+    session.info.pop("expiry_changes", None)
+
+
+def register_expiry_tracking():
+    """
+    注册会话事件，使截止时间的变更在提交后自动同步到调度集合
+    """
+    global _tracking_registered
+    if _tracking_registered:
+        return
+    event.listen(Session, "after_flush", _collect_changes)
+    event.listen(Session, "after_commit", _apply_changes)
+    event.listen(Session, "after_soft_rollback", lambda session, previous_transaction: _discard_changes(session))
+    _tracking_registered = True
+
+
+def rebuild_schedule(batch_size=None):
+    """
+    从数据库重建调度集合（首次部署或 Redis 数据丢失时使用），按主键分批读取
+    :return: 写入的条目数
+    """
+    from app import db
+
+    batch_size = batch_size or Config.EXPIRY_SCHEDULER_BATCH_SIZE
+    total = 0
+    for model, (kind, field, _) in _tracked_models().items():
+        column = getattr(model, field)
+        query = db.session.query(model.id, column).filter(column.isnot(None))
+        if kind == "serial":
+            query = query.filter(model.status == 'unused')
+        else:
+            query = query.filter(model.status == 'active')
+
+        last_id = 0
+        while True:
+            rows = query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            schedule_expiries([(kind, row[0], row[1]) for row in rows])
+            total += len(rows)
+            last_id = rows[-1][0]
+    logger.info(f"Expiry schedule rebuilt with {total} item(s)")
+    return total
+
+
+def process_due(now=None, batch_size=None):
+    """
+    处理一批已到期的条目
+    已处理、已续期或不再有效的条目移出集合；仍有效且已到期的条目（租赁被其他事务锁定、skip_locked 跳过）
+    保留在集合中，Config.EXPIRY_SCHEDULER_RETRY_DELAY 秒后重试
+    :return: 本批取出的条目数
+    """
+    from app import db
+    from app.models import Rental, SerialNumber, UserContainer
+    from app.utils.tasks import expire_rentals
+
+    batch_size = batch_size or Config.EXPIRY_SCHEDULER_BATCH_SIZE
+    now = now or datetime.utcnow()
+    due = redis_client.zrangebyscore(SCHEDULE_KEY, "-inf", _timestamp(now), start=0, num=batch_size, withscores=True)
+    if not due:
+        return 0
+
+    ids = {"rental": [], "serial": [], "user_container": []}
+    for member, _ in due:
+        kind, _, item_id = member.partition(":")
+        if kind in ids and item_id.isdigit():
+            ids[kind].append(int(item_id))
+
+    try:
+        # 条件更新：截止时间已被续期的条目不会被处理
+        if ids["rental"]:
+            expire_rentals(ids["rental"], now=now)
+        if ids["serial"]:
+            db.session.execute(
+                update(SerialNumber)
+                .where(SerialNumber.id.in_(ids["serial"]), SerialNumber.status == 'unused', SerialNumber.expires_at <= now)
+                .values(status='expired', updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        if ids["user_container"]:
+            db.session.execute(
+                update(UserContainer)
+                .where(UserContainer.id.in_(ids["user_container"]), UserContainer.status == 'active', UserContainer.expiry_date <= now)
+                .values(status='inactive', updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # 提交后仍有效且已到期的条目没有被处理（被锁定跳过），不能移出集合
+    pending_filters = {
+        "rental": (Rental, Rental.status == 'active', Rental.end_date <= now),
+        "serial": (SerialNumber, SerialNumber.status == 'unused', SerialNumber.expires_at <= now),
+        "user_container": (UserContainer, UserContainer.status == 'active', UserContainer.expiry_date <= now),
+    }
+    pending = set()
+    try:
+        for kind, item_ids in ids.items():
+            if item_ids:
+                model, *conditions = pending_filters[kind]
+                rows = db.session.query(model.id).filter(model.id.in_(item_ids), *conditions).all()
+                pending.update(f"{kind}:{row[0]}" for row in rows)
+    finally:
+        db.session.rollback()
+
+    done = [value for member, score in due if member not in pending for value in (member, score)]
+    retry = [value for member, score in due if member in pending for value in (member, score)]
+    if done:
+        REMOVE_IF_UNCHANGED(keys=[SCHEDULE_KEY], args=done)
+    if retry:
+        RESCHEDULE_IF_UNCHANGED(keys=[SCHEDULE_KEY], args=[_timestamp(now) + Config.EXPIRY_SCHEDULER_RETRY_DELAY] + retry)
+    logger.info(f"Processed {len(due) - len(pending)} due expiry item(s), {len(pending)} locked and retried later: "
+                f"{len(ids['rental'])} rentals, {len(ids['serial'])} serials, {len(ids['user_container'])} containers")
+    return len(due)
+
+
+def seconds_until_next():
+    """
+    距离下一个截止时间的秒数，集合为空时返回 None
+    """
+    head = redis_client.zrange(SCHEDULE_KEY, 0, 0, withscores=True)
+    if not head:
+        return None
+    return max(0.0, head[0][1] - _timestamp(datetime.utcnow()))
+
+
+def run_scheduler(stop_event=None):
+    """
+    常驻运行：处理完到期条目后阻塞等待到下一个截止时间，期间有新条目写入时提前醒来
+    :param stop_event: threading.Event，设置后退出
+    """
+    logger.info("Expiry scheduler started")
+    while not (stop_event and stop_event.is_set()):
+        try:
+            # 一次最多处理一批，到期条目较多时连续处理
+            if process_due() >= Config.EXPIRY_SCHEDULER_BATCH_SIZE:
+                continue
+            delay = seconds_until_next()
+            timeout = Config.EXPIRY_SCHEDULER_MAX_SLEEP if delay is None else min(delay, Config.EXPIRY_SCHEDULER_MAX_SLEEP)
+            if timeout > 0:
+                # Redis 6.0 之前的 BLPOP 只接受整数秒，向上取整（最多晚醒来不到 1 秒）
+                redis_client.blpop(WAKEUP_KEY, timeout=math.ceil(timeout))
+        except redis.RedisError as e:
+            logger.error(f"Expiry scheduler lost Redis connection: {e}")
+            time.sleep(5)
+        except Exception as e:
+            logger.error(f"Expiry scheduler error: {e}", exc_info=True)
+            time.sleep(5)
+
+
+def main(argv=None):
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Rental / serial number expiry scheduler")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the schedule from the database before running")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        if args.rebuild or not redis_client.exists(SCHEDULE_KEY):
+            rebuild_schedule()
+        run_scheduler()
+
+
+if __name__ == "__main__":
+    main()
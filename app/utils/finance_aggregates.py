@@ -0,0 +1,440 @@
+"""
+财务汇总（finance_aggregates 表）。
+
+按 用户 / 分销商 / 分销商等级（Distributor.role）与 日 / 月 汇总：兑换的序列号数量与天数、已支付发票数量与金额、
+佣金金额。汇总行在产生数据的同一事务中增量更新（INSERT ... ON DUPLICATE KEY UPDATE 累加），仪表盘只读取汇总行：
+- 兑换序列号：claim_serial 直接调用 record_serial_redeemed；
+- 发票支付、佣金记录：会话 flush 时根据 Invoice / CommissionRecord 的新增、修改、删除计算增量；
+  直接执行的 Core INSERT/UPDATE 不经过会话事件，需要调用方自行调用 add_finance_deltas（如结算引擎）。
+
+分销商等级按事件发生时分销商的等级记入；修改分销商等级或通过其它途径改动原始数据后，
+对账任务会发现差异，使用 --repair 按原始数据重写。
+
+用法：
+    python -m app.utils.finance_aggregates --reconcile --days 7            # 对账，只报告差异
+    python -m app.utils.finance_aggregates --reconcile --days 400 --repair # 对账并按原始数据修正（首次部署时执行）
+"""
+import argparse
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from celery import shared_task
+from sqlalchemy import Date, event, func, inspect, select
+from sqlalchemy.orm import Session
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 汇总指标
+MEASURES = ("serial_count", "serial_days", "invoice_count", "invoice_amount", "commission_amount")
+# 金额指标，比较和写入时保留两位小数
+AMOUNT_MEASURES = ("invoice_amount", "commission_amount")
+PERIODS = ("day", "month")
+
+_tracking_registered = False
+
+
+def period_start(day, period):
+    """
+    日期所在汇总周期的第一天
+    """
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.replace(day=1) if period == "month" else day
+
+
+def _normalize(measures):
+    return {
+        name: Decimal(measures.get(name) or 0).quantize(Decimal("0.01")) if name in AMOUNT_MEASURES
+        else int(measures.get(name) or 0)
+        for name in MEASURES
+    }
+
+
+def _distributor_levels(connection, distributor_ids):
+    """
+    查询分销商等级：{分销商 ID: 等级}
+    """
+    from app.models import Distributor
+
+    distributor_ids = {int(distributor_id) for distributor_id in distributor_ids if distributor_id is not None}
+    if not distributor_ids:
+        return {}
+    return dict(connection.execute(
+        select(Distributor.id, Distributor.role).where(Distributor.id.in_(distributor_ids))
+    ).all())
+
+
+def _with_levels(connection, entries):
+    """
+    为分销商维度的增量补上对应等级维度的增量
+    :param entries: [(维度, 维度键, 日期, 指标字典)]
+    """
+    levels = _distributor_levels(connection, [key for scope, key, _, _ in entries if scope == "distributor"])
+    expanded = list(entries)
+    for scope, key, day, measures in entries:
+        if scope == "distributor" and levels.get(int(key)):
+            expanded.append(("level", levels[int(key)], day, measures))
+    return expanded
+
+
+def _upsert(connection, rows, increment=True):
+    """
+    写入汇总行：increment 为 True 时在已有行上累加，否则覆盖
+    按唯一键排序后写入，并发事务以相同顺序加锁，避免 MySQL 死锁
+    """
+    from app.models import FinanceAggregate
+
+    if not rows:
+        return
+    table = FinanceAggregate.__table__
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    stmt = dialect_insert(table)
+    new = stmt.inserted if dialect == "mysql" else stmt.excluded
+    values = {name: table.c[name] + new[name] if increment else new[name] for name in MEASURES}
+    values["updated_at"] = new.updated_at
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**values)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.scope, table.c.scope_key, table.c.period, table.c.period_start], set_=values
+        )
+
+    now = datetime.utcnow()
+    rows = sorted(rows, key=lambda row: (row["scope"], row["scope_key"], row["period"], row["period_start"]))
+    connection.execute(stmt, [{**row, "updated_at": now} for row in rows])
+
+
+def add_finance_deltas(connection, entries):
+    """
+    累加财务汇总（与调用方在同一事务中），每条增量同时记入日汇总和月汇总
+    :param connection: 当前事务的连接（db.session.connection()）
+    :param entries: [(维度 user / distributor / level, 维度键, 日期, {指标: 增量})]，
+                    分销商维度会自动补上等级维度
+    """
+    totals = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+    for scope, key, day, measures in _with_levels(connection, entries):
+        if key is None or day is None:
+            continue
+        for period in PERIODS:
+            row = totals[(scope, str(key), period, period_start(day, period))]
+            for name, value in measures.items():
+                row[name] += value
+    rows = [
+        {"scope": scope, "scope_key": key, "period": period, "period_start": start, **_normalize(measures)}
+        for (scope, key, period, start), measures in totals.items()
+        if any(measures.values())
+    ]
+    _upsert(connection, rows)
+
+
+def record_serial_redeemed(connection, user_id, distributor_id, valid_days, used_at):
+    """
+    记录一次序列号兑换：用户维度，以及序列号所属分销商（和等级）维度
+    """
+    measures = {"serial_count": 1, "serial_days": valid_days or 0}
+    entries = [("user", user_id, used_at, measures)]
+    if distributor_id is not None:
+        entries.append(("distributor", distributor_id, used_at, measures))
+    add_finance_deltas(connection, entries)
+
+
+def _values(obj, names, old):
+    """
+    读取对象字段的当前值，或本次 flush 前的值（old 为 True）
+    """
+    state = inspect(obj)
+    values = {}
+    for name in names:
+        history = state.attrs[name].history
+        values[name] = history.deleted[0] if old and history.deleted else getattr(obj, name)
+    return values
+
+
+def _invoice_entries(values, sign):
+    if values["status"] != 'paid' or not values["payment_time"] or values["user_id"] is None:
+        return []
+    return [("user", values["user_id"], values["payment_time"],
+             {"invoice_count": sign, "invoice_amount": sign * (values["amount"] or 0)})]
+
+
+def _commission_entries(values, sign):
+    if values["distributor_id"] is None or not values["created_at"]:
+        return []
+    return [("distributor", values["distributor_id"], values["created_at"],
+             {"commission_amount": sign * (values["commission_amount"] or 0)})]
+
+
+def _tracked_models():
+    """
+    会话中需要跟踪的模型：模型 -> (字段, 计算增量的函数)
+    """
+    from app.models import Invoice, CommissionRecord
+
+    return {
+        Invoice: (("user_id", "status", "amount", "payment_time"), _invoice_entries),
+        CommissionRecord: (("distributor_id", "commission_amount", "created_at"), _commission_entries),
+    }
+
+
+def _stamp_paid_invoices(session, flush_context, instances):
+    """
+    flush 前为变为已支付但没有支付时间的发票补上支付时间，汇总与对账都按支付时间归入日期
+    """
+    from app.models import Invoice
+
+    for obj in list(session.new) + list(session.dirty):
+        if type(obj) is Invoice and obj.status == 'paid' and obj.payment_time is None:
+            obj.payment_time = datetime.utcnow()
+
+
+def _collect_flushed(session, flush_context):
+    """
+    flush 后按 新值 - 旧值 计算发票和佣金记录的增量，写入汇总（与本次 flush 在同一事务中）
+    """
+    tracked = _tracked_models()
+    entries = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        spec = tracked.get(type(obj))
+        if not spec:
+            continue
+        fields, entries_of = spec
+        if obj in session.new:
+            entries += entries_of(_values(obj, fields, old=False), 1)
+        elif obj in session.deleted:
+            entries += entries_of(_values(obj, fields, old=True), -1)
+        elif any(inspect(obj).attrs[name].history.has_changes() for name in fields):
+            entries += entries_of(_values(obj, fields, old=True), -1)
+            entries += entries_of(_values(obj, fields, old=False), 1)
+    if entries:
+        add_finance_deltas(session.connection(), entries)
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def register_finance_tracking():
+    """
+    注册会话事件，使发票支付和佣金记录在 flush 时同步到财务汇总
+    """
+    global _tracking_registered
+    if _tracking_registered:
+        return
+    for model, (fields, _) in _tracked_models().items():
+        for name in fields:
+            # 修改已过期（提交后）的字段时先加载旧值，flush 后才能计算 新值 - 旧值
+            event.listen(getattr(model, name), "set", _keep_old_value, active_history=True)
+    event.listen(Session, "before_flush", _stamp_paid_invoices)
+    event.listen(Session, "after_flush", _collect_flushed)
+    _tracking_registered = True
+
+
+def get_finance_aggregates(scope="user", period="month", start=None, end=None, scope_key=None):
+    """
+    读取汇总行
+    :param start: 起始日期（含），按周期对齐
+    :param end: 结束日期（含）
+    :return: 汇总行列表，按周期、维度键排序
+    """
+    from app import db
+    from app.models import FinanceAggregate
+
+    query = db.session.query(
+        FinanceAggregate.scope_key, FinanceAggregate.period_start, *[getattr(FinanceAggregate, name) for name in MEASURES]
+    ).filter(FinanceAggregate.scope == scope, FinanceAggregate.period == period)
+    if start:
+        query = query.filter(FinanceAggregate.period_start >= period_start(start, period))
+    if end:
+        query = query.filter(FinanceAggregate.period_start <= end)
+    if scope_key is not None:
+        query = query.filter(FinanceAggregate.scope_key == str(scope_key))
+    return [
+        {"scope_key": row.scope_key, "period_start": row.period_start,
+         **{name: getattr(row, name) for name in MEASURES}}
+        for row in query.order_by(FinanceAggregate.period_start, FinanceAggregate.scope_key)
+    ]
+
+
+def summarize_finance_aggregates(scope="user", period="month", start=None, end=None, limit=100):
+    """
+    汇总一段时间内的汇总行（用于仪表盘）：合计、按周期的序列、按维度键的排行，各一条 GROUP BY 查询
+    :param limit: 排行返回的维度键数量
+    :return: {"totals": {...}, "series": [...], "breakdown": [...]}
+    """
+    from app import db
+    from app.models import FinanceAggregate
+
+    sums = [func.coalesce(func.sum(getattr(FinanceAggregate, name)), 0).label(name) for name in MEASURES]
+    conditions = [FinanceAggregate.scope == scope, FinanceAggregate.period == period]
+    if start:
+        conditions.append(FinanceAggregate.period_start >= period_start(start, period))
+    if end:
+        conditions.append(FinanceAggregate.period_start <= end)
+
+    totals = db.session.execute(select(*sums).where(*conditions)).one()
+    series = db.session.execute(
+        select(FinanceAggregate.period_start, *sums).where(*conditions)
+        .group_by(FinanceAggregate.period_start).order_by(FinanceAggregate.period_start)
+    ).all()
+    breakdown = db.session.execute(
+        select(FinanceAggregate.scope_key, *sums).where(*conditions).group_by(FinanceAggregate.scope_key)
+        .order_by(*[sums[MEASURES.index(name)].desc() for name in ("invoice_amount", "serial_days", "commission_amount")])
+        .limit(limit)
+    ).all()
+    return {
+        "totals": _normalize(totals._mapping),
+        "series": [{"period_start": row.period_start.isoformat(), **_normalize(row._mapping)} for row in series],
+        "breakdown": [{"scope_key": row.scope_key, **_normalize(row._mapping)} for row in breakdown]
+    }
+
+
+def compute_finance_aggregates(start, end):
+    """
+    从原始数据计算 [start, end) 内的日汇总和月汇总（start、end 应为月初，否则月汇总不完整）
+    :return: {(维度, 维度键, 周期, 周期起始日): 指标字典}
+    """
+    from app import db
+    from app.models import SerialNumber, Invoice, CommissionRecord
+
+    start_at = datetime.combine(start, datetime.min.time())
+    end_at = datetime.combine(end, datetime.min.time())
+    connection = db.session.connection()
+    entries = []
+
+    used_on = func.date(SerialNumber.used_at, type_=Date)
+    for user_id, distributor_id, day, count, days in connection.execute(
+        select(SerialNumber.user_id, SerialNumber.distributor_id, used_on,
+               func.count(), func.sum(func.coalesce(SerialNumber.valid_days, 0)))
+        .where(SerialNumber.used_at >= start_at, SerialNumber.used_at < end_at, SerialNumber.user_id.isnot(None))
+        .group_by(SerialNumber.user_id, SerialNumber.distributor_id, used_on)
+    ):
+        measures = {"serial_count": count, "serial_days": days}
+        entries.append(("user", user_id, day, measures))
+        if distributor_id is not None:
+            entries.append(("distributor", distributor_id, day, measures))
+
+    paid_on = func.date(Invoice.payment_time, type_=Date)
+    for user_id, day, count, amount in connection.execute(
+        select(Invoice.user_id, paid_on, func.count(), func.sum(Invoice.amount))
+        .where(Invoice.status == 'paid', Invoice.user_id.isnot(None),
+               Invoice.payment_time >= start_at, Invoice.payment_time < end_at)
+        .group_by(Invoice.user_id, paid_on)
+    ):
+        entries.append(("user", user_id, day, {"invoice_count": count, "invoice_amount": amount}))
+
+    created_on = func.date(CommissionRecord.created_at, type_=Date)
+    for distributor_id, day, amount in connection.execute(
+        select(CommissionRecord.distributor_id, created_on, func.sum(CommissionRecord.commission_amount))
+        .where(CommissionRecord.distributor_id.isnot(None),
+               CommissionRecord.created_at >= start_at, CommissionRecord.created_at < end_at)
+        .group_by(CommissionRecord.distributor_id, created_on)
+    ):
+        entries.append(("distributor", distributor_id, day, {"commission_amount": amount}))
+
+    totals = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+    for scope, key, day, measures in _with_levels(connection, entries):
+        for period in PERIODS:
+            row = totals[(scope, str(key), period, period_start(day, period))]
+            for name, value in measures.items():
+                row[name] += value or 0
+    return {key: _normalize(measures) for key, measures in totals.items()}
+
+
+def reconcile_finance_aggregates(days=None, repair=False, today=None):
+    """
+    对账：按原始数据重新计算最近 days 天所在各月的汇总，与汇总表逐行比较
+    :param days: 对账的天数，默认 Config.FINANCE_RECONCILE_DAYS；起始日期向前对齐到月初
+    :param repair: 是否按原始数据覆盖不一致的汇总行
+    :return: {"start", "end", "checked", "mismatches": [...], "repaired"}
+    """
+    from app import db
+    from app.models import FinanceAggregate
+
+    days = days or Config.FINANCE_RECONCILE_DAYS
+    today = today or datetime.utcnow().date()
+    start = (today - timedelta(days=days - 1)).replace(day=1)
+    end = today + timedelta(days=1)
+
+    expected = compute_finance_aggregates(start, end)
+    stored = {}
+    for row in db.session.query(FinanceAggregate).filter(
+        FinanceAggregate.period_start >= start, FinanceAggregate.period_start < end
+    ):
+        stored[(row.scope, row.scope_key, row.period, row.period_start)] = _normalize(
+            {name: getattr(row, name) for name in MEASURES}
+        )
+
+    zero = _normalize({})
+    mismatched = sorted(key for key in set(expected) | set(stored) if expected.get(key, zero) != stored.get(key, zero))
+    mismatches = [
+        {
+            "scope": scope, "scope_key": scope_key, "period": period, "period_start": start_day.isoformat(),
+            "expected": {name: str(value) for name, value in expected.get(key, zero).items()},
+            "stored": {name: str(value) for name, value in stored.get(key, zero).items()}
+        }
+        for key in mismatched for scope, scope_key, period, start_day in [key]
+    ]
+
+    if mismatches:
+        logger.warning(f"Finance aggregates reconciliation found {len(mismatches)} mismatched row(s) "
+                       f"between {start} and {end}")
+    if mismatches and repair:
+        try:
+            _upsert(db.session.connection(), [
+                {"scope": scope, "scope_key": scope_key, "period": period, "period_start": start_day,
+                 **expected.get((scope, scope_key, period, start_day), zero)}
+                for scope, scope_key, period, start_day in mismatched
+            ], increment=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        logger.info(f"Repaired {len(mismatches)} finance aggregate row(s)")
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "checked": len(set(expected) | set(stored)),
+        "mismatches": mismatches,
+        "repaired": len(mismatches) if repair else 0
+    }
+
+
+@shared_task(name="finance.reconcile_aggregates", ignore_result=True)
+def reconcile_finance_aggregates_task(days=None, repair=False):
+    """
+    Celery 任务：定期对账（可由 celery beat 调度）
+    """
+    result = reconcile_finance_aggregates(days=days, repair=repair)
+    return {"checked": result["checked"], "mismatches": len(result["mismatches"]), "repaired": result["repaired"]}
+
+
+def main(argv=None):
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Finance aggregates")
+    parser.add_argument("--reconcile", action="store_true", help="compare aggregates against the raw data")
+    parser.add_argument("--days", type=int, default=None, help="number of days to check (aligned to month start)")
+    parser.add_argument("--repair", action="store_true", help="overwrite mismatched rows with the recomputed values")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        if args.reconcile:
+            print(json.dumps(reconcile_finance_aggregates(args.days, args.repair), indent=2))
+        else:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+集中的日志配置。
+
+所有模块只需 logger = logging.getLogger(__name__)，不要再调用 logging.basicConfig 或自行添加 Handler：
+- 根 logger 只有一个 QueueHandler，记录放入内存队列后立即返回，请求线程不会阻塞在文件 I/O 上；
+  QueueListener 线程把记录写入日志文件（按大小轮转）和控制台。队列满时丢弃记录并计数。
+- 记录格式为 JSON（LOG_FORMAT=text 时为单行文本），请求中产生的记录带 request_id、method、path，
+  请求结束时输出一条带 status 和 latency_ms 的访问日志（logger: app.access）。
+- 级别由 Config.LOG_LEVEL 配置，可以按模块单独设置，例如 "INFO,app.utils.auth_utils=WARNING,sqlalchemy=WARNING"。
+- DEBUG / INFO 记录按调用位置采样：每个调用位置每 LOG_SAMPLE_WINDOW 秒最多输出 LOG_SAMPLE_BURST 条，
+  其余丢弃，窗口结束后输出的第一条记录带上被丢弃的条数（sampled_suppressed）。WARNING 及以上和访问日志不采样。
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("app.access")
+
+# LogRecord 自带的属性，其余属性（logger.info(..., extra={...}) 传入的字段）原样输出到 JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_state = {"listener": None, "handler": None}
+_lock = threading.Lock()
+
+
+def parse_levels(value):
+    """
+    解析日志级别配置 "INFO,app.utils.auth_utils=WARNING"
+    :return: (根级别, {logger 名: 级别})
+    """
+    root_level, levels = logging.INFO, {}
+    for item in str(value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, level = item.rpartition("=")
+        level = logging.getLevelName(level.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Invalid log level in LOG_LEVEL: {item}")
+        if name.strip():
+            levels[name.strip()] = level
+        else:
+            root_level = level
+    return root_level, levels
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    在产生记录的线程中补上请求信息（QueueListener 线程中没有请求上下文）
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, "request_id", None)
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按调用位置（文件 + 行号）对 DEBUG / INFO 记录限流采样
+    :param exempt: 不采样的 logger 名（如访问日志，每个请求一条，不能丢）
+    """
+
+    def __init__(self, burst, window, exempt=()):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.exempt = set(exempt)
+        self._sites = {}  # (文件, 行号) -> [窗口开始时间, 已输出条数, 丢弃条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.burst <= 0 or record.name in self.exempt:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.sampled_suppressed = suppressed
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    队列满时丢弃记录并计数，不阻塞调用线程；异常堆栈在入队前格式化为文本
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条记录输出为一行 JSON
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    单行文本格式，附加字段以 key=value 形式追加在消息后
+    """
+
+    def __init__(self):
+        super().__init__("[%(asctime)s] %(levelname)s in %(module)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        extra = " ".join(f"{key}={value}" for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        return f"{text} {extra}" if extra else text
+
+
+def configure_logging(config=Config):
+    """
+    配置根 logger（每个进程只配置一次，重复调用只更新级别）
+    :param config: 配置类或 app.config
+    """
+    get = config.get if isinstance(config, dict) else lambda name, default=None: getattr(config, name, default)
+    root_level, levels = parse_levels(get("LOG_LEVEL", "INFO"))
+    root = logging.getLogger()
+    root.setLevel(root_level)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    with _lock:
+        if _state["listener"] is not None:
+            return
+        formatter = TextFormatter() if str(get("LOG_FORMAT", "json")).lower() == "text" else JsonFormatter()
+        handlers = []
+        log_file = get("LOG_FILE")
+        if log_file:
+            file_handler = RotatingFileHandler(
+                log_file, maxBytes=get("LOG_FILE_MAX_BYTES", 100000000), backupCount=get("LOG_FILE_BACKUP_COUNT", 3),
+                encoding="utf-8"
+            )
+            handlers.append(file_handler)
+        if get("LOG_CONSOLE", True):
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=get("LOG_QUEUE_SIZE", 10000)))
+        queue_handler.addFilter(RequestContextFilter())
+        queue_handler.addFilter(SamplingFilter(
+            get("LOG_SAMPLE_BURST", 100), get("LOG_SAMPLE_WINDOW", 10), exempt=(access_logger.name,)
+        ))
+
+        # 替换之前（如第三方库调用 basicConfig）添加到根 logger 的 Handler
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _state.update({"listener": listener, "handler": queue_handler})
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    写完队列中的日志并停止写入线程（进程退出时自动调用）
+    """
+    with _lock:
+        listener = _state["listener"]
+        _state["listener"] = None
+    if listener is not None:
+        listener.stop()
+
+
+def get_logging_metrics():
+    """
+    日志队列深度与丢弃数
+    """
+    handler = _state["handler"]
+    if handler is None:
+        return {"queue_depth": 0, "dropped": 0}
+    return {"queue_depth": handler.queue.qsize(), "queue_capacity": handler.queue.maxsize, "dropped": handler.dropped}
+
+
+def register_request_logging(app):
+    """
+    为每个请求分配 request_id（沿用请求头 X-Request-ID），请求结束时输出访问日志并在响应头中返回 request_id
+    """
+
+    @app.before_request
+    def _start_request_log():
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_request_log(response):
+        started = getattr(g, "request_started", None)
+        if started is not None:
+            access_logger.info("request completed", extra={
+                "status": response.status_code,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+                "remote_addr": request.remote_addr
+            })
+        if getattr(g, "request_id", None):
+            response.headers["X-Request-ID"] = g.request_id
+        return response
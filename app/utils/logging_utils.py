@@ -1,30 +1,204 @@
-from app.models import SystemLog, db
-from flask import request
-from datetime import datetime
+"""
+系统操作日志（审计日志）。
+
+log_operation 只把记录放入进程内队列并立即返回，不使用也不提交请求的会话；
+后台写入线程从队列中取出记录，每攒够 AUDIT_BATCH_SIZE 条或每隔 AUDIT_FLUSH_INTERVAL 秒，
+用独立连接批量 INSERT 到 system_logs。进程退出时写完队列中剩余的记录。
+队列满时最多等待 AUDIT_ENQUEUE_TIMEOUT 秒，仍然满才丢弃并计数，审计日志最多让请求短暂等待、不会长时间阻塞；
+队列深度、等待次数、丢弃数等见 get_audit_metrics。
+"""
+import atexit
 import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from app.config import Config
+from app.models import SystemLog, User, db
 
 logger = logging.getLogger("app_logs")
 
+# 写入失败时的重试次数，超过后丢弃该批记录
+AUDIT_WRITE_RETRIES = 3
+
+_queue = queue.Queue(maxsize=Config.AUDIT_QUEUE_SIZE)
+_stop = object()  # 停止写入线程的标记
+_lock = threading.Lock()
+_writer = None
+_metrics = {"enqueued": 0, "enqueue_waits": 0, "written": 0, "dropped": 0, "write_errors": 0, "batches": 0,
+            "last_flush_at": None}
+
+# 操作状态 -> 日志级别
+STATUS_LEVELS = {"success": "info", "failed": "warning", "error": "error"}
+
+
+def _truncate(value, length=1024):
+    if value is None:
+        return None
+    value = str(value)
+    return value if len(value) <= length else value[:length - 3] + "..."
+
+
+def _count(name, value=1):
+    with _lock:
+        _metrics[name] += value
+
+
+def _write_rows(app, rows):
+    """
+    批量写入引用了不存在用户的记录时整批失败：查出仍存在的用户，其余记录去掉 user_id，
+    在一个事务中整批重写。要么全部写入要么全部回滚，失败重试时不会产生重复记录
+    """
+    user_ids = {row["user_id"] for row in rows if row["user_id"] is not None}
+    with app.app_context():
+        with db.engine.begin() as connection:
+            existing = set(connection.execute(select(User.id).where(User.id.in_(user_ids))).scalars()) if user_ids else set()
+            connection.execute(insert(SystemLog), [
+                row if row["user_id"] is None or row["user_id"] in existing else {**row, "user_id": None}
+                for row in rows
+            ])
+
+
+def _write_batch(app, rows):
+    """
+    用独立连接批量写入一批日志，失败时重试，仍失败则丢弃并计数
+    """
+    for attempt in range(1, AUDIT_WRITE_RETRIES + 1):
+        try:
+            try:
+                with app.app_context():
+                    with db.engine.begin() as connection:
+                        connection.execute(insert(SystemLog), rows)
+            except IntegrityError:
+                _write_rows(app, rows)
+            with _lock:
+                _metrics["written"] += len(rows)
+                _metrics["batches"] += 1
+                _metrics["last_flush_at"] = datetime.utcnow().isoformat()
+            return
+        except Exception as e:
+            _count("write_errors")
+            if attempt == AUDIT_WRITE_RETRIES:
+                _count("dropped", len(rows))
+                logger.error(f"Failed to write {len(rows)} audit log record(s), dropped: {e}")
+                return
+            time.sleep(0.5 * attempt)
+
+
+def _run_writer(app):
+    """
+    写入线程：按数量或时间阈值批量写入，收到停止标记时写完当前批次后退出
+    """
+    batch = []
+    deadline = None
+    while True:
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            item = _queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+
+        stopping = item is _stop
+        if item is not None and not stopping:
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + Config.AUDIT_FLUSH_INTERVAL
+        if batch and (stopping or len(batch) >= Config.AUDIT_BATCH_SIZE or time.monotonic() >= deadline):
+            _write_batch(app, batch)
+            batch = []
+            deadline = None
+        if stopping:
+            return
+
+
+def _ensure_writer():
+    """
+    在第一次记录日志时启动写入线程（需要应用上下文来获取数据库连接）
+    """
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return True
+    if not has_app_context():
+        return False
+    with _lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(
+                target=_run_writer, args=(current_app._get_current_object(),), name="audit-log-writer", daemon=True
+            )
+            _writer.start()
+    return True
+
+
+def shutdown_audit_writer(timeout=10):
+    """
+    写完队列中剩余的记录并停止写入线程（进程退出时自动调用）
+    :param timeout: 最长等待秒数
+    """
+    global _writer
+    writer = _writer
+    if writer is None or not writer.is_alive():
+        return
+    try:
+        _queue.put(_stop, timeout=timeout)
+    except queue.Full:
+        logger.warning("Audit log queue is full at shutdown, remaining records may be lost")
+        return
+    writer.join(timeout)
+    _writer = None
+
+
+atexit.register(shutdown_audit_writer)
+
+
+def get_audit_metrics():
+    """
+    审计日志写入指标
+    :return: 队列深度、容量、入队数、队列满时等待的次数、已写入数、丢弃数、写入错误数、批次数、最后写入时间、写入线程是否运行
+    """
+    with _lock:
+        metrics = dict(_metrics)
+    metrics.update({
+        "queue_depth": _queue.qsize(),
+        "queue_capacity": _queue.maxsize,
+        "writer_alive": bool(_writer and _writer.is_alive())
+    })
+    return metrics
+
+
 def log_operation_to_db(user_id, operation, status, details=None):
     """
-    写入系统操作日志到数据库
-    """
-    ip_address = request.remote_addr if request else "Unknown"
-    log = SystemLog(
-        user_id=user_id,
-        operation=operation,
-        status=status,
-        ip_address=ip_address,
-        details=details,
-        timestamp=datetime.utcnow()
-    )
+    写入系统操作日志到数据库：放入队列，由后台线程批量写入，不使用请求的会话
+    :return: 是否已放入队列（等待 AUDIT_ENQUEUE_TIMEOUT 秒后队列仍满，或无法启动写入线程时丢弃，返回 False）
+    """
+    record = {
+        "level": STATUS_LEVELS.get(status, "info"),
+        "module": request.blueprint if has_request_context() else None,
+        "message": _truncate(status),
+        "details": _truncate(details),
+        "user_id": user_id,
+        "operation": _truncate(operation, 255),
+        "ip_address": request.remote_addr if has_request_context() else "Unknown",
+        "created_at": datetime.utcnow()
+    }
+    if not _ensure_writer():
+        _count("dropped")
+        logger.warning(f"Audit log writer unavailable outside an app context, dropped: {operation} {status}")
+        return False
     try:
-        db.session.add(log)
-        db.session.commit()
-        logger.info(f"[DB LOG] Operation logged: User {user_id}, Operation {operation}, Status {status}")
-    except Exception as e:
-        logger.error(f"Failed to log operation to DB: {e}")
-        db.session.rollback()
+        _queue.put_nowait(record)
+    except queue.Full:
+        # 突发写入时短暂等待写入线程腾出空间，超时后才丢弃
+        _count("enqueue_waits")
+        try:
+            _queue.put(record, timeout=Config.AUDIT_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            _count("dropped")
+            return False
+    _count("enqueued")
+    return True
 
 
 def log_operation_to_file(operation, message, level="INFO"):
@@ -0,0 +1,162 @@
+import logging
+import re
+import threading
+import time
+import zlib
+import requests
+from requests.adapters import HTTPAdapter
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 所有 exporter 共用一个 Session：HTTPAdapter 按 host:port 维护连接池，
+# 同一 exporter 的请求复用 keep-alive 连接
+exporter_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=Config.METRICS_PROXY_MAX_EXPORTERS,
+    pool_maxsize=Config.METRICS_PROXY_POOL_SIZE
+)
+exporter_session.mount("http://", _adapter)
+exporter_session.mount("https://", _adapter)
+
+# exporter 响应的短时缓存：{url: (过期时间, 响应内容)}，同一进程内所有客户端共享
+_cache = {}
+_cache_lock = threading.Lock()
+# 每个 url 一把锁，缓存过期时只有一个请求回源，其余请求等待后直接读缓存
+_fetch_locks = {}
+
+# 指标名：Prometheus 文本格式中样本行与 HELP/TYPE 注释的指标名
+METRIC_NAME_RE = re.compile(r'[a-zA-Z_:][a-zA-Z0-9_:]*')
+# histogram / summary 的样本行带这些后缀，归属于去掉后缀的指标族
+FAMILY_SUFFIXES = ("_bucket", "_sum", "_count", "_total", "_created")
+
+# 流式输出时每积累这么多字节向客户端发送一次
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def _fetch_lock(url):
+    with _cache_lock:
+        return _fetch_locks.setdefault(url, threading.Lock())
+
+
+def fetch_metrics(url, max_age=None):
+    """
+    获取 exporter 的指标文本，ttl 内的重复请求直接返回缓存
+    :param url: exporter 的 /metrics 地址
+    :param max_age: 缓存有效期（秒），默认 Config.METRICS_PROXY_CACHE_TTL，0 表示不使用缓存
+    :return: 响应内容（bytes）
+    :raises requests.RequestException: 请求 exporter 失败
+    """
+    max_age = Config.METRICS_PROXY_CACHE_TTL if max_age is None else max_age
+    if max_age <= 0:
+        response = exporter_session.get(url, timeout=Config.METRICS_PROXY_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    cached = _cache.get(url)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    with _fetch_lock(url):
+        # 等锁期间其它请求可能已经刷新了缓存
+        cached = _cache.get(url)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        response = exporter_session.get(url, timeout=Config.METRICS_PROXY_TIMEOUT)
+        response.raise_for_status()
+        body = response.content
+        with _cache_lock:
+            _cache[url] = (time.monotonic() + max_age, body)
+            if len(_cache) > Config.METRICS_PROXY_MAX_EXPORTERS:
+                # 清理已过期的条目，避免下线的 exporter 长期占用内存
+                now = time.monotonic()
+                for key in [key for key, (expires_at, _) in _cache.items() if expires_at <= now]:
+                    _cache.pop(key, None)
+                    _fetch_locks.pop(key, None)
+        return body
+
+
+def _compile_matchers(matches):
+    """
+    把 match[] 参数转换为指标族匹配函数
+    支持精确的指标族名（node_cpu_seconds_total）和前缀通配（node_memory_*）
+    """
+    exact, prefixes = set(), []
+    for match in matches:
+        match = match.strip()
+        if not match:
+            continue
+        if match.endswith("*"):
+            prefixes.append(match[:-1])
+        else:
+            exact.add(match)
+    if not exact and not prefixes:
+        return None
+    prefixes = tuple(prefixes)
+    return lambda family: family in exact or (bool(prefixes) and family.startswith(prefixes))
+
+
+def _family_of(name, current_family):
+    """
+    计算样本所属的指标族：紧跟在 HELP/TYPE 注释后的 xxx_bucket / xxx_sum 等样本归属于 xxx
+    """
+    if current_family and name != current_family and name.startswith(current_family):
+        if name[len(current_family):] in FAMILY_SUFFIXES:
+            return current_family
+    return name
+
+
+def filter_metrics(body, matches):
+    """
+    只保留指定指标族的行（含对应的 HELP/TYPE 注释）
+    :param body: exporter 返回的指标文本（bytes）
+    :param matches: match[] 参数列表，为空时原样返回
+    :return: 逐行生成的 bytes
+    """
+    matcher = _compile_matchers(matches or [])
+    if matcher is None:
+        yield body
+        return
+
+    current_family = None
+    for line in body.decode("utf-8", errors="replace").splitlines(keepends=True):
+        if line.startswith("#"):
+            parts = line.split(None, 3)
+            if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                current_family = parts[2]
+                if matcher(current_family):
+                    yield line.encode("utf-8")
+            continue
+
+        name = METRIC_NAME_RE.match(line)
+        if name and matcher(_family_of(name.group(0), current_family)):
+            yield line.encode("utf-8")
+
+
+def buffer_stream(chunks):
+    """
+    把逐行生成的内容合并为不小于 STREAM_CHUNK_SIZE 的块，减少响应写入次数
+    """
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b"".join(buffered)
+            buffered, size = [], 0
+    if buffered:
+        yield b"".join(buffered)
+
+
+def gzip_stream(chunks, level=6):
+    """
+    边生成边压缩，向客户端流式输出 gzip 数据
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31：gzip 格式
+    for chunk in buffer_stream(chunks):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
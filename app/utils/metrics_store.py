@@ -0,0 +1,204 @@
+import logging
+import numbers
+from datetime import datetime
+from weakref import WeakKeyDictionary
+from sqlalchemy import func, insert, and_, Integer, cast
+from app import db
+from app.models import MetricDefinition, ServerMetric
+
+logger = logging.getLogger(__name__)
+
+# 已知指标的单位，首次写入时自动登记到 metric_definitions
+METRIC_UNITS = {
+    "cpu_usage": "%",
+    "memory_usage": "%",
+    "disk_usage": "%",
+    "load_average": "",
+    "load_average_5": "",
+    "load_average_15": "",
+    "network_rx_bytes": "bytes",
+    "network_tx_bytes": "bytes",
+    "rtt_avg": "ms",
+    "rtt_max": "ms",
+    "packet_loss": "%",
+}
+
+# 每批写入的最大行数
+INSERT_BATCH_SIZE = 5000
+
+# 指标名 -> ID 的进程内缓存，按数据库引擎区分
+_metric_id_cache = WeakKeyDictionary()
+
+
+def _insert_ignore(model):
+    """
+    构造忽略主键冲突的批量 INSERT 语句（MySQL: INSERT IGNORE，SQLite: INSERT OR IGNORE）
+    """
+    return insert(model).prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+
+def get_metric_ids(names, session=None, create=True):
+    """
+    获取指标名对应的指标 ID，不存在的指标自动登记
+    :param names: 指标名列表
+    :param session: 数据库会话，默认 db.session
+    :param create: 是否自动登记不存在的指标
+    :return: {指标名: 指标 ID}
+    """
+    session = session or db.session
+    cache = _metric_id_cache.setdefault(session.get_bind(), {})
+    missing = [name for name in set(names) if name not in cache]
+
+    if missing:
+        cache.update(session.query(MetricDefinition.name, MetricDefinition.id)
+                     .filter(MetricDefinition.name.in_(missing)).all())
+        unknown = [name for name in missing if name not in cache]
+        if unknown and create:
+            # 在独立连接上登记新指标并立即提交，调用方事务回滚不会让缓存中的 ID 失效
+            with session.get_bind().begin() as connection:
+                connection.execute(_insert_ignore(MetricDefinition), [
+                    {"name": name, "unit": METRIC_UNITS.get(name), "created_at": datetime.utcnow()}
+                    for name in unknown
+                ])
+            cache.update(session.query(MetricDefinition.name, MetricDefinition.id)
+                         .filter(MetricDefinition.name.in_(unknown)).all())
+
+    return {name: cache[name] for name in names if name in cache}
+
+
+def record_samples(samples, session=None, commit=True):
+    """
+    批量写入指标样本
+    :param samples: (server_id, ts, {指标名: 数值}) 元组的可迭代对象，非数值指标会被忽略
+    :param session: 数据库会话，默认 db.session
+    :param commit: 是否在写入后提交事务
+    :return: 写入的样本行数
+    """
+    session = session or db.session
+    samples = list(samples)
+    names = {
+        name for _, _, metrics in samples
+        for name, value in metrics.items()
+        if isinstance(value, numbers.Real) and not isinstance(value, bool)
+    }
+    if not names:
+        return 0
+
+    metric_ids = get_metric_ids(names, session)
+    rows = [
+        {"server_id": server_id, "metric_id": metric_ids[name], "ts": ts, "value": float(value)}
+        for server_id, ts, metrics in samples
+        for name, value in metrics.items()
+        if name in metric_ids and isinstance(value, numbers.Real) and not isinstance(value, bool)
+    ]
+
+    for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+        session.execute(_insert_ignore(ServerMetric), rows[offset:offset + INSERT_BATCH_SIZE])
+    if commit:
+        session.commit()
+
+    logger.debug(f"Recorded {len(rows)} metric samples")
+    return len(rows)
+
+
+def query_range(server_id, metric, start, end=None, above=None, below=None, session=None):
+    """
+    查询单台服务器某指标在时间范围内的样本，例如 "服务器 X 最近一小时 CPU > 80"：
+    query_range(X, 'cpu_usage', now - timedelta(hours=1), above=80)
+    :param above: 只返回大于该值的样本
+    :param below: 只返回小于该值的样本
+    :return: [(ts, value)] 按时间升序
+    """
+    session = session or db.session
+    metric_id = get_metric_ids([metric], session, create=False).get(metric)
+    if metric_id is None:
+        return []
+
+    query = session.query(ServerMetric.ts, ServerMetric.value).filter(
+        ServerMetric.server_id == server_id,
+        ServerMetric.metric_id == metric_id,
+        ServerMetric.ts >= start
+    )
+    if end is not None:
+        query = query.filter(ServerMetric.ts < end)
+    if above is not None:
+        query = query.filter(ServerMetric.value > above)
+    if below is not None:
+        query = query.filter(ServerMetric.value < below)
+    return [(row.ts, row.value) for row in query.order_by(ServerMetric.ts).all()]
+
+
+def query_latest(metric, server_ids=None, session=None):
+    """
+    查询各服务器某指标的最新样本（一次查询）
+    :param server_ids: 只查询指定服务器，默认全部
+    :return: {server_id: (ts, value)}
+    """
+    session = session or db.session
+    metric_id = get_metric_ids([metric], session, create=False).get(metric)
+    if metric_id is None:
+        return {}
+
+    latest = session.query(
+        ServerMetric.server_id.label('server_id'),
+        func.max(ServerMetric.ts).label('ts')
+    ).filter(ServerMetric.metric_id == metric_id)
+    if server_ids:
+        latest = latest.filter(ServerMetric.server_id.in_(server_ids))
+    latest = latest.group_by(ServerMetric.server_id).subquery()
+
+    rows = session.query(ServerMetric.server_id, ServerMetric.ts, ServerMetric.value).join(
+        latest,
+        and_(ServerMetric.server_id == latest.c.server_id, ServerMetric.ts == latest.c.ts)
+    ).filter(ServerMetric.metric_id == metric_id).all()
+    return {row.server_id: (row.ts, row.value) for row in rows}
+
+
+def _bucket_expression(column, bucket_seconds, dialect_name):
+    """
+    把时间列映射到降采样桶的起始 Unix 时间戳
+    """
+    if dialect_name == 'mysql':
+        return func.floor(func.unix_timestamp(column) / bucket_seconds) * bucket_seconds
+    if dialect_name == 'postgresql':
+        return func.floor(func.extract('epoch', column) / bucket_seconds) * bucket_seconds
+    # SQLite：整数相除即向下取整
+    return cast(func.strftime('%s', column), Integer) // bucket_seconds * bucket_seconds
+
+
+def query_downsampled(server_id, metric, start, end=None, bucket_seconds=300, session=None):
+    """
+    按固定时间桶降采样查询（数据库端聚合）
+    :param bucket_seconds: 时间桶长度（秒）
+    :return: [{"ts", "avg", "min", "max", "count"}] 按时间升序
+    """
+    session = session or db.session
+    metric_id = get_metric_ids([metric], session, create=False).get(metric)
+    if metric_id is None:
+        return []
+
+    bucket = _bucket_expression(ServerMetric.ts, bucket_seconds, session.get_bind().dialect.name).label('bucket')
+    query = session.query(
+        bucket,
+        func.avg(ServerMetric.value).label('avg'),
+        func.min(ServerMetric.value).label('min'),
+        func.max(ServerMetric.value).label('max'),
+        func.count().label('count')
+    ).filter(
+        ServerMetric.server_id == server_id,
+        ServerMetric.metric_id == metric_id,
+        ServerMetric.ts >= start
+    )
+    if end is not None:
+        query = query.filter(ServerMetric.ts < end)
+
+    return [
+        {
+            "ts": datetime.utcfromtimestamp(int(row.bucket)),
+            "avg": float(row.avg),
+            "min": float(row.min),
+            "max": float(row.max),
+            "count": row.count
+        }
+        for row in query.group_by(bucket).order_by(bucket).all()
+    ]
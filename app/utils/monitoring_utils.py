@@ -1,79 +1,205 @@
 import logging
+import time
+from collections import Counter
 import paramiko
-from app.models import MonitoringLog, Server, SystemAlert, db
-from sqlalchemy import func
+from concurrent.futures import ThreadPoolExecutor
+from celery import shared_task
+from app.models import Server, ServerMetric, SystemAlert, db
+from app.utils.metrics_store import get_metric_ids, record_samples
+from app.utils.alert_utils import alert_engine, alert_deduplicator, alert_fingerprint
+from sqlalchemy import func, case
 from datetime import datetime, timedelta
 from app.config import Config
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger('monitoring_utils')
+logger = logging.getLogger(__name__)
 
-# 动态获取负载阈值
+# 没有配置告警规则时的默认负载阈值
 THRESHOLD = Config.HIGH_LOAD_THRESHOLD or 80.0
 
 
-def check_server_health(ssh_host, ssh_user, ssh_password):
+# 一次性采集远程主机指标的命令：只读取 /proc 与 statvfs，不调用 top/free/df/uptime，
+# 两次 /proc/stat 采样间隔 50ms 用于计算 CPU 使用率，整体在远端耗时远低于 100ms
+HEALTH_PROBE_COMMAND = (
+    "echo '@stat'; head -n1 /proc/stat; sleep 0.05; head -n1 /proc/stat; "
+    "echo '@meminfo'; grep -E '^(MemTotal|MemAvailable|MemFree|Buffers|Cached):' /proc/meminfo; "
+    "echo '@loadavg'; cat /proc/loadavg; "
+    "echo '@netdev'; tail -n +3 /proc/net/dev; "
+    "echo '@statvfs'; stat -f -c '%S %b %f %a' /"
+)
+
+
+def _parse_health_output(output):
+    """
+    解析 HEALTH_PROBE_COMMAND 的输出。
+    :param output: 远程命令的标准输出
+    :return: 指标字典
+    """
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('@'):
+            current = line[1:]
+            sections[current] = []
+        elif current:
+            sections[current].append(line)
+
+    # CPU：两次 /proc/stat 采样的差值（idle + iowait 视为空闲）
+    first, second = [[int(v) for v in row.split()[1:]] for row in sections['stat'][:2]]
+    total_delta = sum(second) - sum(first)
+    idle_delta = (second[3] + second[4]) - (first[3] + first[4])
+    cpu_usage = (1 - idle_delta / total_delta) * 100 if total_delta > 0 else 0.0
+
+    # 内存：优先使用 MemAvailable，旧内核回退到 MemFree + Buffers + Cached
+    meminfo = {}
+    for row in sections['meminfo']:
+        key, value = row.split(':', 1)
+        meminfo[key] = int(value.split()[0])
+    mem_total = meminfo.get('MemTotal', 0)
+    mem_available = meminfo.get(
+        'MemAvailable',
+        meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+    )
+    memory_usage = (mem_total - mem_available) * 100 / mem_total if mem_total else 0.0
+
+    # 负载：/proc/loadavg 前三列为 1/5/15 分钟负载
+    load_1, load_5, load_15 = [float(v) for v in sections['loadavg'][0].split()[:3]]
+
+    # 网络：累加除 lo 以外所有网卡的收发字节数
+    rx_bytes = tx_bytes = 0
+    for row in sections['netdev']:
+        iface, counters = row.split(':', 1)
+        if iface.strip() == 'lo':
+            continue
+        fields = counters.split()
+        rx_bytes += int(fields[0])
+        tx_bytes += int(fields[8])
+
+    # 磁盘：statvfs 的块大小、总块数、空闲块数、非 root 可用块数，计算方式与 df 一致
+    block_size, blocks, blocks_free, blocks_avail = [int(v) for v in sections['statvfs'][0].split()]
+    used = blocks - blocks_free
+    disk_usage = used * 100 / (used + blocks_avail) if (used + blocks_avail) else 0.0
+
+    return {
+        "cpu_usage": round(cpu_usage, 2),
+        "memory_usage": round(memory_usage, 2),
+        "disk_usage": round(disk_usage, 2),
+        "disk_total_bytes": blocks * block_size,
+        "load_average": load_1,
+        "load_average_5": load_5,
+        "load_average_15": load_15,
+        "network_rx_bytes": rx_bytes,
+        "network_tx_bytes": tx_bytes
+    }
+
+
+def check_server_health(ssh_host, ssh_user, ssh_password, timeout=10):
     """
     检查远程服务器的健康状态。
+    只执行一次远程命令（HEALTH_PROBE_COMMAND），一次采样只需一次往返。
     :param ssh_host: 远程主机地址
     :param ssh_user: SSH 用户名
     :param ssh_password: SSH 密码
+    :param timeout: SSH 连接及命令执行超时时间（秒）
     :return: 服务器健康状态的字典
     """
+    client = paramiko.SSHClient()
     try:
         # 创建 SSH 连接
-        client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(ssh_host, username=ssh_user, password=ssh_password)
+        client.connect(ssh_host, username=ssh_user, password=ssh_password, timeout=timeout)
         logger.info("SSH connection established for server health check.")
 
-        # 检查 CPU 使用率
-        stdin, stdout, stderr = client.exec_command("top -bn1 | grep 'Cpu(s)' | awk '{print $2}'")
-        cpu_usage = stdout.read().decode('utf-8').strip()
+        stdin, stdout, stderr = client.exec_command(HEALTH_PROBE_COMMAND, timeout=timeout)
+        output = stdout.read().decode('utf-8')
+        metrics = _parse_health_output(output)
 
-        # 检查内存使用率
-        stdin, stdout, stderr = client.exec_command("free -m | awk 'NR==2{printf \"%.2f\", $3*100/$2 }'")
-        memory_usage = stdout.read().decode('utf-8').strip()
+        logger.info("Server health check completed.")
+        return metrics
+    except Exception as e:
+        logger.error(f"Error checking server health: {e}")
+        return None
+    finally:
+        client.close()
 
-        # 检查磁盘使用率
-        stdin, stdout, stderr = client.exec_command("df -h | awk '$NF==\"/\"{printf \"%s\", $5}'")
-        disk_usage = stdout.read().decode('utf-8').strip()
 
-        # 检查负载
-        stdin, stdout, stderr = client.exec_command("uptime | awk -F'[a-z]:' '{ print $2}'")
-        load_average = stdout.read().decode('utf-8').strip()
+def record_server_health(results, timestamp=None, commit=True):
+    """
+    将一批健康检查结果批量写入指标表（server_metrics），并交给告警规则引擎评估
+    :param results: {server_id: check_server_health 返回的指标字典}，检查失败（None）的服务器被忽略
+    :param timestamp: 采样时间，默认当前时间
+    :param commit: 是否在写入后提交事务
+    :return: 写入的样本行数
+    """
+    timestamp = timestamp or datetime.utcnow()
+    samples = [(server_id, timestamp, metrics) for server_id, metrics in results.items() if metrics]
+    if not samples:
+        return 0
+    try:
+        recorded = record_samples(samples, commit=False)
+        alert_engine.evaluate_samples(samples, commit=False)
+        if commit:
+            db.session.commit()
+        return recorded
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error recording health of {len(samples)} servers: {e}")
+        return 0
 
-        client.close()
-        logger.info("Server health check completed.")
 
-        return {
-            "cpu_usage": float(cpu_usage),
-            "memory_usage": float(memory_usage),
-            "disk_usage": disk_usage,
-            "load_average": float(load_average.split(",")[0])
-        }
+def collect_server_health(concurrency=None, timeout=None):
+    """
+    并发检查所有服务器的健康状态（每台一次 SSH 往返），结果一次批量写入指标表
+    :param concurrency: 同时进行的 SSH 检查数，默认 Config.MONITORING_SSH_CONCURRENCY
+    :param timeout: 单台服务器的超时时间（秒），默认 Config.MONITORING_SSH_TIMEOUT
+    :return: 检查的服务器数、成功数与写入的样本行数
+    """
+    try:
+        servers = Server.query.with_entities(Server.id, Server.ip_address).all()
+        if not servers:
+            return {"success": True, "data": {"servers": 0, "collected": 0, "rows": 0}}
+
+        timeout = timeout or Config.MONITORING_SSH_TIMEOUT
+
+        def _check(server):
+            return check_server_health(server.ip_address, Config.MONITORING_SSH_USER, Config.MONITORING_SSH_PASSWORD,
+                                       timeout)
+
+        started = time.perf_counter()
+        # paramiko 是阻塞调用，用线程池并发检查
+        with ThreadPoolExecutor(max_workers=min(concurrency or Config.MONITORING_SSH_CONCURRENCY, len(servers))) as pool:
+            results = dict(zip([server.id for server in servers], pool.map(_check, servers)))
+        rows = record_server_health(results)
+        collected = sum(1 for metrics in results.values() if metrics)
+        logger.info(f"Collected health of {collected}/{len(servers)} servers in {time.perf_counter() - started:.2f}s")
+        return {"success": True, "data": {"servers": len(servers), "collected": collected, "rows": rows}}
     except Exception as e:
-        logger.error(f"Error checking server health: {e}")
-        return None
+        logger.error(f"Error collecting server health: {e}")
+        return {"success": False, "message": f"Error collecting server health: {str(e)}"}
+
+
+@shared_task(name="monitoring.collect_server_health", ignore_result=True)
+def collect_server_health_task():
+    """
+    Celery 任务：采集所有服务器的健康指标（由 celery beat 每 MONITORING_INTERVAL 秒调度）
+    """
+    return collect_server_health()
 
 
 def generate_alerts(server_metrics):
     """
-    根据服务器指标生成警报。
+    根据服务器指标生成警报（阈值来自告警规则引擎的评估计划）。
     :param server_metrics: 服务器的健康指标字典
     :return: 警报列表
     """
     try:
-        alerts = []
-        if server_metrics.get("cpu_usage", 0) > 80:
-            alerts.append("High CPU usage detected!")
-        if server_metrics.get("memory_usage", 0) > 80:
-            alerts.append("High memory usage detected!")
-        if int(server_metrics.get("disk_usage", "0%").replace('%', '')) > 90:
-            alerts.append("Disk usage is critically high!")
-        if server_metrics.get("load_average", 0) > 5.0:
-            alerts.append("High server load detected!")
+        try:
+            alert_engine.refresh()
+        except Exception as e:
+            logger.debug(f"Alarm rules not refreshed, using cached plan: {e}")
+        alerts = [rule.describe(value) for rule, value in alert_engine.check(server_metrics)]
         logger.info(f"Generated alerts: {alerts}")
         return alerts
     except Exception as e:
@@ -99,30 +225,68 @@ def analyze_server_load(load_data):
         return "Error"
 
 
-def analyze_all_server_loads():
+def analyze_all_server_loads(window_minutes=60, metric="load_average", server_ids=None, session=None):
     """
-    分析所有服务器的平均负载。
-    返回一个服务器负载统计的列表。
+    分析所有服务器在时间窗口内的负载（平均值、P95、最新值）。
+    所有服务器的统计在一条分组查询中完成（窗口函数 + 聚合），不再逐台服务器查询。
+    :param window_minutes: 统计时间窗口（分钟）
+    :param metric: 指标名（metric_definitions.name）
+    :param server_ids: 只统计指定的服务器 ID 列表，默认统计全部
+    :param session: 数据库会话，默认 db.session
+    :return: 服务器负载统计的列表
     """
     try:
-        servers = Server.query.all()
-        load_results = []
-
-        for server in servers:
-            # 查询服务器的平均负载
-            avg_load = (
-                MonitoringLog.query.filter_by(server_id=server.id)
-                .with_entities(func.avg(MonitoringLog.value).label('avg_load'))
-                .scalar()
-            ) or 0  # 若没有记录，设置负载为 0
-
-            load_results.append({
-                "server_id": server.id,
-                "ip": server.ip,
-                "region": server.region,
-                "average_load": round(avg_load, 2)  # 平均负载保留两位小数
-            })
-            logger.debug(f"Analyzed load for server {server.ip}: {avg_load}")
+        session = session or db.session
+        since = datetime.utcnow() - timedelta(minutes=window_minutes)
+        # 未登记的指标用 -1 占位，所有服务器的统计都为 0
+        metric_id = get_metric_ids([metric], session, create=False).get(metric, -1)
+
+        # 每条样本在所属服务器内的数值排名、样本数以及时间倒序排名
+        ranked_query = session.query(
+            ServerMetric.server_id.label('server_id'),
+            ServerMetric.value.label('value'),
+            func.row_number().over(partition_by=ServerMetric.server_id, order_by=ServerMetric.value).label('value_rank'),
+            func.count().over(partition_by=ServerMetric.server_id).label('sample_count'),
+            func.row_number().over(
+                partition_by=ServerMetric.server_id,
+                order_by=ServerMetric.ts.desc()
+            ).label('recency_rank')
+        ).filter(ServerMetric.metric_id == metric_id, ServerMetric.ts >= since)
+        if server_ids:
+            ranked_query = ranked_query.filter(ServerMetric.server_id.in_(server_ids))
+        ranked = ranked_query.subquery()
+
+        # 按服务器聚合：P95 取最近秩法（排名 >= 0.95 * 样本数的最小值）
+        stats = session.query(
+            ranked.c.server_id,
+            func.avg(ranked.c.value).label('average_load'),
+            func.min(case((ranked.c.value_rank >= 0.95 * ranked.c.sample_count, ranked.c.value))).label('p95_load'),
+            func.max(case((ranked.c.recency_rank == 1, ranked.c.value))).label('latest_load'),
+            func.max(ranked.c.value).label('max_load'),
+            func.count().label('sample_count')
+        ).group_by(ranked.c.server_id).subquery()
+
+        servers_query = session.query(
+            Server.id, Server.ip_address, Server.region,
+            stats.c.average_load, stats.c.p95_load, stats.c.latest_load, stats.c.max_load, stats.c.sample_count
+        ).outerjoin(stats, stats.c.server_id == Server.id)
+        if server_ids:
+            servers_query = servers_query.filter(Server.id.in_(server_ids))
+
+        load_results = [
+            {
+                "server_id": row.id,
+                "ip": row.ip_address,
+                "region": row.region,
+                "average_load": round(float(row.average_load or 0), 2),  # 若没有记录，负载为 0
+                "p95_load": round(float(row.p95_load or 0), 2),
+                "latest_load": round(float(row.latest_load or 0), 2),
+                "max_load": round(float(row.max_load or 0), 2),
+                "sample_count": row.sample_count or 0
+            }
+            for row in servers_query.order_by(Server.id).all()
+        ]
+        logger.debug(f"Analyzed load for {len(load_results)} servers over {window_minutes} minutes")
 
         return {"success": True, "data": load_results}
     except Exception as e:
@@ -130,51 +294,100 @@ def analyze_all_server_loads():
         return {"success": False, "message": f"Error analyzing server load: {str(e)}"}
 
 
-def generate_system_alerts():
+def generate_system_alerts(window_minutes=10, metric="cpu_usage", threshold=None, session=None):
     """
     生成系统告警（如服务器过载）。
+    超限样本在数据库中按服务器聚合，结果批量交给 AlertDeduplicator 去重（与规则引擎的默认规则共用指纹），
+    有未解决告警、窗口内有样本但未超限的服务器上报恢复，按滞回规则解除告警。
+    :param window_minutes: 评估时间窗口（分钟）
+    :param metric: 评估的指标名
+    :param threshold: 告警阈值，默认取告警规则中该指标的阈值，没有规则时为 THRESHOLD
+    :param session: 数据库会话，默认 db.session
+    :return: 超限服务器数以及新建、去重、等待确认、解除的告警数
     """
     try:
+        session = session or db.session
         now = datetime.utcnow()
+        since = now - timedelta(minutes=window_minutes)
+        if threshold is None:
+            alert_engine.refresh(session)
+            threshold = alert_engine.threshold_for(metric, THRESHOLD)
+        metric_id = get_metric_ids([metric], session, create=False).get(metric)
+        if metric_id is None:
+            return {"success": True, "message": "Alerts generated successfully.", "data": {"breached": 0, "created": 0}}
 
-        # 获取最近 10 分钟内的监控数据
-        recent_logs = MonitoringLog.query.filter(
-            MonitoringLog.timestamp >= now - timedelta(minutes=10)
-        ).all()
-
-        new_alerts = []
-
-        for log in recent_logs:
-            if log.value > THRESHOLD:
-                # 检查是否已有未解决的告警
-                existing_alert = SystemAlert.query.filter_by(
-                    alert_type="High Load",
-                    resolved=False,
-                    server_id=log.server_id  # 确保告警与服务器相关联
-                ).first()
-
-                if not existing_alert:
-                    # 创建新的告警
-                    alert = SystemAlert(
-                        alert_type="High Load",
-                        severity="critical",
-                        message=f"Server {log.server.ip} is overloaded with a load of {log.value}",
-                        timestamp=now,
-                        server_id=log.server_id,  # 关联到具体服务器
-                        resolved=False
-                    )
-                    new_alerts.append(alert)
-                    logger.warning(f"Generated alert for server {log.server.ip} with load {log.value}")
-
-        # 批量添加告警
-        if new_alerts:
-            db.session.add_all(new_alerts)
-
-        db.session.commit()
+        # 最近时间窗口内每台服务器的超限样本数与峰值（一次分组查询）
+        breaches = session.query(
+            ServerMetric.server_id,
+            Server.ip_address,
+            func.count().label('breach_count'),
+            func.max(ServerMetric.value).label('peak_value')
+        ).join(Server, Server.id == ServerMetric.server_id).filter(
+            ServerMetric.metric_id == metric_id,
+            ServerMetric.ts >= since,
+            ServerMetric.value > threshold
+        ).group_by(ServerMetric.server_id, Server.ip_address).all()
+
+        results = alert_deduplicator.raise_alerts([
+            {
+                "alert_type": "server",
+                "severity": "critical",
+                "target_id": row.server_id,
+                "target_type": "server",
+                "message": f"Server {row.ip_address} is overloaded with {metric} of {round(float(row.peak_value), 2)}",
+                "details": {
+                    "metric": metric,
+                    "threshold": threshold,
+                    "peak_value": round(float(row.peak_value), 2),
+                    "breach_count": row.breach_count,
+                    "window_minutes": window_minutes
+                },
+                "fingerprint": alert_fingerprint("server", "server", row.server_id, metric)
+            }
+            for row in breaches
+        ], session, commit=False)
+
+        # 有未解决告警但本窗口未超限、且有样本（仍在上报）的服务器视为恢复
+        pattern = alert_fingerprint("server", "server", "%", metric.replace("_", "\\_"))
+        breached_ids = {row.server_id for row in breaches}
+        open_ids = {
+            target_id for (target_id,) in session.query(SystemAlert.target_id).filter(
+                SystemAlert.alert_type == 'server',
+                SystemAlert.target_type == 'server',
+                SystemAlert.status.in_(['active', 'acknowledged']),
+                SystemAlert.fingerprint.like(pattern, escape="\\")
+            ).all()
+        } - breached_ids
+        recovered = [
+            server_id for (server_id,) in session.query(ServerMetric.server_id).filter(
+                ServerMetric.metric_id == metric_id,
+                ServerMetric.ts >= since,
+                ServerMetric.server_id.in_(open_ids)
+            ).distinct().all()
+        ] if open_ids else []
+        cleared = alert_deduplicator.clear_alerts(
+            [alert_fingerprint("server", "server", server_id, metric) for server_id in recovered], session, commit=False
+        )
+        session.commit()
+
+        actions = Counter(result["action"] for result in results)
+        if actions["created"]:
+            logger.warning(f"Generated {actions['created']} {metric} alerts (threshold {threshold})")
         logger.info("Alerts generation completed.")
-        return {"success": True, "message": "Alerts generated successfully."}
+        return {
+            "success": True,
+            "message": "Alerts generated successfully.",
+            "data": {
+                "breached": len(breaches),
+                "created": actions["created"],
+                "deduplicated": actions["deduplicated"],
+                "pending": actions["pending"],
+                "resolved": sum(1 for action in cleared.values() if action == "resolved")
+            }
+        }
 
     except Exception as e:
+        session.rollback()
         logger.error(f"Error generating alerts: {str(e)}")
         return {"success": False, "message": f"Error generating alerts: {str(e)}"}
 
@@ -182,6 +395,8 @@ def generate_system_alerts():
 # 导出模块
 __all__ = [
     "check_server_health",
+    "record_server_health",
+    "collect_server_health",
     "generate_alerts",
     "analyze_server_load",
     "analyze_all_server_loads",
@@ -0,0 +1,153 @@
+import json
+import logging
+from collections import Counter, OrderedDict
+from datetime import datetime
+import redis
+from celery import shared_task
+from app.config import Config
+from app.models import User
+from app.utils.notification_queue import enqueue_email
+from app.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 共享连接池的 Redis 客户端
+redis_client = get_redis_client()
+
+# 每个收件人一个缓冲列表，以及已安排汇总发送的标记
+DIGEST_KEY = "notifications:digest:{recipient}"
+SCHEDULED_KEY = "notifications:digest:scheduled:{recipient}"
+URGENT_KEY = "notifications:digest:urgent:{recipient}"
+
+# 这些级别的通知不等待汇总窗口结束，在 NOTIFICATION_DIGEST_URGENT_DELAY 秒内发出
+URGENT_SEVERITIES = {"critical"}
+# 汇总邮件中最多列出的明细条数
+DIGEST_DETAIL_LINES = 50
+
+
+def _schedule_flush(recipient, flag_key, countdown):
+    """
+    为收件人安排一次汇总发送，同一标记存在期间不重复安排
+    """
+    if not redis_client.set(flag_key, 1, nx=True, ex=int(countdown) + 300):
+        return
+    try:
+        flush_digest.apply_async(args=[recipient], countdown=countdown)
+    except Exception as e:
+        # 无法安排任务时立即发送已缓冲的通知
+        logger.error(f"Failed to schedule digest flush for {recipient}: {e}")
+        flush_digest_now(recipient)
+
+
+def add_to_digest(recipient, subject, body, severity="medium", target=None, user_id=None):
+    """
+    把通知放入收件人的汇总缓冲，窗口结束时合并为一封邮件发送
+    :param recipient: 收件人邮箱
+    :param subject: 通知主题（汇总时按主题统计次数）
+    :param body: 通知内容
+    :param severity: 严重程度，critical 会提前发送
+    :param target: 受影响对象（如 "server:3"、"container:12"），汇总中列出
+    :param user_id: 收件用户 ID（可选）
+    :return: bool (True 表示已接受)
+    """
+    entry = json.dumps({
+        "subject": subject,
+        "body": body,
+        "severity": severity,
+        "target": target,
+        "user_id": user_id,
+        "created_at": datetime.utcnow().isoformat()
+    }, ensure_ascii=False)
+
+    try:
+        size = redis_client.rpush(DIGEST_KEY.format(recipient=recipient), entry)
+        if severity in URGENT_SEVERITIES or size >= Config.NOTIFICATION_DIGEST_MAX_ITEMS:
+            _schedule_flush(recipient, URGENT_KEY.format(recipient=recipient), Config.NOTIFICATION_DIGEST_URGENT_DELAY)
+        else:
+            _schedule_flush(recipient, SCHEDULED_KEY.format(recipient=recipient), Config.NOTIFICATION_DIGEST_WINDOW)
+        return True
+    except redis.RedisError as e:
+        # 缓冲不可用时直接发送单条通知
+        logger.warning(f"Digest buffer unavailable, sending notification to {recipient} directly: {e}")
+        return enqueue_email(recipient, subject, body, user_id=user_id)
+
+
+def notify_admins(subject, body, severity="medium", target=None):
+    """
+    通知所有管理员（经过汇总缓冲）
+    :return: 接受通知的管理员数量
+    """
+    admins = User.query.with_entities(User.id, User.email).filter_by(role="admin").all()
+    return sum(
+        1 for admin in admins
+        if admin.email and add_to_digest(admin.email, subject, body, severity=severity, target=target, user_id=admin.id)
+    )
+
+
+def build_digest(entries):
+    """
+    把多条通知合并为一封汇总邮件
+    :param entries: 缓冲中的通知列表（按时间顺序）
+    :return: (主题, 内容)
+    """
+    if len(entries) == 1:
+        return entries[0]["subject"], entries[0]["body"]
+
+    subjects = Counter(entry["subject"] for entry in entries)
+    severities = Counter(entry.get("severity") or "medium" for entry in entries)
+    targets = list(OrderedDict.fromkeys(entry["target"] for entry in entries if entry.get("target")))
+
+    subject = f"Notification digest: {len(entries)} events"
+    if targets:
+        subject += f" on {len(targets)} targets"
+
+    lines = [
+        f"{len(entries)} notifications between {entries[0]['created_at'][:19]} and {entries[-1]['created_at'][:19]} UTC.",
+        "",
+        "By severity: " + ", ".join(f"{severity} x{count}" for severity, count in severities.most_common()),
+        "",
+        "By type:"
+    ]
+    lines += [f"  - {name} x{count}" for name, count in subjects.most_common()]
+    if targets:
+        lines += ["", f"Affected targets ({len(targets)}):", "  " + ", ".join(str(target) for target in targets)]
+    lines += ["", "Details:"]
+    lines += [
+        f"  [{entry['created_at'][11:19]}] [{entry.get('severity') or 'medium'}] {entry['body']}"
+        for entry in entries[:DIGEST_DETAIL_LINES]
+    ]
+    if len(entries) > DIGEST_DETAIL_LINES:
+        lines.append(f"  ... and {len(entries) - DIGEST_DETAIL_LINES} more")
+    return subject, "\n".join(lines)
+
+
+def flush_digest_now(recipient):
+    """
+    取出收件人缓冲中的全部通知，合并为一封邮件放入发送队列
+    :return: 合并的通知条数
+    """
+    key = DIGEST_KEY.format(recipient=recipient)
+    pipeline = redis_client.pipeline()
+    pipeline.lrange(key, 0, -1)
+    pipeline.delete(key, SCHEDULED_KEY.format(recipient=recipient), URGENT_KEY.format(recipient=recipient))
+    raw_entries, _ = pipeline.execute()
+
+    entries = []
+    for raw in raw_entries:
+        try:
+            entries.append(json.loads(raw))
+        except ValueError:
+            logger.error(f"Dropping malformed digest entry for {recipient}: {raw[:200]!r}")
+    if not entries:
+        return 0
+
+    subject, body = build_digest(entries)
+    user_id = next((entry["user_id"] for entry in entries if entry.get("user_id")), None)
+    enqueue_email(recipient, subject, body, user_id=user_id)
+    logger.info(f"Digest of {len(entries)} notification(s) queued for {recipient}")
+    return len(entries)
+
+
+@shared_task(name="notifications.flush_digest", ignore_result=True)
+def flush_digest(recipient):
+    return flush_digest_now(recipient)
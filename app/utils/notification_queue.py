@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import smtplib
+from collections import defaultdict
+from datetime import datetime
+import redis
+from celery import shared_task
+from flask_mail import Message
+from sqlalchemy import insert
+from app import db, mail
+from app.config import Config
+from app.models import NotificationLog, User
+from app.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 共享连接池的 Redis 客户端
+redis_client = get_redis_client()
+
+# 已安排批量发送任务的标记，同一时间只安排一个
+FLUSH_SCHEDULED_KEY = "notifications:email:flush_scheduled"
+
+# 只影响单封邮件的错误，其它错误视为连接故障，本连接上剩余的邮件整体重试
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError, ValueError)
+
+
+def _email_message(recipient, subject, body, user_id=None):
+    return {
+        "recipient": recipient,
+        "subject": subject,
+        "body": body,
+        "user_id": user_id,
+        "queued_at": datetime.utcnow().isoformat(),
+        "attempts": 0
+    }
+
+
+def enqueue_email(recipient, subject, body, user_id=None):
+    """
+    把一封邮件放入发送队列，立即返回，由 Celery worker 批量发送
+    :param recipient: 收件人邮箱
+    :param subject: 邮件主题
+    :param body: 邮件内容
+    :param user_id: 收件用户 ID（可选，用于通知记录）
+    :return: bool (True 表示已接受)
+    """
+    return enqueue_emails([_email_message(recipient, subject, body, user_id)])
+
+
+def enqueue_emails(messages):
+    """
+    批量入队
+    :param messages: 邮件列表，每项包含 recipient、subject、body，可选 user_id
+    :return: bool (True 表示已接受)
+    """
+    messages = [
+        _email_message(m["recipient"], m["subject"], m["body"], m.get("user_id"))
+        for m in messages if m.get("recipient")
+    ]
+    if not messages:
+        return False
+
+    try:
+        pipeline = redis_client.pipeline()
+        pipeline.rpush(Config.EMAIL_QUEUE_KEY, *[json.dumps(m, ensure_ascii=False) for m in messages])
+        pipeline.set(FLUSH_SCHEDULED_KEY, 1, nx=True, ex=int(Config.EMAIL_FLUSH_DELAY) + 300)
+        _, schedule = pipeline.execute()
+    except redis.RedisError as e:
+        # 队列不可用时直接发送，保证邮件不丢失
+        logger.warning(f"Email queue unavailable, sending {len(messages)} message(s) inline: {e}")
+        result = deliver_emails(messages, retry=False)
+        return result["sent"] > 0
+
+    if schedule:
+        try:
+            flush_email_queue.apply_async(countdown=Config.EMAIL_FLUSH_DELAY)
+        except Exception as e:
+            # 邮件已在队列中，下次入队时会重新安排发送
+            redis_client.delete(FLUSH_SCHEDULED_KEY)
+            logger.error(f"Failed to schedule email flush: {e}")
+    return True
+
+
+def _build_message(message):
+    msg = Message(
+        subject=message["subject"],
+        sender=os.getenv('MAIL_USERNAME', Config.MAIL_USERNAME),
+        recipients=[message["recipient"]]
+    )
+    msg.body = message["body"]
+    return msg
+
+
+def _record_outcomes(sent, failed):
+    """
+    批量写入通知记录
+    :param sent: 发送成功的邮件列表
+    :param failed: (邮件, 错误信息) 列表，已放弃重试
+    """
+    outcomes = [(m, "sent", None) for m in sent] + [(m, "failed", error) for m, error in failed]
+    if not outcomes:
+        return
+
+    # 没有 user_id 的邮件按收件人邮箱一次查询补全
+    emails = {m["recipient"] for m, _, _ in outcomes if not m.get("user_id")}
+    user_ids = dict(db.session.query(User.email, User.id).filter(User.email.in_(emails)).all()) if emails else {}
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "user_id": m.get("user_id") or user_ids.get(m["recipient"]),
+            "notification_type": "email",
+            "title": (m["subject"] or "")[:255],
+            "content": (m["body"] or "")[:1024],
+            "status": status,
+            "sent_at": now if status == "sent" else None,
+            "created_at": datetime.fromisoformat(m["queued_at"]) if m.get("queued_at") else now,
+            "error_message": error[:1024] if error else None
+        }
+        for m, status, error in outcomes
+    ]
+    try:
+        # 使用独立连接写入，不影响调用方会话中未提交的修改
+        with db.engine.begin() as connection:
+            connection.execute(insert(NotificationLog), rows)
+    except Exception as e:
+        logger.error(f"Failed to record {len(rows)} notification log(s): {e}")
+
+
+def deliver_emails(messages, retry=True):
+    """
+    按收件域名分组发送，每组复用 SMTP 连接（mail.connect()），每个连接最多发送
+    EMAIL_MESSAGES_PER_CONNECTION 封；失败的邮件按指数退避重试，最终结果批量写入 NotificationLog
+    :param messages: 邮件列表
+    :param retry: 失败时是否安排重试
+    :return: {"sent": 成功数, "retrying": 等待重试数, "failed": 放弃数}
+    """
+    by_domain = defaultdict(list)
+    for message in messages:
+        by_domain[message["recipient"].rpartition("@")[2].lower()].append(message)
+
+    sent, errors = [], []
+    size = Config.EMAIL_MESSAGES_PER_CONNECTION
+    for domain, group in by_domain.items():
+        for offset in range(0, len(group), size):
+            chunk = []
+            for message in group[offset:offset + size]:
+                try:
+                    chunk.append((message, _build_message(message)))
+                except Exception as e:
+                    errors.append((message, str(e)))
+            if not chunk:
+                continue
+
+            done = 0
+            try:
+                with mail.connect() as connection:
+                    for message, msg in chunk:
+                        try:
+                            connection.send(msg)
+                            sent.append(message)
+                        except MESSAGE_ERRORS as e:
+                            errors.append((message, str(e)))
+                        done += 1
+            except Exception as e:
+                # 连接失败或中途断开：本连接上尚未发送的邮件全部记为失败
+                logger.warning(f"SMTP connection failed for domain {domain}: {e}")
+                errors.extend((message, str(e)) for message, _ in chunk[done:])
+
+    pending, failed = defaultdict(list), []
+    for message, error in errors:
+        message["attempts"] = message.get("attempts", 0) + 1
+        if retry and message["attempts"] <= Config.EMAIL_MAX_RETRIES:
+            pending[message["attempts"]].append((message, error))
+        else:
+            failed.append((message, error))
+
+    retrying = 0
+    for attempts, batch in pending.items():
+        countdown = Config.EMAIL_RETRY_BACKOFF * 2 ** (attempts - 1)
+        try:
+            deliver_email_batch.apply_async(args=[[message for message, _ in batch]], countdown=countdown)
+            retrying += len(batch)
+        except Exception as e:
+            logger.error(f"Failed to schedule retry for {len(batch)} email(s): {e}")
+            failed.extend(batch)
+
+    _record_outcomes(sent, failed)
+    result = {"sent": len(sent), "retrying": retrying, "failed": len(failed)}
+    logger.info(f"Email delivery finished: {result}")
+    return result
+
+
+@shared_task(name="notifications.flush_email_queue", ignore_result=True)
+def flush_email_queue():
+    """
+    取出队列中的全部邮件并发送
+    """
+    # 先清除标记，发送期间新入队的邮件会安排下一次发送
+    redis_client.delete(FLUSH_SCHEDULED_KEY)
+    totals = {"sent": 0, "retrying": 0, "failed": 0}
+    while True:
+        pipeline = redis_client.pipeline()
+        pipeline.lrange(Config.EMAIL_QUEUE_KEY, 0, Config.EMAIL_BATCH_SIZE - 1)
+        pipeline.ltrim(Config.EMAIL_QUEUE_KEY, Config.EMAIL_BATCH_SIZE, -1)
+        raw_messages, _ = pipeline.execute()
+        if not raw_messages:
+            return totals
+
+        messages = []
+        for raw in raw_messages:
+            try:
+                messages.append(json.loads(raw))
+            except ValueError:
+                logger.error(f"Dropping malformed queued email: {raw[:200]!r}")
+        for key, value in deliver_emails(messages).items():
+            totals[key] += value
+
+
+@shared_task(name="notifications.deliver_email_batch", ignore_result=True)
+def deliver_email_batch(messages):
+    """
+    重试发送一批邮件
+    """
+    return deliver_emails(messages)
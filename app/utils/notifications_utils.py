@@ -1,34 +1,24 @@
-import os
-from flask_mail import Message
-from app import mail
 from app.models import User, SerialNumber
+from app.utils.notification_queue import enqueue_email, enqueue_emails
 from datetime import datetime, timedelta
 import logging
 
-# 配置日志记录
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_email(recipient, subject, body):
+def send_email(recipient, subject, body, user_id=None):
     """
-    通用函数，用于发送邮件
+    通用函数，用于发送邮件：放入发送队列后立即返回，由 Celery worker 批量发送，
+    发送结果记录到 NotificationLog
     :param recipient: 接收方邮箱地址
     :param subject: 邮件主题
     :param body: 邮件内容
-    :return: bool (True 表示发送成功，False 表示失败)
+    :param user_id: 收件用户 ID（可选）
+    :return: bool (True 表示已接受发送，False 表示失败)
     """
     try:
-        msg = Message(
-            subject=subject,
-            sender=os.getenv('MAIL_USERNAME'),  # 从环境变量中获取发件人
-            recipients=[recipient]
-        )
-        msg.body = body
-        mail.send(msg)
-        logger.info(f"Email sent successfully to {recipient}")
-        return True
+        return enqueue_email(recipient, subject, body, user_id=user_id)
     except Exception as e:
-        logger.error(f"Failed to send email to {recipient}: {str(e)}")
+        logger.error(f"Failed to queue email to {recipient}: {str(e)}")
         return False
 
 
@@ -85,7 +75,7 @@ def send_general_notification(user_id, subject, body):
             logger.error(f"User with ID {user_id} not found.")
             return False
 
-        return send_email(user.email, subject, body)
+        return send_email(user.email, subject, body, user_id=user.id)
     except Exception as e:
         logger.error(f"Error sending general notification to user {user_id}: {str(e)}")
         logger.error(e, exc_info=True)
@@ -100,12 +90,20 @@ def send_bulk_notifications(users, subject, body_template):
     :param body_template: 通知模板 (支持字符串格式化，例如 {username})
     """
     try:
-        for user in users:
-            body = body_template.format(username=user.username, email=user.email)
-            if send_email(user.email, subject, body):
-                logger.info(f"Notification sent to {user.email}")
-            else:
-                logger.error(f"Failed to send notification to {user.email}")
+        # 一次入队，由 worker 按收件域名分批发送
+        messages = [
+            {
+                "recipient": user.email,
+                "subject": subject,
+                "body": body_template.format(username=user.username, email=user.email),
+                "user_id": user.id
+            }
+            for user in users
+        ]
+        if enqueue_emails(messages):
+            logger.info(f"Queued {len(messages)} notification(s)")
+        else:
+            logger.error("Failed to queue bulk notifications")
     except Exception as e:
         logger.error(f"Error sending bulk notifications: {str(e)}")
         logger.error(e, exc_info=True)
@@ -117,6 +115,6 @@ def send_notification_email(recipient, subject, body):
     :param recipient: 收件人邮箱
     :param subject: 邮件主题
     :param body: 邮件内容
-    :return: bool (True 表示发送成功，False 表示失败)
+    :return: bool (True 表示已接受发送，False 表示失败)
     """
     return send_email(recipient, subject, body)
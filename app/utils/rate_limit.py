@@ -0,0 +1,192 @@
+"""
+基于 Redis 的滑动窗口限流。
+
+每个限流键是一个有序集合，成员为一次计数，分数为计数时间（毫秒，取 Redis 服务器时间）。
+一次检查由 Lua 脚本原子完成：清理窗口外的记录、统计窗口内次数、未超限时记录本次计数，
+多个规则（例如按 IP 和按账号）可以在同一次调用中检查，只需一次往返。
+
+规则在 Config 中以 RATE_LIMIT_<规则名大写> 配置，格式为 "次数/秒数"，例如 "5/300"。
+
+用法：
+    @bp.route('/api/login', methods=['POST'])
+    @rate_limit("login")                       # 按客户端 IP 计数
+    def login(): ...
+
+    result = check_rate_limits([("login_failures", email, 0)])   # cost=0 只检查不计数
+    record_failures([("login_failures", email)])                 # 记录一次失败
+"""
+import logging
+import uuid
+from collections import namedtuple
+from functools import wraps
+import redis
+from flask import jsonify, request
+from app.config import Config
+from app.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 共享连接池的 Redis 客户端
+redis_client = get_redis_client()
+
+KEY_PREFIX = "ratelimit"
+
+# allowed: 是否放行；remaining: 各规则中最少的剩余次数；retry_after: 被拒绝时需要等待的秒数
+RateLimitResult = namedtuple("RateLimitResult", ["allowed", "remaining", "retry_after"])
+
+# KEYS: 限流键；ARGV[1]: 本次请求的唯一标识；ARGV[2]: 为 1 时不论是否超限都记录；
+# 之后每个键依次为 次数上限、窗口（毫秒）、本次计数
+# cost 为 0 时只检查（窗口内次数已达到上限即拒绝），不记录
+SLIDING_WINDOW = redis_client.register_script("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local allowed = 1
+local remaining = -1
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 3])
+    local window = tonumber(ARGV[i * 3 + 1])
+    local cost = tonumber(ARGV[i * 3 + 2])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    local needed = math.max(cost, 1)
+    if count + needed > limit then
+        allowed = 0
+        -- 等到足够多的旧记录移出窗口
+        local oldest = redis.call('ZRANGE', key, count + needed - limit - 1, count + needed - limit - 1, 'WITHSCORES')
+        if oldest[2] then
+            retry_after = math.max(retry_after, tonumber(oldest[2]) + window - now)
+        else
+            retry_after = math.max(retry_after, window)
+        end
+    end
+    local left = limit - count - cost
+    if remaining < 0 or left < remaining then
+        remaining = math.max(left, 0)
+    end
+end
+if allowed == 1 or ARGV[2] == '1' then
+    for i, key in ipairs(KEYS) do
+        local window = tonumber(ARGV[i * 3 + 1])
+        local cost = tonumber(ARGV[i * 3 + 2])
+        for j = 1, cost do
+            redis.call('ZADD', key, now, ARGV[1] .. ':' .. j)
+        end
+        if cost > 0 then
+            redis.call('PEXPIRE', key, window)
+        end
+    end
+end
+return {allowed, remaining, retry_after}
+""")
+
+# 只读取窗口内的计数，不记录；KEYS[1]: 限流键；ARGV[1]: 窗口（毫秒）
+WINDOW_COUNT = redis_client.register_script("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+return redis.call('ZCOUNT', KEYS[1], now - tonumber(ARGV[1]), '+inf')
+""")
+
+_rules = {}
+
+
+def get_rule(name):
+    """
+    读取限流规则 Config.RATE_LIMIT_<NAME>
+    :return: (次数上限, 窗口秒数)
+    """
+    rule = _rules.get(name)
+    if rule is None:
+        value = getattr(Config, f"RATE_LIMIT_{name.upper()}")
+        limit, _, window = str(value).partition("/")
+        rule = (int(limit), float(window))
+        _rules[name] = rule
+    return rule
+
+
+def check_rate_limits(entries, force=False):
+    """
+    在一次往返中检查多个限流规则，全部未超限时才记录本次计数
+    :param entries: [(规则名, 键, 计数)]，计数省略时为 1，为 0 时只检查
+    :param force: 为 True 时不论是否超限都记录
+    :return: RateLimitResult；Redis 不可用时放行
+    """
+    keys, args = [], [uuid.uuid4().hex, 1 if force else 0]
+    for entry in entries:
+        name, key = entry[0], entry[1]
+        cost = entry[2] if len(entry) > 2 else 1
+        limit, window = get_rule(name)
+        keys.append(f"{KEY_PREFIX}:{name}:{key}")
+        args += [limit, int(window * 1000), cost]
+    if not keys:
+        return RateLimitResult(True, None, 0)
+
+    try:
+        allowed, remaining, retry_after = SLIDING_WINDOW(keys=keys, args=args)
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+        return RateLimitResult(True, None, 0)
+    return RateLimitResult(bool(allowed), int(remaining), -(-int(retry_after) // 1000))
+
+
+def record_failures(entries):
+    """
+    记录一次失败（如密码错误、序列号不存在），供后续 check_rate_limits 以计数 0 检查
+    :param entries: [(规则名, 键)]
+    """
+    return check_rate_limits([(name, key, 1) for name, key in entries], force=True)
+
+
+def window_count(name, key):
+    """
+    读取某个键在当前窗口内的计数（不记录），例如判断客户端最近是否有失败记录
+    :return: 次数；Redis 不可用时返回 0
+    """
+    _, window = get_rule(name)
+    try:
+        return int(WINDOW_COUNT(keys=[f"{KEY_PREFIX}:{name}:{key}"], args=[int(window * 1000)]))
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, assuming no recent {name}: {e}")
+        return 0
+
+
+def reset_rate_limit(name, key):
+    """
+    清除某个键的计数（例如登录成功后清除该账号的失败次数）
+    """
+    try:
+        redis_client.delete(f"{KEY_PREFIX}:{name}:{key}")
+    except redis.RedisError as e:
+        logger.warning(f"Failed to reset rate limit {name}:{key}: {e}")
+
+
+def client_ip():
+    return request.remote_addr or "unknown"
+
+
+def too_many_requests(result, message="Too many requests. Please try again later."):
+    """
+    构造 429 响应，带 Retry-After 头
+    """
+    response = jsonify({"success": False, "message": message, "retry_after": result.retry_after})
+    response.headers["Retry-After"] = str(max(result.retry_after, 1))
+    return response, 429
+
+
+def rate_limit(name, key_func=client_ip):
+    """
+    视图装饰器：按规则限制请求频率，超限时返回 429
+    需要放在 @bp.route(...) 之下，路由注册的才是带限流的函数
+    :param name: 规则名（Config.RATE_LIMIT_<NAME>）
+    :param key_func: 计算限流键的函数，默认客户端 IP
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            result = check_rate_limits([(name, key_func())])
+            if not result.allowed:
+                logger.warning(f"Rate limit {name} exceeded for {key_func()}")
+                return too_many_requests(result)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
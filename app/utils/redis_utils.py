@@ -0,0 +1,65 @@
+import logging
+import threading
+import redis
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 进程内共享的连接池，按 (db, decode_responses, stream) 区分
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(db, decode_responses, stream=False):
+    key = (db, decode_responses, stream)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                if stream:
+                    # 阻塞读取的连接在 BLOCK 期间一直被占用，单独建池，避免占满普通命令的连接池；
+                    # 池满时快速失败，由调用方向客户端返回不可用，而不是挂起请求
+                    options = {
+                        "max_connections": Config.REDIS_STREAM_MAX_CONNECTIONS,
+                        "socket_timeout": Config.EVENT_STREAM_BLOCK_MS / 1000 + Config.REDIS_SOCKET_TIMEOUT,
+                        "timeout": Config.REDIS_CONNECT_TIMEOUT
+                    }
+                else:
+                    options = {
+                        "max_connections": Config.REDIS_MAX_CONNECTIONS,
+                        "socket_timeout": Config.REDIS_SOCKET_TIMEOUT
+                    }
+                pool = redis.BlockingConnectionPool(
+                    host=Config.REDIS_HOST,
+                    port=Config.REDIS_PORT,
+                    db=db,
+                    password=Config.REDIS_PASSWORD,
+                    socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT,
+                    health_check_interval=30,
+                    decode_responses=decode_responses,
+                    **options
+                )
+                _pools[key] = pool
+    return pool
+
+
+def get_redis_client(db=None, decode_responses=False):
+    """
+    获取使用共享连接池的 Redis 客户端（连接参数来自 Config）
+    客户端本身很轻量，可以在模块级别保存，也可以按需获取
+    :param db: Redis 数据库编号，默认 Config.REDIS_DB
+    :param decode_responses: 是否把返回值解码为字符串
+    :return: redis.StrictRedis
+    """
+    return redis.StrictRedis(connection_pool=_get_pool(Config.REDIS_DB if db is None else db, decode_responses))
+
+
+def get_stream_client(db=None):
+    """
+    获取用于阻塞读取（XREAD BLOCK）的 Redis 客户端，使用独立的连接池，返回值解码为字符串
+    长时间阻塞的读取不会占用 get_redis_client 的连接，发布事件和普通命令不受 SSE 连接数影响
+    :param db: Redis 数据库编号，默认 Config.REDIS_DB
+    :return: redis.StrictRedis
+    """
+    return redis.StrictRedis(connection_pool=_get_pool(Config.REDIS_DB if db is None else db, True, stream=True))
@@ -0,0 +1,150 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app import db
+from app.models import SerialNumber, Rental, DockerContainer, Server, User, UserContainer, user_server_association
+from app.utils.serial_lookup import invalidate_serial_status
+from app.utils.finance_aggregates import record_serial_redeemed
+from app.utils.expiry_scheduler import track_expiry_change
+
+logger = logging.getLogger(__name__)
+
+
+def rental_days_of(serial_code):
+    """
+    从序列号前三位解析租赁天数（例如 '180XXXX' -> 180）
+    :return: 天数，无法解析或不大于 0 时返回 None
+    """
+    try:
+        days = int(serial_code[:3])
+    except (TypeError, ValueError):
+        return None
+    return days if days > 0 else None
+
+
+def claim_serial(serial_code, user_id, start_date, end_date, now=None):
+    """
+    原子地领取一个未使用的序列号：UPDATE ... WHERE code = ? AND status = 'unused'
+    并发请求中只有一个能更新成功，其余请求等待该行锁释放后条件不再满足，影响行数为 0。
+    领取成功时在同一事务中记入财务汇总。不提交，序列号在调用方事务回滚时恢复为未使用
+    :return: 序列号 ID，序列号不存在或已被使用时返回 None
+    """
+    now = now or datetime.utcnow()
+    result = db.session.execute(
+        update(SerialNumber)
+        .where(SerialNumber.code == serial_code, SerialNumber.status == 'unused')
+        .values(status='used', user_id=user_id, start_date=start_date, end_date=end_date, used_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+    invalidate_serial_status([serial_code])
+    serial = db.session.execute(
+        select(SerialNumber.id, SerialNumber.distributor_id, SerialNumber.valid_days).where(SerialNumber.code == serial_code)
+    ).one()
+    record_serial_redeemed(db.session.connection(), user_id, serial.distributor_id, serial.valid_days, now)
+    # 已兑换的序列号不再按生成时的 expires_at 过期，提交后移出到期调度集合
+    track_expiry_change(db.session, "serial", serial.id, None)
+    return serial.id
+
+
+def redeem_serial(serial_code, user_id, server_id, container_id, traffic_limit=0):
+    """
+    兑换序列号并创建租赁：领取序列号、创建租赁与容器记录、更新服务器用户数、用户到期时间和
+    用户-服务器关联，全部在一个事务中完成并提交一次
+    同一用户的并发请求通过锁定用户行串行执行，同一序列号的并发请求只有一个成功
+    :return: (结果字典, HTTP 状态码)
+    """
+    rental_days = rental_days_of(serial_code)
+    if rental_days is None:
+        return {"success": False, "message": "Invalid rental days in serial code"}, 400
+
+    now = datetime.utcnow()
+    end_date = now + timedelta(days=rental_days)
+    try:
+        # 锁定用户行（SELECT ... FOR UPDATE），避免同一用户并发创建多个有效租赁
+        user_exists = db.session.execute(
+            select(User.id).where(User.id == user_id).with_for_update()
+        ).scalar_one_or_none()
+        if user_exists is None:
+            db.session.rollback()
+            return {"success": False, "message": "User not found"}, 404
+
+        has_active = db.session.execute(
+            select(Rental.id).where(Rental.user_id == user_id, Rental.status == 'active').limit(1)
+        ).first()
+        if has_active:
+            db.session.rollback()
+            return {"success": False, "message": "User already has an active rental. Cannot proceed with server and container selection."}, 400
+
+        serial_number_id = claim_serial(serial_code, user_id, now, end_date, now=now)
+        if serial_number_id is None:
+            db.session.rollback()
+            return {"success": False, "message": "Invalid or used serial code"}, 404
+
+        rental = Rental(
+            user_id=user_id,
+            serial_number_id=serial_number_id,
+            serial_number_expiry=end_date,
+            status='active',
+            payment_status='pending',
+            start_date=now,
+            end_date=end_date,
+            traffic_limit=traffic_limit,
+            traffic_usage=0,
+            renewal_count=0,
+            container_status='active',
+            server_status='active',
+            server_ids=[server_id],
+            container_ids=[container_id],
+            created_at=now,
+            updated_at=now
+        )
+        db.session.add(rental)
+        db.session.add(UserContainer(
+            user_id=user_id,
+            container_id=container_id,
+            status='active',
+            created_at=now,
+            updated_at=now,
+            expiry_date=end_date
+        ))
+
+        # 直接在数据库中更新，不读取整行；用户数使用 user_count + 1，避免并发请求相互覆盖
+        db.session.execute(
+            update(DockerContainer).where(DockerContainer.id == container_id)
+            .values(status='running', user_id=user_id)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(Server).where(Server.id == server_id)
+            .values(user_count=Server.user_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(User).where(User.id == user_id)
+            .values(rental_expiry=end_date)
+            .execution_options(synchronize_session=False)
+        )
+
+        # 用户行已锁定，检查后插入不会与同一用户的其它请求冲突
+        associated = db.session.execute(
+            select(user_server_association.c.user_id).where(
+                user_server_association.c.user_id == user_id,
+                user_server_association.c.server_id == server_id
+            )
+        ).first()
+        if not associated:
+            db.session.execute(user_server_association.insert().values(user_id=user_id, server_id=server_id))
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Serial {serial_code} redeemed by user {user_id}, rental {rental.id}")
+    return {
+        "success": True,
+        "message": "Rental created successfully",
+        "data": {"rental_id": rental.id, "serial_number_id": serial_number_id, "end_date": end_date.isoformat()}
+    }, 200
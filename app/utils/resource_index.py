@@ -0,0 +1,230 @@
+"""
+服务器/容器依赖索引。
+
+Rental.server_ids / container_ids、ACLConfig.server_ids、DeviceBinding.container_ids 为 JSON 字段，
+按服务器或容器反查依赖记录需要扫描并解析每一行。这里把其中的 ID 同步写入带索引的关联表
+（rental_servers、rental_containers、acl_config_servers、device_binding_containers），
+故障切换时按服务器/容器查询依赖只需一次索引查找。
+
+会话 flush 时自动同步：新建或修改了上述 JSON 字段的记录会重写其索引行，删除的记录同时删除索引行
+（直接执行的 Core UPDATE/DELETE 不经过会话事件，删除时由外键 ON DELETE CASCADE 清理）。
+
+用法：
+    python -m app.utils.resource_index --backfill   # 从 JSON 字段重建全部索引行（首次部署时执行）
+"""
+import argparse
+import json
+import logging
+from sqlalchemy import event, delete, insert, inspect, select
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+_index_registered = False
+
+
+def _index_specs():
+    """
+    索引定义：[(模型, JSON 字段名, 索引表, 记录 ID 列名, 服务器/容器 ID 列名)]
+    """
+    from app.models import (Rental, ACLConfig, DeviceBinding, rental_servers, rental_containers,
+                            acl_config_servers, device_binding_containers)
+
+    return [
+        (Rental, "server_ids", rental_servers, "rental_id", "server_id"),
+        (Rental, "container_ids", rental_containers, "rental_id", "container_id"),
+        (ACLConfig, "server_ids", acl_config_servers, "acl_config_id", "server_id"),
+        (DeviceBinding, "container_ids", device_binding_containers, "device_binding_id", "container_id"),
+    ]
+
+
+def parse_ids(value):
+    """
+    解析 JSON 字段中的 ID 列表
+    字段可能是列表、JSON 字符串（部分接口以 json.dumps 写入）或默认值 {}
+    :return: 去重后的整数 ID 列表
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    if not isinstance(value, (list, tuple)):
+        return []
+    ids = set()
+    for item in value:
+        try:
+            ids.add(int(item))
+        except (TypeError, ValueError):
+            continue
+    return sorted(ids)
+
+
+def _rewrite(connection, table, owner_column, target_column, targets_by_owner):
+    """
+    重写一批记录的索引行
+    :param targets_by_owner: {记录 ID: [服务器/容器 ID]}
+    """
+    if not targets_by_owner:
+        return
+    connection.execute(delete(table).where(table.c[owner_column].in_(list(targets_by_owner))))
+    rows = [
+        {owner_column: owner_id, target_column: target_id}
+        for owner_id, target_ids in targets_by_owner.items() for target_id in target_ids
+    ]
+    if rows:
+        connection.execute(insert(table), rows)
+
+
+def _sync_flushed(session, flush_context):
+    """
+    flush 后重写 JSON 字段发生变化的记录的索引行（与本次 flush 在同一事务中）
+    """
+    changes = {}
+    for model, field, table, owner_column, target_column in _index_specs():
+        targets_by_owner = {}
+        for obj in list(session.new) + list(session.dirty):
+            if type(obj) is not model:
+                continue
+            if obj not in session.new and not inspect(obj).attrs[field].history.has_changes():
+                continue
+            targets_by_owner[obj.id] = parse_ids(getattr(obj, field))
+        for obj in session.deleted:
+            if type(obj) is model:
+                targets_by_owner[obj.id] = []
+        if targets_by_owner:
+            changes[table.name] = (table, owner_column, target_column, targets_by_owner)
+
+    if changes:
+        connection = session.connection()
+        for table, owner_column, target_column, targets_by_owner in changes.values():
+            _rewrite(connection, table, owner_column, target_column, targets_by_owner)
+
+
+def register_resource_index():
+    """
+    注册会话事件，使 JSON 字段的修改在 flush 时同步到索引表
+    """
+    global _index_registered
+    if _index_registered:
+        return
+    event.listen(Session, "after_flush", _sync_flushed)
+    _index_registered = True
+
+
+def backfill_resource_index(batch_size=None):
+    """
+    从 JSON 字段重建全部索引行，按主键分批读取，每批单独提交；可重复执行
+    :return: {索引表名: 写入的行数}
+    """
+    from app import db
+
+    batch_size = batch_size or BACKFILL_BATCH_SIZE
+    totals = {}
+    for model, field, table, owner_column, target_column in _index_specs():
+        totals[table.name] = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(model.id, getattr(model, field))
+                .where(model.id > last_id).order_by(model.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            targets_by_owner = {owner_id: parse_ids(value) for owner_id, value in rows}
+            try:
+                _rewrite(db.session.connection(), table, owner_column, target_column, targets_by_owner)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            totals[table.name] += sum(len(target_ids) for target_ids in targets_by_owner.values())
+            last_id = rows[-1][0]
+    logger.info(f"Resource index backfilled: {totals}")
+    return totals
+
+
+def find_server_dependents(server_id, active_only=True):
+    """
+    查询依赖指定服务器的租赁和 ACL 配置（索引查找）
+    :param active_only: 只返回有效的记录
+    :return: {"rentals": [...], "acl_configs": [...]}
+    """
+    from app import db
+    from app.models import Rental, ACLConfig, rental_servers, acl_config_servers
+
+    rentals = select(Rental.id, Rental.user_id, Rental.status, Rental.end_date).join(
+        rental_servers, rental_servers.c.rental_id == Rental.id
+    ).where(rental_servers.c.server_id == server_id).order_by(Rental.id)
+    acl_configs = select(ACLConfig.id, ACLConfig.user_id, ACLConfig.version, ACLConfig.is_active).join(
+        acl_config_servers, acl_config_servers.c.acl_config_id == ACLConfig.id
+    ).where(acl_config_servers.c.server_id == server_id).order_by(ACLConfig.id)
+    if active_only:
+        rentals = rentals.where(Rental.status == 'active')
+        acl_configs = acl_configs.where(ACLConfig.is_active.is_(True))
+
+    return {
+        "rentals": [
+            {"id": row.id, "user_id": row.user_id, "status": row.status,
+             "end_date": row.end_date.isoformat() if row.end_date else None}
+            for row in db.session.execute(rentals)
+        ],
+        "acl_configs": [
+            {"id": row.id, "user_id": row.user_id, "version": row.version, "is_active": row.is_active}
+            for row in db.session.execute(acl_configs)
+        ]
+    }
+
+
+def find_container_dependents(container_id, active_only=True):
+    """
+    查询依赖指定容器的租赁和设备绑定（索引查找）
+    :param active_only: 只返回有效的记录
+    :return: {"rentals": [...], "device_bindings": [...]}
+    """
+    from app import db
+    from app.models import Rental, DeviceBinding, rental_containers, device_binding_containers
+
+    rentals = select(Rental.id, Rental.user_id, Rental.status, Rental.end_date).join(
+        rental_containers, rental_containers.c.rental_id == Rental.id
+    ).where(rental_containers.c.container_id == container_id).order_by(Rental.id)
+    bindings = select(DeviceBinding.id, DeviceBinding.user_id, DeviceBinding.acl_id, DeviceBinding.status).join(
+        device_binding_containers, device_binding_containers.c.device_binding_id == DeviceBinding.id
+    ).where(device_binding_containers.c.container_id == container_id).order_by(DeviceBinding.id)
+    if active_only:
+        rentals = rentals.where(Rental.status == 'active')
+        bindings = bindings.where(DeviceBinding.status == 'active')
+
+    return {
+        "rentals": [
+            {"id": row.id, "user_id": row.user_id, "status": row.status,
+             "end_date": row.end_date.isoformat() if row.end_date else None}
+            for row in db.session.execute(rentals)
+        ],
+        "device_bindings": [
+            {"id": row.id, "user_id": row.user_id, "acl_id": row.acl_id, "status": row.status}
+            for row in db.session.execute(bindings)
+        ]
+    }
+
+
+def main(argv=None):
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Server / container dependency index")
+    parser.add_argument("--backfill", action="store_true", help="rebuild all index rows from the JSON columns")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        if args.backfill:
+            print(json.dumps(backfill_resource_index(args.batch_size), indent=2))
+        else:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
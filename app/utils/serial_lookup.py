@@ -0,0 +1,270 @@
+"""
+序列号查询前置层：布隆过滤器 + 短时状态缓存。
+
+/api/serial/check 的请求（包括暴力猜测）先经过本进程内的布隆过滤器，不存在的序列号直接拒绝，
+不查询数据库；存在的序列号状态在本进程内缓存 SERIAL_STATUS_CACHE_TTL 秒。
+
+布隆过滤器由数据库中的全部序列号在后台线程构建，构建完成前查询直接回源数据库：
+- 本进程生成序列号时立即加入过滤器，并通过 Redis 广播通知其它进程重建（重建完成前其它进程回源数据库，
+  不会误拒新序列号）；
+- 删除序列号后广播重建，重建期间继续使用旧过滤器（旧过滤器只会多放行，不会误拒）；
+- 与 Redis 断线重连后，或超过 SERIAL_BLOOM_MAX_AGE 秒后也会重建。
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import redis
+from sqlalchemy import func, select
+from app.config import Config
+from app.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 共享连接池的 Redis 客户端
+redis_client = get_redis_client(decode_responses=True)
+
+CHANGED_CHANNEL = "serials:changed"
+# 广播消息带上本进程标识，本进程生成的序列号已直接加入过滤器，无需因自己的广播重建
+PROCESS_ID = uuid.uuid4().hex
+
+
+class BloomFilter:
+    """
+    布隆过滤器：k 个位置由一次 blake2b 摘要的两个 64 位整数组合得出（双重哈希）
+    每次构建使用随机密钥，外部无法构造必然误判的序列号
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(1, capacity)
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self._key = os.urandom(16)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16, key=self._key).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+_lock = threading.Lock()
+# filter: 当前过滤器；usable: 是否可以用来拒绝请求；generation: 每次收到变更递增，
+# 构建开始后又有变更时构建结果不再可用
+_bloom = {"filter": None, "usable": False, "generation": 0, "built_at": 0.0, "building": False}
+_listener = None
+
+# 序列号状态缓存：{code: (过期时间, 状态字典或 None)}
+_status_cache = OrderedDict()
+_status_lock = threading.Lock()
+
+
+def build_bloom_filter(session=None):
+    """
+    从数据库读取全部序列号构建布隆过滤器（按批流式读取）
+    容量按当前数量的两倍分配，之后新生成的序列号可直接加入而不明显升高误判率
+    """
+    from app import db
+    from app.models import SerialNumber
+
+    session = session or db.session
+    count = session.query(func.count(SerialNumber.id)).scalar() or 0
+    bloom = BloomFilter(max(count * 2, Config.SERIAL_BLOOM_MIN_CAPACITY), Config.SERIAL_BLOOM_ERROR_RATE)
+    for code in session.execute(select(SerialNumber.code).execution_options(yield_per=10000)).scalars():
+        bloom.add(code)
+    return bloom, count
+
+
+def _rebuild(app):
+    with _lock:
+        generation = _bloom["generation"]
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            from app import db
+            try:
+                bloom, count = build_bloom_filter()
+            finally:
+                db.session.remove()
+    except Exception as e:
+        logger.error(f"Failed to build serial number bloom filter: {e}")
+        with _lock:
+            _bloom["building"] = False
+        return
+
+    with _lock:
+        _bloom["building"] = False
+        if generation != _bloom["generation"]:
+            # 构建期间序列号又发生了变化，下次查询时重新构建
+            return
+        _bloom.update({"filter": bloom, "usable": True, "built_at": time.monotonic()})
+    logger.info(f"Serial number bloom filter built: {count} codes, {len(bloom.bits)} bytes, "
+                f"{bloom.hashes} hashes in {time.perf_counter() - started:.2f}s")
+
+
+def _start_rebuild():
+    from flask import current_app
+
+    with _lock:
+        if _bloom["building"]:
+            return
+        _bloom["building"] = True
+    threading.Thread(
+        target=_rebuild, args=(current_app._get_current_object(),), name="serial-bloom-builder", daemon=True
+    ).start()
+
+
+def _mark_changed(keep_usable):
+    """
+    序列号发生变化：过滤器需要重建
+    :param keep_usable: 旧过滤器是否仍可用于拒绝请求（只删除了序列号时为 True）
+    """
+    with _lock:
+        _bloom["generation"] += 1
+        if not keep_usable:
+            _bloom["usable"] = False
+        _bloom["built_at"] = 0.0
+
+
+def _listen_for_changes():
+    """
+    订阅序列号变更广播；连接断开时自动重连
+    """
+    connected = True
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANGED_CHANNEL)
+            if not connected:
+                # 断线期间的广播可能丢失，过滤器可能缺少其它进程新生成的序列号
+                _mark_changed(keep_usable=False)
+                connected = True
+            while True:
+                # 带超时轮询，避免空闲连接触发 socket_timeout
+                message = pubsub.get_message(timeout=10)
+                if not message:
+                    continue
+                origin, _, action = message["data"].partition(":")
+                if origin == PROCESS_ID and action == "added":
+                    continue
+                _mark_changed(keep_usable=(action == "deleted"))
+        except redis.RedisError as e:
+            if connected:
+                logger.warning(f"Serial number change listener disconnected: {e}")
+            connected = False
+            time.sleep(5)
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is None:
+        with _lock:
+            if _listener is None:
+                _listener = threading.Thread(target=_listen_for_changes, name="serial-change-listener", daemon=True)
+                _listener.start()
+
+
+def might_exist(code):
+    """
+    查询布隆过滤器
+    :return: False 表示序列号一定不存在；True 表示可能存在；None 表示过滤器尚未就绪（需要回源数据库）
+    """
+    _ensure_listener()
+    bloom = _bloom["filter"]
+    stale = time.monotonic() - _bloom["built_at"] > Config.SERIAL_BLOOM_MAX_AGE
+    if bloom is None or stale:
+        if stale and bloom is not None and _bloom["built_at"]:
+            # 超过最长使用时间（可能错过了变更广播），重建完成前回源数据库
+            _mark_changed(keep_usable=False)
+        _start_rebuild()
+    if bloom is None or not _bloom["usable"]:
+        return None
+    return code in bloom
+
+
+def _cache_status(code, status):
+    with _status_lock:
+        _status_cache[code] = (time.monotonic() + Config.SERIAL_STATUS_CACHE_TTL, status)
+        _status_cache.move_to_end(code)
+        while len(_status_cache) > Config.SERIAL_STATUS_CACHE_SIZE:
+            _status_cache.popitem(last=False)
+
+
+def get_serial_status(code):
+    """
+    查询序列号状态：状态缓存 -> 布隆过滤器 -> 数据库
+    :return: (状态字典或 None, 来源 cache / bloom / mysql)
+    """
+    cached = _status_cache.get(code)
+    if cached and cached[0] > time.monotonic():
+        return cached[1], "cache"
+
+    if might_exist(code) is False:
+        return None, "bloom"
+
+    from app import db
+    from app.models import SerialNumber
+
+    row = db.session.query(
+        SerialNumber.code, SerialNumber.status, SerialNumber.valid_days, SerialNumber.created_at, SerialNumber.expires_at
+    ).filter(SerialNumber.code == code).first()
+    status = {
+        "serial_code": row.code,
+        "status": row.status,
+        "valid_days": row.valid_days,
+        "created_at": row.created_at,
+        "expires_at": row.expires_at
+    } if row else None
+    # 布隆过滤器误判的不存在结果同样缓存，重复猜测同一序列号不会再次查询
+    _cache_status(code, status)
+    return status, "mysql"
+
+
+def invalidate_serial_status(codes):
+    """
+    清除本进程中指定序列号的状态缓存（其它进程的缓存在 SERIAL_STATUS_CACHE_TTL 秒内过期）
+    """
+    with _status_lock:
+        for code in codes:
+            _status_cache.pop(code, None)
+
+
+def serials_added(codes):
+    """
+    新生成的序列号加入本进程的过滤器，并清除其状态缓存（可能缓存了不存在的结果）
+    """
+    with _lock:
+        bloom = _bloom["filter"]
+        if bloom is not None:
+            for code in codes:
+                bloom.add(code)
+        if _bloom["building"]:
+            # 正在构建的过滤器读取的快照可能不包含这些序列号，构建结果作废
+            _bloom["generation"] += 1
+    invalidate_serial_status(codes)
+
+
+def publish_serials_changed(action):
+    """
+    广播序列号变更，其它进程重建布隆过滤器
+    :param action: "added" 或 "deleted"
+    """
+    if action == "deleted":
+        _mark_changed(keep_usable=True)
+    try:
+        redis_client.publish(CHANGED_CHANNEL, f"{PROCESS_ID}:{action}")
+    except redis.RedisError as e:
+        # 其它进程的过滤器最多在 SERIAL_BLOOM_MAX_AGE 秒后重建
+        logger.warning(f"Failed to broadcast serial number change: {e}")
@@ -1,11 +1,38 @@
-import random
+import secrets
 import string
 import logging
+from datetime import datetime, timedelta
+import redis
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app.config import Config
 
-# 配置日志记录
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 序列号字符集
+SERIAL_ALPHABET = string.ascii_uppercase + string.digits
+# 连续多少批都没有生成新的序列号时认为可用的序列号空间已耗尽
+MAX_EMPTY_BATCHES = 5
+
+
+def random_codes(count, length, alphabet=SERIAL_ALPHABET):
+    """
+    使用 secrets 批量生成随机字符串：一次读取系统随机字节，按字符集大小拒绝采样，保证均匀分布
+    :param count: 数量
+    :param length: 每个字符串的长度
+    :return: 字符串列表（可能有重复，由调用方去重）
+    """
+    size = len(alphabet)
+    limit = 256 - 256 % size  # 大于等于 limit 的字节丢弃，避免取模偏差
+    needed = count * length
+    chars = []
+    while len(chars) < needed:
+        missing = needed - len(chars)
+        chars.extend(alphabet[b % size] for b in secrets.token_bytes(missing + missing // 8 + 16) if b < limit)
+    joined = ''.join(chars[:needed])
+    return [joined[i:i + length] for i in range(0, needed, length)]
+
+
 def generate_serial_number(length=12):
     """
     生成单个序列号
@@ -13,7 +40,7 @@ def generate_serial_number(length=12):
     :return: 随机生成的序列号
     """
     try:
-        serial_number = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+        serial_number = random_codes(1, length)[0]
         logger.info(f"Generated serial number: {serial_number}")
         return serial_number
     except Exception as e:
@@ -29,9 +56,94 @@ def generate_bulk_serial_numbers(count, length=12):
     :return: 序列号列表
     """
     try:
-        serial_numbers = [generate_serial_number(length) for _ in range(count)]
+        serial_numbers = random_codes(count, length)
         logger.info(f"Generated {count} serial numbers successfully.")
         return serial_numbers
     except Exception as e:
         logger.error(f"Error generating bulk serial numbers: {str(e)}")
         return []
+
+
+def create_serial_numbers(count, valid_days, prefix='', length=6, batch_size=None, distributor_id=None):
+    """
+    批量生成并写入序列号，按批生成、按批提交，每批：
+    1. 用 secrets 生成一批候选序列号并去重
+    2. 一条 SELECT ... WHERE code IN (...) 排除数据库中已存在的序列号
+    3. 一条批量 INSERT 写入；与并发生成的序列号冲突时（唯一索引报错）整批重新生成
+    4. 提交后查询本批 ID，写入到期调度集合（批量 INSERT 不经过会话的到期跟踪事件）
+    :param count: 生成的序列号数量
+    :param valid_days: 有效天数
+    :param prefix: 序列号前缀
+    :param length: 随机部分的长度
+    :param batch_size: 每批数量，默认 Config.SERIAL_GENERATE_BATCH_SIZE
+    :param distributor_id: 分销商 ID（可选）
+    :return: 生成器，逐批返回已提交的序列号列表
+    :raises ValueError: 可用的序列号空间已耗尽
+    """
+    from app import db
+    from app.models import SerialNumber
+    from app.utils.serial_lookup import serials_added, publish_serials_changed
+    from app.utils.expiry_scheduler import schedule_expiries
+
+    batch_size = batch_size or Config.SERIAL_GENERATE_BATCH_SIZE
+    remaining = count
+    empty_batches = 0
+    try:
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            # 多生成少量候选，抵消批内重复和已存在的序列号
+            candidates = list(dict.fromkeys(prefix + code for code in random_codes(size + size // 100 + 1, length)))
+            existing = {
+                code for code, in db.session.query(SerialNumber.code).filter(SerialNumber.code.in_(candidates))
+            }
+            codes = [code for code in candidates if code not in existing][:size]
+            if not codes:
+                empty_batches += 1
+                if empty_batches >= MAX_EMPTY_BATCHES:
+                    raise ValueError(f"Serial number space exhausted for prefix '{prefix}' and length {length}")
+                continue
+
+            now = datetime.utcnow()
+            expires_at = now + timedelta(days=valid_days)
+            try:
+                db.session.execute(insert(SerialNumber), [
+                    {
+                        "code": code,
+                        "valid_days": valid_days,
+                        "status": "unused",
+                        "activated_at": now,
+                        "expires_at": expires_at,
+                        "distributor_id": distributor_id,
+                        "created_at": now,
+                        "updated_at": now
+                    }
+                    for code in codes
+                ])
+                db.session.commit()
+            except IntegrityError:
+                # 检查之后有并发请求写入了相同的序列号，整批重新生成
+                db.session.rollback()
+                empty_batches += 1
+                if empty_batches >= MAX_EMPTY_BATCHES:
+                    raise
+                logger.warning(f"Serial number collision while inserting a batch of {len(codes)}, retrying")
+                continue
+
+            # 新序列号加入本进程的布隆过滤器
+            serials_added(codes)
+            try:
+                ids = [serial_id for serial_id, in db.session.query(SerialNumber.id).filter(SerialNumber.code.in_(codes))]
+                db.session.commit()
+                schedule_expiries([("serial", serial_id, expires_at) for serial_id in ids])
+            except redis.RedisError as e:
+                # 调度集合未同步时，序列号仍会在重建调度集合后按时过期
+                logger.warning(f"Failed to schedule expiry for {len(codes)} serial number(s): {e}")
+            empty_batches = 0
+            remaining -= len(codes)
+            yield codes
+    finally:
+        # 通知其它进程重建布隆过滤器（中途出错时已提交的批次同样需要通知）
+        if remaining < count:
+            publish_serials_changed("added")
+
+    logger.info(f"Generated {count} serial numbers with prefix '{prefix}'")
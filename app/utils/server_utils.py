@@ -1,56 +1,210 @@
+import asyncio
 import logging
-import subprocess
-from app.models import Server
+import re
+import time
+from datetime import datetime
+from sqlalchemy import func, insert
+from app import db
+from app.config import Config
+from app.models import Server, DockerContainer, ServerPerformanceMonitoring
+from app.utils.metrics_store import record_samples
+from app.utils.alert_utils import alert_engine
 
-# 配置日志记录
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ping 输出解析：发送/接收包数与 rtt min/avg/max
+PING_PACKETS_RE = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received')
+PING_RTT_RE = re.compile(r'= ([\d.]+)/([\d.]+)/([\d.]+)')
+
+
+def _summarize_probe(method, sent, rtts, error=""):
+    """
+    汇总一次探测的结果
+    :param method: 探测方式（icmp 或 tcp）
+    :param sent: 发送的探测次数
+    :param rtts: 成功探测的往返时延列表（毫秒）
+    :param error: 最后一次失败的错误信息
+    :return: 探测结果字典
+    """
+    received = len(rtts)
+    return {
+        "status": "reachable" if received else "unreachable",
+        "method": method,
+        "sent": sent,
+        "received": received,
+        "loss": round((sent - received) * 100 / sent, 2) if sent else 100.0,
+        "rtt_min": round(min(rtts), 3) if rtts else None,
+        "rtt_avg": round(sum(rtts) / received, 3) if rtts else None,
+        "rtt_max": round(max(rtts), 3) if rtts else None,
+        "error": "" if received else error
+    }
+
+
+async def _icmp_probe(ip_address, count, timeout):
+    """
+    使用系统 ping 发送 ICMP 探测（异步子进程，不阻塞其它探测）
+    :return: 探测结果字典；ICMP 不可用或没有任何回包时返回 None，由调用方回退到 TCP 探测
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            'ping', '-n', '-q', '-c', str(count), '-i', '0.2', '-W', str(max(1, int(timeout))), ip_address,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    except (FileNotFoundError, PermissionError) as e:
+        logger.debug(f"ICMP probe unavailable for {ip_address}: {e}")
+        return None
+
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=count * 0.2 + timeout + 1)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+
+    output = stdout.decode('utf-8', errors='ignore')
+    packets = PING_PACKETS_RE.search(output)
+    if proc.returncode != 0 or not packets or int(packets.group(2)) == 0:
+        # returncode 2 表示无权限/解析失败，1 表示没有回包（可能被防火墙过滤 ICMP）
+        return None
+
+    sent, received = int(packets.group(1)), int(packets.group(2))
+    rtt = PING_RTT_RE.search(output)
+    rtt_min, rtt_avg, rtt_max = [float(v) for v in rtt.groups()] if rtt else (None, None, None)
+    return {
+        "status": "reachable",
+        "method": "icmp",
+        "sent": sent,
+        "received": received,
+        "loss": round((sent - received) * 100 / sent, 2),
+        "rtt_min": rtt_min,
+        "rtt_avg": rtt_avg,
+        "rtt_max": rtt_max,
+        "error": ""
+    }
+
+
+async def _tcp_probe(ip_address, port, count, timeout):
+    """
+    通过 TCP 连接 DERP 端口测量往返时延（ICMP 不可用时的回退方式）
+    """
+    rtts = []
+    error = ""
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout=timeout)
+            rtts.append((time.perf_counter() - start) * 1000)
+            writer.close()
+        except (OSError, asyncio.TimeoutError) as e:
+            error = str(e) or type(e).__name__
+    return _summarize_probe("tcp", count, rtts, error)
+
+
+async def probe_server(ip_address, port=None, count=None, timeout=None):
+    """
+    探测单台服务器的可达性：优先 ICMP，不允许或无回包时回退到 TCP 连接 DERP 端口
+    :param ip_address: 服务器 IP 地址
+    :param port: TCP 回退时连接的端口，默认 Config.DERP_PORT
+    :param count: 探测包数量，默认 Config.PROBE_COUNT
+    :param timeout: 单次探测超时时间（秒），默认 Config.PROBE_TIMEOUT
+    :return: 探测结果字典（status、method、loss、rtt_min/avg/max 等）
+    """
+    count = count or Config.PROBE_COUNT
+    timeout = timeout or Config.PROBE_TIMEOUT
+    result = await _icmp_probe(ip_address, count, timeout)
+    if result is None:
+        result = await _tcp_probe(ip_address, port or Config.DERP_PORT, count, timeout)
+    return result
+
+
+async def probe_servers(targets, count=None, timeout=None, concurrency=None):
+    """
+    并发探测多台服务器
+    :param targets: (server_id, ip_address, port) 元组列表
+    :param concurrency: 同时进行的最大探测数，默认 Config.PROBE_CONCURRENCY
+    :return: {server_id: 探测结果} 字典
+    """
+    semaphore = asyncio.Semaphore(concurrency or Config.PROBE_CONCURRENCY)
+
+    async def _probe(server_id, ip_address, port):
+        async with semaphore:
+            try:
+                return server_id, await probe_server(ip_address, port, count, timeout)
+            except Exception as e:
+                return server_id, _summarize_probe("tcp", count or Config.PROBE_COUNT, [], str(e))
+
+    results = await asyncio.gather(*[_probe(*target) for target in targets])
+    return dict(results)
+
+
 def ping_server(ip_address):
     """
-    使用 ping 命令检测服务器是否可达
+    检测单台服务器是否可达
     :param ip_address: 服务器 IP 地址
     :return: 返回服务器是否可达的状态（reachable 或 unreachable）和详细错误信息
     """
     try:
-        # 执行 ping 命令
-        result = subprocess.run(
-            ['ping', '-c', '4', ip_address], 
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        
-        if result.returncode == 0:
-            return "reachable", ""
-        else:
-            return "unreachable", result.stderr
+        result = asyncio.run(probe_server(ip_address))
+        return result["status"], result["error"]
     except Exception as e:
         return "unreachable", str(e)
 
-def monitor_server_health():
+
+def monitor_server_health(count=None, timeout=None, concurrency=None):
     """
-    批量监控所有服务器健康状态，使用 ping 检测
+    批量并发监控所有服务器健康状态，结果批量写入 ServerPerformanceMonitoring
+    :param count: 每台服务器的探测包数量
+    :param timeout: 单次探测超时时间（秒）
+    :param concurrency: 最大并发探测数
     :return: 服务器健康状态的列表
     """
-    results = []
-
     try:
-        servers = Server.query.all()  # 查询所有服务器
+        servers = Server.query.with_entities(Server.id, Server.ip_address).all()  # 查询所有服务器
         if not servers:
             logger.warning("No servers found for health check.")
             return {"success": False, "message": "No servers found for health check."}
 
+        # 每台服务器取一个 DERP 容器端口作为 TCP 回退端口（一次分组查询）
+        derp_ports = dict(
+            db.session.query(DockerContainer.server_id, func.min(DockerContainer.port))
+            .filter(DockerContainer.port.isnot(None))
+            .group_by(DockerContainer.server_id)
+            .all()
+        )
+        targets = [(server.id, server.ip_address, derp_ports.get(server.id)) for server in servers]
+
+        started = time.perf_counter()
+        probe_results = asyncio.run(probe_servers(targets, count, timeout, concurrency))
+        logger.info(f"Probed {len(targets)} servers in {time.perf_counter() - started:.2f}s")
+
+        now = datetime.utcnow()
+        results = []
+        performance_rows = []
+        metric_samples = []
         for server in servers:
-            # 使用 ping 检测服务器是否可达
-            status, error = ping_server(server.ip_address)
+            probe = probe_results[server.id]
             results.append({
                 "server_id": server.id,
                 "ip_address": server.ip_address,
-                "status": {"status": status, "error": error if status == "unreachable" else ""}
+                "status": {"status": probe["status"], "error": probe["error"]},
+                "probe": probe
             })
-            logger.info(f"Server {server.ip_address} status: {status}")
+            performance_rows.append({
+                "server_id": server.id,
+                "network_latency": probe["rtt_avg"],
+                "timestamp": now
+            })
+            metric_samples.append((server.id, now, {"rtt_avg": probe["rtt_avg"], "packet_loss": probe["loss"]}))
+
+        # 批量写入探测结果（同一事务内写入指标表与触发的告警）
+        db.session.execute(insert(ServerPerformanceMonitoring), performance_rows)
+        record_samples(metric_samples, commit=False)
+        alert_engine.evaluate_samples(metric_samples, commit=False)
+        db.session.commit()
 
         return {"success": True, "data": results}
 
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error monitoring server health: {str(e)}")
         return {"success": False, "message": f"Error monitoring server health: {str(e)}"}
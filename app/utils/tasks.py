@@ -1,50 +1,13 @@
 from app import db
-from app.models import User, UserHistory, ACLLog
+from app.models import UserHistory, ACLLog, Rental, DockerContainer, UserTraffic, SystemLog
 from datetime import datetime, timedelta
 import logging
-from app.utils.docker_utils import stop_container
+import time
+from sqlalchemy import insert, update, delete
+from app.config import Config
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def release_expired_resources():
-    """
-    定期检查到期用户并释放资源
-    """
-    try:
-        now = datetime.utcnow()
-        # 查询所有到期的用户
-        expired_users = User.query.filter(User.rental_expiry < now).all()
-
-        if not expired_users:
-            logger.info("No expired resources found.")
-            return
-
-        for user in expired_users:
-            for container in user.containers:
-                container_name = f"container_{user.id}_{container.server_id}"
-                # 停止容器
-                stop_container(container_name)
-                db.session.delete(container)  # 删除容器
-
-            # 创建用户历史记录
-            history = UserHistory(
-                user_id=user.id,
-                rental_start=user.created_at,
-                rental_end=user.rental_expiry,
-                total_traffic=sum(container.upload_traffic + container.download_traffic for container in user.containers)
-            )
-            db.session.add(history)  # 添加历史记录
-            db.session.delete(user)  # 删除用户
-
-        db.session.commit()  # 提交数据库事务
-        logger.info("Expired resources released successfully.")
-    except Exception as e:
-        db.session.rollback()  # 回滚事务
-        logger.error(f"Error releasing expired resources: {e}")
-        logger.error(e, exc_info=True)
-
 def regenerate_expired_acl():
     """
     定期检查 ACL 配置到期并重新生成
@@ -68,3 +31,115 @@ def regenerate_expired_acl():
         db.session.rollback()  # 回滚事务
         logger.error(f"Error regenerating expired ACLs: {e}")
         logger.error(e, exc_info=True)
+
+
+def _expire_rental_rows(rows, now):
+    """
+    把一批租赁标记为过期并释放资源（不提交）
+    :param rows: (id, user_id) 行列表，调用方已确认其到期
+    :return: 释放资源的用户数
+    """
+    rental_ids = [row.id for row in rows]
+    user_ids = {row.user_id for row in rows if row.user_id is not None}
+    db.session.execute(
+        update(Rental)
+        .where(Rental.id.in_(rental_ids), Rental.status == 'active')
+        .values(status='expired', expired_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+    # 仍有其它有效租赁（例如已续费）的用户保留资源
+    still_active = {
+        user_id for user_id, in db.session.query(Rental.user_id).filter(
+            Rental.user_id.in_(user_ids),
+            Rental.status == 'active',
+            Rental.end_date >= now
+        ).distinct()
+    } if user_ids else set()
+    release_ids = list(user_ids - still_active)
+
+    if release_ids:
+        for model in (DockerContainer, UserTraffic, UserHistory):
+            db.session.execute(
+                delete(model).where(model.user_id.in_(release_ids)).execution_options(synchronize_session=False)
+            )
+
+    db.session.execute(insert(SystemLog), [
+        {
+            "level": "info",
+            "module": "rental",
+            "operation": "rental_expiry",
+            "user_id": row.user_id,
+            "message": f"Rental {row.id} expired",
+            "details": f"Rental expired for user {row.user_id} and resources released",
+            "created_at": now
+        }
+        for row in rows
+    ])
+    return len(release_ids)
+
+
+def expire_rentals(rental_ids, now=None):
+    """
+    处理指定的租赁：只有仍为 active 且确实已到期的租赁会被标记过期（已续费的自动跳过）
+    正被其他事务锁定的租赁同样跳过（skip_locked），由调用方稍后重试
+    :param rental_ids: 租赁 ID 列表
+    :return: 实际过期的租赁数
+    """
+    now = now or datetime.utcnow()
+    rows = db.session.query(Rental.id, Rental.user_id).filter(
+        Rental.id.in_(rental_ids),
+        Rental.status == 'active',
+        Rental.end_date <= now
+    ).order_by(Rental.id).with_for_update(skip_locked=True).all()
+    if rows:
+        _expire_rental_rows(rows, now)
+    db.session.commit()
+    return len(rows)
+
+
+def process_expired_rentals(batch_size=None, max_batches=None, after_id=0, now=None):
+    """
+    分批处理到期租赁：每批用一条 UPDATE ... WHERE id IN 标记过期，批量删除相关容器、
+    流量与历史记录，批量写入操作日志，并单独提交
+    已处理的租赁状态变为 expired，不会被再次选中，因此中断后重新执行即可从剩余部分继续；
+    也可以传入上次返回的 last_id 跳过已检查过的区间
+    :param batch_size: 每批处理的租赁数，默认 Config.RENTAL_EXPIRY_BATCH_SIZE
+    :param max_batches: 最多处理的批数，None 表示处理完为止
+    :param after_id: 只处理 ID 大于该值的租赁
+    :param now: 到期判断时间，默认当前时间（整个运行过程中保持不变）
+    :return: {"processed", "released_users", "batches", "last_id", "done", "seconds", "per_second"}
+    """
+    batch_size = batch_size or Config.RENTAL_EXPIRY_BATCH_SIZE
+    now = now or datetime.utcnow()
+    started = time.perf_counter()
+    stats = {"processed": 0, "released_users": 0, "batches": 0, "last_id": after_id, "done": False}
+
+    while max_batches is None or stats["batches"] < max_batches:
+        rows = db.session.query(Rental.id, Rental.user_id).filter(
+            Rental.status == 'active',
+            Rental.end_date < now,
+            Rental.id > stats["last_id"]
+        ).order_by(Rental.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not rows:
+            stats["done"] = True
+            break
+
+        try:
+            release_count = _expire_rental_rows(rows, now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.error(f"Error processing expired rentals after id {stats['last_id']}", exc_info=True)
+            raise
+
+        stats["processed"] += len(rows)
+        stats["released_users"] += release_count
+        stats["batches"] += 1
+        stats["last_id"] = rows[-1].id
+
+    stats["seconds"] = round(time.perf_counter() - started, 4)
+    stats["per_second"] = round(stats["processed"] / stats["seconds"], 1) if stats["seconds"] else None
+    logger.info(f"Processed {stats['processed']} expired rentals in {stats['batches']} batches "
+                f"({stats['per_second']}/s), last id {stats['last_id']}")
+    return stats
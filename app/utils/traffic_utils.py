@@ -1,8 +1,13 @@
 import random
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from celery import shared_task
+from app.config import Config
+from app.models import DockerContainer
+from app.utils.event_utils import publish_event, redis_client
+from app.utils.metrics_proxy import fetch_metrics
 
-# 配置日志记录
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 模拟实时流量统计
@@ -44,3 +49,129 @@ def detect_abnormal_traffic(user_id):
     except Exception as e:
         logger.error(f"Error detecting abnormal traffic for user {user_id}: {e}")
         return {"abnormal": False, "details": {"error": "Failed to detect abnormal traffic"}}
+
+
+# 从容器名称提取 IP 地址
+def extract_ip_from_container_name(container_name):
+    """
+    从容器名称中提取 IP 地址，假设容器名称格式为 "120_79_137_248_derper_4"
+    :param container_name: 容器名称
+    :return: IP 地址，格式不正确时返回 None
+    """
+    parts = container_name.split('_')
+    if len(parts) >= 4:  # 确保容器名称包含 IP 地址
+        return '.'.join(parts[:4])
+    return None
+
+
+# 从 metrics 提取流量数据
+def fetch_traffic_metrics(url):
+    """
+    抓取 node exporter 指标并解析 eth0 的上传/下载累计字节数。
+    :param url: exporter 的 /metrics 地址
+    :return: {"upload_traffic", "download_traffic"}，失败时返回 None
+    """
+    try:
+        # 复用到 exporter 的 keep-alive 连接；流量增量按采集时刻计算，不读缓存
+        body = fetch_metrics(url, max_age=0).decode('utf-8', errors='replace')
+        metrics = {}
+
+        for line in body.splitlines():
+            # 解析 eth0 设备的上传流量
+            if "node_network_transmit_bytes_total" in line:
+                if 'eth0' in line:
+                    metrics["upload_traffic"] = float(line.split(" ")[1])
+
+            # 解析 eth0 设备的下载流量
+            elif "node_network_receive_bytes_total" in line:
+                if 'eth0' in line:
+                    metrics["download_traffic"] = float(line.split(" ")[1])
+
+        if "upload_traffic" in metrics and "download_traffic" in metrics:
+            return metrics
+        logger.error("Could not extract traffic data from metrics.")
+        return None
+
+    except Exception as e:
+        logger.error(f"Error fetching metrics from {url}: {str(e)}")
+        return None
+
+
+# 上一次采集的容器流量计数器（Redis 哈希：容器 ID -> "upload download timestamp"）
+TRAFFIC_COUNTERS_KEY = "traffic:last_counters"
+
+
+def collect_realtime_traffic(concurrency=None):
+    """
+    采集所有容器的实时流量，计算与上一次采集之间的增量并发布 traffic 事件。
+    由 collect_realtime_traffic_task 周期调用，所有仪表盘共享同一次采集结果（通过 /api/events/stream 推送），不再各自轮询抓取 exporter。
+    :param concurrency: 最大并发抓取数，默认 Config.TRAFFIC_COLLECT_CONCURRENCY
+    :return: 发布的事件数量
+    """
+    try:
+        containers = DockerContainer.query.with_entities(
+            DockerContainer.id, DockerContainer.server_id, DockerContainer.container_name, DockerContainer.node_exporter_port
+        ).all()
+        targets = []
+        for container in containers:
+            server_ip = extract_ip_from_container_name(container.container_name or "")
+            if server_ip and container.node_exporter_port:
+                targets.append((container, f"http://{server_ip}:{container.node_exporter_port}/metrics"))
+        if not targets:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=concurrency or Config.TRAFFIC_COLLECT_CONCURRENCY) as executor:
+            results = list(executor.map(lambda target: fetch_traffic_metrics(target[1]), targets))
+
+        now = time.time()
+        previous = redis_client.hgetall(TRAFFIC_COUNTERS_KEY)
+        counters = {}
+        published = 0
+        for (container, _), metrics in zip(targets, results):
+            if not metrics:
+                continue
+            upload, download = metrics["upload_traffic"], metrics["download_traffic"]
+            counters[container.id] = f"{upload} {download} {now}"
+
+            event = {
+                "container_id": container.id,
+                "server_id": container.server_id,
+                "upload_traffic": upload,
+                "download_traffic": download,
+                "upload_delta": None,
+                "download_delta": None,
+                "upload_rate": None,
+                "download_rate": None,
+                "timestamp": now
+            }
+            last = previous.get(str(container.id))
+            if last:
+                last_upload, last_download, last_ts = (float(value) for value in last.split())
+                elapsed = now - last_ts
+                # 计数器回绕或容器重建时不计算增量
+                if elapsed > 0 and upload >= last_upload and download >= last_download:
+                    event.update({
+                        "upload_delta": upload - last_upload,
+                        "download_delta": download - last_download,
+                        "upload_rate": round((upload - last_upload) / elapsed, 2),
+                        "download_rate": round((download - last_download) / elapsed, 2)
+                    })
+            if publish_event("traffic", event):
+                published += 1
+
+        if counters:
+            redis_client.hset(TRAFFIC_COUNTERS_KEY, mapping=counters)
+        logger.info(f"Published realtime traffic for {published}/{len(targets)} containers")
+        return published
+    except Exception as e:
+        logger.error(f"Error collecting realtime traffic: {e}")
+        return 0
+
+
+@shared_task(name="traffic.collect_realtime", ignore_result=True)
+def collect_realtime_traffic_task():
+    """
+    Celery 周期任务：由 celery beat 每 Config.TRAFFIC_PUSH_INTERVAL 秒调度一次（见 make_celery 中的 CELERYBEAT_SCHEDULE）。
+    :return: 发布的事件数量
+    """
+    return collect_realtime_traffic()
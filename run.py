@@ -7,9 +7,8 @@ app.config['SQLALCHEMY_ECHO'] = True  # 启用 SQL 语句的日志输出
 
 # 启动应用程序
 if __name__ == "__main__":
-    # 建议添加日志记录功能
+    # 日志已在 create_app 中统一配置
     import logging
-    logging.basicConfig(level=logging.INFO)
     logging.info("Starting the application...")
 
     # 确保数据库表创建